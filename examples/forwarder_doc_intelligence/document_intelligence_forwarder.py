@@ -4,12 +4,13 @@ import os
 
 import fastapi
 from fastapi.datastructures import URL
-import requests
+import httpx
 
 
 from aoai_api_simulator import constants
 from aoai_api_simulator.auth import validate_api_key_header
 from aoai_api_simulator.models import RequestContext
+from aoai_api_simulator.record_replay.forwarding import forwarding_client
 
 #
 # This example shows a multi-file extension to the simulator
@@ -58,7 +59,7 @@ doc_intelligence_response_headers_to_remove = [
 
 async def forward_to_azure_document_intelligence(
     context: RequestContext,
-) -> fastapi.Response | requests.Response | dict | None:
+) -> fastapi.Response | httpx.Response | dict | None:
     request = context.request
     if not request.url.path.startswith("/formrecognizer/"):
         # assume not an Doc Intelligence request
@@ -92,14 +93,10 @@ async def forward_to_azure_document_intelligence(
     }
     fwd_headers["api-key"] = doc_intelligence_api_key
 
-    body = await request.body()
+    body = await context.body()
 
-    response = requests.request(
-        request.method,
-        url,
-        headers=fwd_headers,
-        data=body,
-    )
+    # use the simulator's pooled client so that forwarding doesn't block the event loop
+    response = await forwarding_client.request(request.method, url, headers=fwd_headers, content=body)
 
     for header in doc_intelligence_response_headers_to_remove:
         if response.headers.get(header):
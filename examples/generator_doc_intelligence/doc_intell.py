@@ -5,6 +5,7 @@ import random
 import uuid
 
 from aoai_api_simulator.auth import validate_api_key_header
+from aoai_api_simulator.clock import simulator_clock
 from aoai_api_simulator.constants import SIMULATOR_KEY_LIMITER
 from aoai_api_simulator.generator.lorem import raw_lorem_get_word
 from aoai_api_simulator.models import RequestContext
@@ -91,6 +92,8 @@ async def doc_intelligence_analyze(context: RequestContext) -> Response | None:
         "features": features,
         "content_length": int(content_length),
         "submitted_at": datetime.datetime.now(),
+        # the processing time is measured in simulated time (the timestamps returned to the client use real time)
+        "submitted_perf_counter": simulator_clock.perf_counter(),
     }
 
     # Return the response
@@ -119,17 +122,16 @@ async def doc_intelligence_analyze_result(context: RequestContext) -> Response |
         return Response(status_code=404)
 
     # Simulate latency between submission and generating a response
-    now = datetime.datetime.now()
     duration_s = get_wait_time_for_result(doc_config["content_length"])
-    ready_at = doc_config["submitted_at"] + datetime.timedelta(seconds=duration_s)
-    if now < ready_at:
+    elapsed_s = simulator_clock.perf_counter() - doc_config["submitted_perf_counter"]
+    if elapsed_s < duration_s:
         return Response(
             status_code=200,
             content=json.dumps(
                 {
                     "status": "running",
                     "createdDateTime": doc_config["submitted_at"],
-                    "lastUpdatedDateTime": now,
+                    "lastUpdatedDateTime": datetime.datetime.now(),
                 },
                 default=datetime_handler,
             ),
@@ -23,5 +23,5 @@ async def generate_echo_response(context: RequestContext) -> Response | None:
     # This validates the "api-key" header in the request against the configured API key
     validate_api_key_header(request=request, header_name="api-key", allowed_key_value=context.config.simulator_api_key)
 
-    request_body = await request.body()
+    request_body = await context.body()
     return Response(content=f"Echo: {request_body.decode("utf-8")}", status_code=200)
@@ -47,7 +47,7 @@ async def custom_azure_openai_chat_completion(context: RequestContext) -> Respon
     # This validates the "api-key" header in the request against the configured API key
     validate_api_key_header(request=request, header_name="api-key", allowed_key_value=context.config.simulator_api_key)
 
-    request_body = await request.json()
+    request_body = await context.json()
     deployment_name = path_params["deployment"]
     model = get_chat_model_from_deployment_name(context, deployment_name)
     if model is None:
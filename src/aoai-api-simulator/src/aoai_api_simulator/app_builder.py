@@ -1,33 +1,86 @@
+import dataclasses
 import logging
+from contextlib import asynccontextmanager
 import re
 import traceback
 from typing import Annotated
 
+from aoai_api_simulator import constants
 from aoai_api_simulator.auth import validate_api_key_header
 from aoai_api_simulator.config_loader import get_config, set_config
+from aoai_api_simulator.generator.lorem_cache import lorem_warm_up
+from aoai_api_simulator.generator.openai import get_lorem_model_names
 from aoai_api_simulator.generator.manager import invoke_generators
 from aoai_api_simulator.latency import LatencyGenerator
-from aoai_api_simulator.limiters import apply_limits
+from aoai_api_simulator.limiters import apply_limits, apply_pre_limits, settle_limits
 from aoai_api_simulator.models import RequestContext
+from aoai_api_simulator.record_replay.forwarding import forwarding_client
 from aoai_api_simulator.record_replay.handler import RecordReplayHandler
-from aoai_api_simulator.record_replay.persistence import YamlRecordingPersister
+from aoai_api_simulator.record_replay.indexed_persistence import IndexedRecordingPersister
+from aoai_api_simulator.record_replay.persistence import RecordingPersister, YamlRecordingPersister
+from aoai_api_simulator.record_replay.sqlite_persistence import SqliteRecordingPersister
 from fastapi import Depends, FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
 
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    # pylint: disable-next=global-statement
+    global record_replay_handler, record_replay_settings
+
+    yield
+    if record_replay_handler:
+        record_replay_handler.shutdown()
+        record_replay_handler = None
+        record_replay_settings = None
+    # close the pooled connections used to forward requests in record mode
+    await forwarding_client.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 repeated_quotes = re.compile(r"//+")
 
 # pylint: disable-next=invalid-name
 record_replay_handler = None
+# the settings that record_replay_handler was created with (see _get_record_replay_settings)
+# pylint: disable-next=invalid-name
+record_replay_settings = None
+
+
+def _get_record_replay_settings() -> tuple | None:
+    """
+    Returns the settings that the record/replay handler depends on (or None if not in record/replay mode)
+    """
+    config = get_config()
+    if config.simulator_mode not in ["record", "replay"]:
+        return None
+    recording = config.recording
+    return (
+        config.simulator_mode,
+        recording.dir,
+        recording.format,
+        recording.autosave,
+        recording.deduplicate_bodies,
+        tuple(recording.forwarders or []),
+    )
 
 
 def apply_config():
     # pylint: disable-next=global-statement
-    global record_replay_handler
-
-    record_replay_handler = None
+    global record_replay_handler, record_replay_settings
+
+    # Only replace the handler when the recording settings change so that other config changes
+    # (e.g. rate-limits) don't save all the recordings and discard the loaded recordings
+    new_record_replay_settings = _get_record_replay_settings()
+    if new_record_replay_settings != record_replay_settings:
+        if record_replay_handler:
+            # save any journalled recordings before replacing the handler
+            record_replay_handler.shutdown()
+        record_replay_handler = None
+        record_replay_settings = new_record_replay_settings
 
     logger.info("🚀 Starting aoai-api-simulator in %s mode", get_config().simulator_mode)
     logger.info("🗝️ Simulator api-key                       : %s", get_config().simulator_api_key)
@@ -35,19 +88,42 @@ def apply_config():
     if get_config().simulator_mode in ["record", "replay"]:
         logger.info("📼 Recording directory                     : %s", get_config().recording.dir)
         logger.info("📼 Recording auto-save                     : %s", get_config().recording.autosave)
-        persister = YamlRecordingPersister(get_config().recording.dir)
-
-        record_replay_handler = RecordReplayHandler(
-            simulator_mode=get_config().simulator_mode,
-            persister=persister,
-            forwarders=get_config().recording.forwarders,
-            autosave=get_config().recording.autosave,
-        )
+        logger.info("📼 Recording format                        : %s", get_config().recording.format)
+        forwarding_client.configure(get_config().recording)
+
+        if record_replay_handler is None:
+            record_replay_handler = RecordReplayHandler(
+                simulator_mode=get_config().simulator_mode,
+                persister=_create_recording_persister(),
+                forwarders=get_config().recording.forwarders,
+                autosave=get_config().recording.autosave,
+            )
     else:
         logger.info("📝 allow_undefined_openai_deployments      : %s", get_config().allow_undefined_openai_deployments)
 
     logger.info("📝 Using OpenAI deployments                : %s", get_config().openai_deployments)
     logger.info("📝 Using latencies                         : %s", get_config().latency)
+    if get_config().time_dilation != 1:
+        logger.info("⏱️ Using time dilation                     : %sx", get_config().time_dilation)
+
+    if get_config().corpus_path:
+        logger.info("📝 Generating text from corpus             : %s", get_config().corpus_path)
+
+    # build the text generation tables in the background so that the first requests aren't delayed
+    lorem_warm_up.start(
+        get_lorem_model_names(get_config().openai_deployments or {}),
+        get_config().lorem_cache_dir,
+        get_config().corpus_path,
+    )
+
+
+def _create_recording_persister() -> RecordingPersister:
+    recording = get_config().recording
+    if recording.format == constants.RECORDING_FORMAT_INDEXED:
+        return IndexedRecordingPersister(recording.dir)
+    if recording.format == constants.RECORDING_FORMAT_SQLITE:
+        return SqliteRecordingPersister(recording.dir)
+    return YamlRecordingPersister(recording.dir, deduplicate_bodies=recording.deduplicate_bodies)
 
 
 def _default_validate_api_key_header(request: Request):
@@ -70,8 +146,18 @@ async def root():
     return {"message": "👋 aoai-api-simulator is running"}
 
 
+@app.get("/++/ready")
+async def ready():
+    # Returns 503 until the background warm-up (e.g. building the lorem generation tables) has completed
+    if lorem_warm_up.is_ready:
+        return {"ready": True}
+    return JSONResponse(content={"ready": False}, status_code=503)
+
+
+# async so that saving runs on the event loop rather than a threadpool thread
+# (requests being recorded update the recordings and journals from the event loop)
 @app.post("/++/save-recordings")
-def save_recordings(_: Annotated[bool, Depends(_default_validate_api_key_header)]):
+async def save_recordings(_: Annotated[bool, Depends(_default_validate_api_key_header)]):
     if get_config().simulator_mode == "record":
         logger.info("📼 Saving recordings...")
         record_replay_handler.save_recordings()
@@ -105,6 +191,14 @@ def config_get(_: Annotated[bool, Depends(_default_validate_api_key_header)]):
                 "mean": config.latency.open_ai_translations.mean,
                 "std_dev": config.latency.open_ai_translations.std_dev,
             },
+            "open_ai_streaming_first_token": {
+                "mean": config.latency.open_ai_streaming_first_token.mean,
+                "std_dev": config.latency.open_ai_streaming_first_token.std_dev,
+            },
+            "open_ai_streaming_inter_token": {
+                "mean": config.latency.open_ai_streaming_inter_token.mean,
+                "std_dev": config.latency.open_ai_streaming_inter_token.std_dev,
+            },
         },
         "openai_deployments": (
             {
@@ -117,8 +211,20 @@ def config_get(_: Annotated[bool, Depends(_default_validate_api_key_header)]):
     }
 
 
+def _validate_deployment_update(name: str, deployment_update: dict):
+    # validate the limits here rather than failing when the limiter is applied to a request
+    if not isinstance(deployment_update, dict):
+        raise HTTPException(status_code=400, detail=f"Invalid settings for deployment: {name}")
+    for key, value in deployment_update.items():
+        if key not in ["tokens_per_minute", "requests_per_minute"]:
+            raise HTTPException(status_code=400, detail=f"Unsupported setting for deployment {name}: {key}")
+        if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+            raise HTTPException(status_code=400, detail=f"{key} for deployment {name} must be a non-negative integer")
+
+
+# async so that replacing the record/replay handler runs on the event loop (see save_recordings)
 @app.patch("/++/config")
-def config_patch(config: dict, _: Annotated[bool, Depends(_default_validate_api_key_header)]):
+async def config_patch(config: dict, _: Annotated[bool, Depends(_default_validate_api_key_header)]):
     original_config = get_config()
 
     # Config is a nested settings class to enable setting env var names on child items
@@ -142,9 +248,32 @@ def config_patch(config: dict, _: Annotated[bool, Depends(_default_validate_api_
             new_config.latency.open_ai_translations = original_config.latency.open_ai_translations.model_copy(
                 update=config["latency"]["open_ai_translations"]
             )
+        if "open_ai_streaming_first_token" in config["latency"]:
+            new_config.latency.open_ai_streaming_first_token = (
+                original_config.latency.open_ai_streaming_first_token.model_copy(
+                    update=config["latency"]["open_ai_streaming_first_token"]
+                )
+            )
+        if "open_ai_streaming_inter_token" in config["latency"]:
+            new_config.latency.open_ai_streaming_inter_token = (
+                original_config.latency.open_ai_streaming_inter_token.model_copy(
+                    update=config["latency"]["open_ai_streaming_inter_token"]
+                )
+            )
+
+    if "openai_deployments" in config:
+        # limits can be changed for existing deployments
+        deployments = dict(original_config.openai_deployments or {})
+        for name, deployment_update in config["openai_deployments"].items():
+            if name not in deployments:
+                raise HTTPException(status_code=400, detail=f"Unknown deployment: {name}")
+            _validate_deployment_update(name, deployment_update)
+            deployments[name] = dataclasses.replace(deployments[name], **deployment_update)
+        new_config.openai_deployments = deployments
 
     # Update the config and re-initialize
-    set_config(new_config)
+    # (preserving the rate-limiting state so that changing the config doesn't allow a burst of requests)
+    set_config(new_config, preserve_limiter_state=True)
     apply_config()
 
     return config_get(_)
@@ -161,18 +290,31 @@ async def catchall(request: Request):
         # LatencyGenerator adds simulated latency to response
         # and emit associated metrics
         async with LatencyGenerator(context) as latency_generator:
-            # Get response
-            if get_config().simulator_mode == "generate":
-                response = await invoke_generators(context, get_config().generators)
-            elif get_config().simulator_mode in ["record", "replay"]:
-                response = await record_replay_handler.handle_request(context)
+            # Check limits before getting the response where the limiter supports it
+            # so that rejected requests don't incur the cost of generating a response
+            admission = await apply_pre_limits(context)
+            if admission and admission.response:
+                latency_generator.set_response(admission.response)
+                return admission.response
+
+            try:
+                # Get response
+                if get_config().simulator_mode == "generate":
+                    response = await invoke_generators(context, get_config().generators)
+                elif get_config().simulator_mode in ["record", "replay"]:
+                    response = await record_replay_handler.handle_request(context)
+            finally:
+                if admission:
+                    # Settle the limits for the admitted request
+                    # (releases the admitted usage if no successful response was generated)
+                    response = await settle_limits(context, admission, response)
 
             if not response:
                 logger.error("No response found for request: %s", request.url.path)
                 return Response(status_code=500)
 
             # Apply limits here so that that they apply to record/replay as well as generate
-            if response.status_code < 300:
+            if not admission and response.status_code < 300:
                 response = await apply_limits(context, response)
 
             # pass the response to the latency generator
@@ -0,0 +1,69 @@
+import asyncio
+import time
+
+# This file contains the clock used for simulated time.
+#
+# Simulated time runs `dilation` times faster than real time, e.g. with a dilation of 60
+# a minute of simulated time (such as a tokens-per-minute window) passes in one second.
+# Rate-limit windows and simulated latency use the simulated time so that long-running traffic patterns
+# can be simulated in a fraction of the time.
+# Timestamps returned to clients (e.g. the `created` value in responses) use real time, as simulated timestamps
+# drift into the future (and out of the range of datetime with large dilations).
+#
+# Simulated time is anchored to a fixed point in real time (rather than the time the process started)
+# so that all processes using the same dilation agree on the simulated time.
+# This is required for the shared-memory and redis rate-limit stores where state is shared across processes.
+
+# The point in real time where the simulated time and real time are equal (2024-01-01T00:00:00Z)
+_ANCHOR_TIME = 1_704_067_200.0
+
+
+class SimulatorClock:
+    """
+    Provides the simulated time, scaled by the dilation factor.
+    With the default dilation of 1, simulated time is the same as real time.
+    """
+
+    _dilation: float
+
+    def __init__(self, dilation: float = 1.0):
+        self._perf_counter_anchor = time.perf_counter()
+        self._dilation = 1.0
+        self.set_dilation(dilation)
+
+    @property
+    def dilation(self) -> float:
+        return self._dilation
+
+    def set_dilation(self, dilation: float):
+        if dilation <= 0:
+            raise ValueError(f"Time dilation must be greater than 0 (got {dilation})")
+        self._dilation = dilation
+
+    def time(self) -> float:
+        """
+        Returns the simulated time in seconds since the epoch (the simulated equivalent of time.time())
+        """
+        return _ANCHOR_TIME + (time.time() - _ANCHOR_TIME) * self._dilation
+
+    def perf_counter(self) -> float:
+        """
+        Returns the simulated value of a performance counter for measuring durations
+        (the simulated equivalent of time.perf_counter())
+        """
+        return (time.perf_counter() - self._perf_counter_anchor) * self._dilation
+
+    def to_real_duration(self, seconds: float) -> float:
+        """
+        Converts a duration in simulated seconds to real seconds
+        """
+        return seconds / self._dilation
+
+    async def sleep(self, seconds: float):
+        """
+        Sleeps for the specified number of simulated seconds
+        """
+        await asyncio.sleep(self.to_real_duration(seconds))
+
+
+simulator_clock = SimulatorClock()
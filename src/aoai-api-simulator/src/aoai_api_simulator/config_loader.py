@@ -4,8 +4,12 @@ import logging
 import os
 import sys
 
+from aoai_api_simulator import constants
+from aoai_api_simulator.clock import simulator_clock
 from aoai_api_simulator.generator.manager import get_default_generators
 from aoai_api_simulator.generator.model_catalogue import model_catalogue
+from aoai_api_simulator.generator.embeddings import embedding_cache
+from aoai_api_simulator.generator.openai_tokens import token_count_cache
 from aoai_api_simulator.limiters import get_default_limiters
 from aoai_api_simulator.models import Config, OpenAIDeployment
 from aoai_api_simulator.record_replay.handler import get_default_forwarders
@@ -27,8 +31,16 @@ def get_config_from_env_vars(logger: logging.Logger) -> Config:
     return config
 
 
-def initialize_config(config: Config):
-    config.limiters = get_default_limiters(config)
+def initialize_config(config: Config, previous_config: Config | None = None):
+    """
+    Initializes the limiters and extension for the config.
+    If previous_config is specified, its limiters are updated rather than replaced to preserve
+    the rate-limiting state
+    """
+    simulator_clock.set_dilation(config.time_dilation)
+    token_count_cache.set_max_size(config.token_count_cache_size)
+    embedding_cache.set_max_size(config.embedding_cache_size)
+    config.limiters = get_default_limiters(config, previous_config)
 
     # load extension and invoke to update config (customise forwarders, generators, etc.)
     load_extension(config)
@@ -63,12 +75,21 @@ def _load_openai_deployments(logger: logging.Logger) -> dict[str, OpenAIDeployme
             )
 
         model = model_catalogue[model_name]
+
+        rate_limit_mode = deployment.get("rateLimitMode", constants.RATE_LIMIT_MODE_SLIDING)
+        if rate_limit_mode not in [constants.RATE_LIMIT_MODE_SLIDING, constants.RATE_LIMIT_MODE_BUCKETED]:
+            raise ValueError(
+                f"Unsupported rateLimitMode '{rate_limit_mode}' for deployment {deployment_name} "
+                + f"(expected '{constants.RATE_LIMIT_MODE_SLIDING}' or '{constants.RATE_LIMIT_MODE_BUCKETED}')"
+            )
+
         deployments[deployment_name] = OpenAIDeployment(
             name=deployment_name,
             model=model,
             tokens_per_minute=int(deployment.get("tokensPerMinute", 0)),
             embedding_size=int(deployment.get("embeddingSize", 1536)),
             requests_per_minute=int(deployment.get("requestsPerMinute", 0)),
+            rate_limit_mode=rate_limit_mode,
         )
     return deployments
 
@@ -145,8 +166,13 @@ def get_config() -> Config:
     return _config
 
 
-def set_config(new_config: Config):
+def set_config(new_config: Config, preserve_limiter_state: bool = False):
+    """
+    Sets the current config.
+    Set preserve_limiter_state when new_config is an update to the current config (e.g. from the config API)
+    to keep the rate-limiting state of the current limiters
+    """
     # pylint: disable-next=global-statement
     global _config
-    initialize_config(new_config)
+    initialize_config(new_config, _config if preserve_limiter_state else None)
     _config = new_config
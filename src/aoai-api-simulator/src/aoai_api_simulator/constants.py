@@ -16,6 +16,9 @@ SIMULATOR_KEY_LIMITER = "Limiter"
 # SIMULATOR_KEY_OPENAI_PROMPT_TOKENS stores the number of tokens used for the prompt
 SIMULATOR_KEY_OPENAI_PROMPT_TOKENS = "X-OpenAI-Tokens-Prompt"
 
+# SIMULATOR_KEY_OPENAI_EMBEDDING_INPUT_TOKENS stores the number of tokens in each input of an embeddings request
+SIMULATOR_KEY_OPENAI_EMBEDDING_INPUT_TOKENS = "X-OpenAI-Tokens-Embedding-Inputs"
+
 # SIMULATOR_KEY_OPENAI_COMPLETION_TOKENS stores the number of tokens used for the completion (i.e. generated tokens)
 SIMULATOR_KEY_OPENAI_COMPLETION_TOKENS = "X-OpenAI-Tokens-Completion"
 
@@ -50,6 +53,43 @@ LIMITER_OPENAI_TOKENS = "openai-tokens"
 # that are rate-limited using requests-per-minute
 LIMITER_OPENAI_REQUESTS = "openai-requests"
 
+# RATE_LIMIT_MODE_SLIDING is the (default) rate-limit mode that tracks each request in an exact sliding window
+RATE_LIMIT_MODE_SLIDING = "sliding"
+
+# RATE_LIMIT_MODE_BUCKETED is the rate-limit mode that tracks requests in per-second buckets
+# This uses fixed memory per deployment at the cost of a bounded error (up to 1s) in rate-limiting
+RATE_LIMIT_MODE_BUCKETED = "bucketed"
+
+# RATE_LIMIT_STORE_MEMORY is the (default) rate-limit store that keeps limiter state in the worker process
+RATE_LIMIT_STORE_MEMORY = "memory"
+
+# RATE_LIMIT_STORE_SHARED_MEMORY is the rate-limit store that keeps limiter state in shared memory
+# so that limits are enforced across all worker processes on a host
+RATE_LIMIT_STORE_SHARED_MEMORY = "shared-memory"
+
+# RATE_LIMIT_STORE_REDIS is the rate-limit store that keeps limiter state in Redis
+# so that limits are enforced across all simulator replicas
+RATE_LIMIT_STORE_REDIS = "redis"
+
+# RATE_LIMIT_COST_MODE_TOKENIZER is the (default) mode for estimating the token cost of a request for rate-limiting
+# The prompt is tokenized with the deployment's tokenizer and the effective max_tokens is added (as the service does)
+RATE_LIMIT_COST_MODE_TOKENIZER = "tokenizer"
+
+# RATE_LIMIT_COST_MODE_HEURISTIC estimates the prompt tokens from the prompt length (4 characters per token)
+# This avoids tokenizing the prompt for extreme-throughput scenarios at the cost of accuracy
+RATE_LIMIT_COST_MODE_HEURISTIC = "heuristic"
+
+# RECORDING_FORMAT_YAML is the (default) recording format with one YAML file per URL
+RECORDING_FORMAT_YAML = "yaml"
+
+# RECORDING_FORMAT_INDEXED is the recording format with a sorted request hash index and a memory-mapped data file
+# per URL so that large recordings are opened without parsing them and responses are loaded on demand
+RECORDING_FORMAT_INDEXED = "indexed"
+
+# RECORDING_FORMAT_SQLITE is the recording format that stores all recordings in a SQLite database
+# with indexed columns for querying the recorded traffic
+RECORDING_FORMAT_SQLITE = "sqlite"
+
 
 OPENAI_OPERATION_EMBEDDINGS = "embeddings"
 OPENAI_OPERATION_COMPLETIONS = "completions"
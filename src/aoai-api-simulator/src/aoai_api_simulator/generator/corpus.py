@@ -0,0 +1,212 @@
+import bisect
+import logging
+import mmap
+import os
+import random
+import re
+import threading
+import time
+from array import array
+from itertools import accumulate
+
+from aoai_api_simulator.generator.openai_tokens import get_tokenizer
+
+# This file contains a text generator that returns spans of text from a user-provided corpus file
+# (as an alternative to lorem text) so that generated content compresses and tokenizes like real output.
+#
+# The corpus file is memory-mapped and an index of "cut points" is built once per encoding. A cut point is
+# a space followed by a letter: the encodings' pre-tokenizers always start a new chunk there, so no token
+# spans a cut point and the token count of the text between two cut points is the difference of the
+# cumulative token counts at those points. This allows spans with an exact token count to be found with
+# a binary search on the cumulative token counts without tokenizing the generated text.
+#
+# The index is saved alongside the corpus file (<corpus>.<encoding>.index) and memory-mapped so that
+# worker processes share the pages for both the corpus and the index.
+
+logger = logging.getLogger(__name__)
+
+_cut_point = re.compile(rb" (?=[A-Za-z])")
+
+# increment when the format of the index files changes
+_INDEX_VERSION = 1
+# index header: version, corpus size, corpus mtime (ns), number of cut points
+_HEADER_SIZE = 4
+# approximate number of bytes of the corpus to tokenize at a time when building the index
+_BLOCK_SIZE = 1024 * 1024
+# number of random start points to try before scanning for a span that fills the remaining token count
+_SPAN_ATTEMPTS = 10
+
+
+def _build_index(corpus: mmap.mmap, encoding) -> tuple[array, array]:
+    """
+    Returns the byte offsets of the cut points (including the start and end of the corpus)
+    and the number of tokens before each cut point
+    """
+    offsets = array("Q", [0])
+    cumulative_tokens = array("Q", [0])
+    size = len(corpus)
+    block_start = 0
+    while block_start < size:
+        # blocks end at a cut point so that the tokenization of each block matches the full corpus
+        match = _cut_point.search(corpus, min(block_start + _BLOCK_SIZE, size))
+        block_end = match.start() if match else size
+        try:
+            text = corpus[block_start:block_end].decode("utf-8")
+        except UnicodeDecodeError as e:
+            raise ValueError(f"Corpus must be UTF-8 encoded (invalid data at offset {block_start + e.start})") from e
+
+        tokens = encoding.encode_ordinary(text)
+        # byte offset (within the block) of the end of each token
+        token_ends = list(accumulate(len(token_bytes) for token_bytes in encoding.decode_tokens_bytes(tokens)))
+        tokens_before_block = cumulative_tokens[-1]
+        for cut in _cut_point.finditer(corpus, block_start + 1, block_end):
+            offsets.append(cut.start())
+            cumulative_tokens.append(tokens_before_block + bisect.bisect_right(token_ends, cut.start() - block_start))
+        offsets.append(block_end)
+        cumulative_tokens.append(tokens_before_block + len(tokens))
+        block_start = block_end
+
+    return offsets, cumulative_tokens
+
+
+class TextCorpus:
+    """
+    Generates text from spans of a memory-mapped corpus file with exact token counts
+    """
+
+    path: str
+    encoding_name: str
+
+    def __init__(self, path: str, model_name: str):
+        self.path = path
+        self._encoding = get_tokenizer(model_name).encoding
+        self.encoding_name = self._encoding.name
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_size == 0:
+                raise ValueError(f"Corpus file is empty: {path}")
+            self._corpus = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._offsets, self._cumulative_tokens = self._load_index(stat)
+
+    @property
+    def token_count(self) -> int:
+        return self._cumulative_tokens[-1]
+
+    def _load_index(self, stat: os.stat_result):
+        header = [_INDEX_VERSION, stat.st_size, stat.st_mtime_ns]
+        index_path = f"{self.path}.{self.encoding_name}.index"
+        try:
+            with open(index_path, "rb") as f:
+                index = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)).cast("Q")
+            if len(index) > _HEADER_SIZE and list(index[: _HEADER_SIZE - 1]) == header:
+                count = index[_HEADER_SIZE - 1]
+                offsets_start = _HEADER_SIZE
+                tokens_start = offsets_start + count
+                # check the index isn't truncated and ends at the end of the corpus so that spans stay in the corpus
+                if count > 1 and len(index) == tokens_start + count and index[tokens_start - 1] == stat.st_size:
+                    return index[offsets_start:tokens_start], index[tokens_start:]
+            logger.info("Rebuilding out of date corpus index %s", index_path)
+        except (OSError, ValueError, TypeError):
+            # e.g. a missing or empty index file, or a length that isn't a multiple of the item size
+            pass
+
+        logger.info("Building corpus index for %s (encoding %s)...", self.path, self.encoding_name)
+        start_time = time.perf_counter()
+        offsets, cumulative_tokens = _build_index(self._corpus, self._encoding)
+        logger.info(
+            "Built corpus index for %s: %s tokens (took %ss)",
+            self.path,
+            cumulative_tokens[-1],
+            time.perf_counter() - start_time,
+        )
+        try:
+            # write to a temporary file and rename so that other processes never read a partial index
+            temp_path = f"{index_path}.{os.getpid()}.tmp"
+            with open(temp_path, "wb") as f:
+                array("Q", header + [len(offsets)]).tofile(f)
+                offsets.tofile(f)
+                cumulative_tokens.tofile(f)
+            os.replace(temp_path, index_path)
+        except OSError as e:
+            logger.warning("Failed to save corpus index %s (using in-memory index): %s", index_path, e)
+        return offsets, cumulative_tokens
+
+    def _get_span(self, start: int, max_tokens: int, is_first: bool) -> tuple[str, int]:
+        """
+        Returns the text from cut point `start` with the most tokens up to max_tokens (and the token count)
+        """
+        offsets = self._offsets
+        cumulative_tokens = self._cumulative_tokens
+        prefix = ""
+        prefix_tokens = 0
+        if is_first and self._corpus[offsets[start] : offsets[start] + 1] == b" ":
+            # drop the leading space from the start of the text, re-counting the tokens for the first segment
+            prefix = self._corpus[offsets[start] + 1 : offsets[start + 1]].decode("utf-8")
+            prefix_tokens = len(self._encoding.encode_ordinary(prefix))
+            if prefix_tokens > max_tokens:
+                return "", 0
+            start += 1
+
+        target = cumulative_tokens[start] + max_tokens - prefix_tokens
+        end = bisect.bisect_right(cumulative_tokens, target, lo=start) - 1
+        text = prefix + self._corpus[offsets[start] : offsets[end]].decode("utf-8")
+        return text, prefix_tokens + cumulative_tokens[end] - cumulative_tokens[start]
+
+    def _find_span(self, max_tokens: int, is_first: bool) -> tuple[str, int]:
+        """
+        Returns the text of a span with up to max_tokens tokens from a random cut point (and the token count)
+        """
+        count = len(self._offsets) - 1
+        # spans after the first mustn't start at the start of the corpus as there is no space before the text
+        # (so it would be joined to the last word of the previous span, changing the token count)
+        first_start = 0 if is_first else 1
+        start_count = count - first_start
+        if start_count <= 0:
+            return "", 0
+        for _ in range(_SPAN_ATTEMPTS):
+            text, tokens = self._get_span(random.randrange(first_start, count), max_tokens, is_first)
+            if tokens > 0:
+                return text, tokens
+        # e.g. for small max_tokens values where most words have more tokens
+        # fall back to checking each cut point in turn from a random start
+        start = random.randrange(start_count)
+        for i in range(start_count):
+            text, tokens = self._get_span(first_start + (start + i) % start_count, max_tokens, is_first)
+            if tokens > 0:
+                return text, tokens
+        return "", 0
+
+    def generate_text(self, max_tokens: int) -> str:
+        """
+        Generates text with max_tokens tokens from the corpus (joining spans if max_tokens exceeds the corpus size).
+        The text can have fewer tokens if no span of the corpus fills the last few tokens
+        """
+        parts = []
+        remaining = max_tokens
+        while remaining > 0:
+            text, tokens = self._find_span(remaining, is_first=not parts)
+            if tokens == 0:
+                break
+            parts.append(text)
+            remaining -= tokens
+        return "".join(parts)
+
+
+_corpora: dict[tuple[str, str], TextCorpus] = {}
+_corpora_lock = threading.Lock()
+
+
+def get_text_corpus(path: str, model_name: str) -> TextCorpus:
+    """
+    Returns the TextCorpus for the file and the model's encoding (loading or building the index on first use)
+    """
+    key = (path, get_tokenizer(model_name).encoding.name)
+    corpus = _corpora.get(key)
+    if corpus is None:
+        # lock to avoid building the index for the same corpus concurrently (e.g. in the warm-up thread)
+        with _corpora_lock:
+            corpus = _corpora.get(key)
+            if corpus is None:
+                corpus = TextCorpus(path, model_name)
+                _corpora[key] = corpus
+    return corpus
@@ -0,0 +1,79 @@
+import hashlib
+import json
+
+import numpy as np
+
+from aoai_api_simulator.generator.lru_cache import LRUCache
+
+# This file contains the generation of deterministic embeddings.
+#
+# When deterministic embeddings are enabled, the vector for each input is generated from a random number
+# generator seeded with a hash of the input, the model and the embedding size. Identical inputs always get
+# the same vector (across requests, processes and restarts) so that vector-store benchmarks give reproducible
+# similarity results. Recently generated vectors are kept in a bounded cache as repeated inputs are common
+# (e.g. when re-indexing documents in load tests).
+
+
+def get_embedding_inputs(request_input: str | list) -> list[str | list[int]]:
+    """
+    Returns the individual inputs for an embeddings request.
+    The input can be a string, a list of strings, a list of tokens or a list of lists of tokens.
+    """
+    if isinstance(request_input, str):
+        return [request_input]
+    if request_input and all(isinstance(item, int) for item in request_input):
+        # a single input as a list of tokens
+        return [request_input]
+    return request_input
+
+
+def _get_embedding_key(model_name: str, embedding_size: int, embedding_input: str | list[int]) -> bytes:
+    text = embedding_input if isinstance(embedding_input, str) else json.dumps(embedding_input)
+    value = f"{model_name}\0{embedding_size}\0{type(embedding_input).__name__}\0{text}"
+    return hashlib.blake2b(value.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+
+def create_deterministic_embedding(key: bytes, embedding_size: int) -> np.ndarray:
+    """
+    Generates the embedding for the key (see _get_embedding_key) in the range [-2, 2)
+    """
+    rng = np.random.default_rng(int.from_bytes(key, "little"))
+    return (rng.random(embedding_size, dtype=np.float32) - 0.5) * 4
+
+
+class EmbeddingCache(LRUCache[np.ndarray]):
+    """
+    Bounded LRU cache of deterministic embeddings keyed on a hash of the input, the model and the embedding size
+    """
+
+    def __init__(self, max_size: int = 1000):
+        super().__init__("Embedding cache", max_size)
+
+    def get_embedding(self, model_name: str, embedding_size: int, embedding_input: str | list[int]) -> np.ndarray:
+        """
+        Returns the deterministic embedding for the input, generating it only if it isn't in the cache.
+        The returned array is read-only as it can be shared with other requests
+        """
+        key = _get_embedding_key(model_name, embedding_size, embedding_input)
+        if self._max_size == 0:
+            return create_deterministic_embedding(key, embedding_size)
+
+        embedding = self.get(key)
+        if embedding is None:
+            embedding = create_deterministic_embedding(key, embedding_size)
+            embedding.setflags(write=False)
+            self.put(key, embedding)
+        return embedding
+
+    def get_embeddings(
+        self, model_name: str, embedding_size: int, embedding_inputs: list[str | list[int]]
+    ) -> np.ndarray:
+        """
+        Returns the deterministic embeddings for the inputs (one row per input)
+        """
+        if not embedding_inputs:
+            return np.empty((0, embedding_size), dtype=np.float32)
+        return np.stack([self.get_embedding(model_name, embedding_size, item) for item in embedding_inputs])
+
+
+embedding_cache = EmbeddingCache()
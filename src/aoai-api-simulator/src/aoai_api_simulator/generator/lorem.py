@@ -3,6 +3,7 @@ import random
 import time
 
 from aoai_api_simulator.generator.openai_tokens import (
+    get_tokenizer,
     num_tokens_from_string,
 )
 
@@ -43,6 +44,7 @@ class LoremReference:
         return None
 
 
+# LoremReference values keyed on encoding name
 lorem_reference_values: dict[str, LoremReference] = {}
 
 
@@ -56,18 +58,147 @@ def generate_lorem_reference_text_values(token_values: list[int], model_name: st
     return LoremReference(model_name, values)
 
 
-def generate_lorem_text(max_tokens: int, model_name: str):
-    text = ""
-    target = max_tokens
+# pylint: disable-next=too-few-public-methods, too-many-instance-attributes
+class LoremCorpus:
+    """
+    Table of the lorem words and their token counts for a model's encoding.
+
+    Lorem words only contain letters and trailing punctuation, so the encoding's pre-tokenizer splits
+    space-separated text at each word boundary and the token count of the text is the sum of the
+    token counts of the words (the first word without a leading space, the others with a leading space).
+    This allows text with an exact number of tokens to be generated without tokenizing the text.
+    The additivity is verified when the table is built (is_exact is False if it doesn't hold for the encoding)
+    """
+
+    encoding_name: str
+    words: list[str]
+    # token count for each word when it starts the text
+    first_word_tokens: list[int]
+    # token count for each word when it follows a space
+    word_tokens: list[int]
+    is_exact: bool
+
+    # pylint: disable-next=too-many-arguments, too-many-positional-arguments
+    def __init__(
+        self,
+        encoding_name: str,
+        words: list[str],
+        first_word_tokens: list[int],
+        word_tokens: list[int],
+        is_exact: bool,
+    ):
+        self.encoding_name = encoding_name
+        self.words = words
+        self.first_word_tokens = first_word_tokens
+        self.word_tokens = word_tokens
+        self.is_exact = is_exact
+        self._max_word_tokens = max(word_tokens)
+
+        # indices of the words with at most N tokens (indexed by N) to fill the remaining tokens at the end
+        self._first_words_within = self._get_words_within(first_word_tokens)
+        self._words_within = self._get_words_within(word_tokens)
+
+    @classmethod
+    def build(cls, model_name: str, words: list[str] | None = None) -> "LoremCorpus":
+        """
+        Builds the table by tokenizing each word with the model's encoding
+        """
+        encoding = get_tokenizer(model_name).encoding
+        words = list(words or lorem_words)
+        first_word_tokens = [len(encoding.encode(word)) for word in words]
+        word_tokens = [len(encoding.encode(" " + word)) for word in words]
+
+        sample = words + list(reversed(words))
+        expected_tokens = first_word_tokens[0] + sum(word_tokens[1:]) + sum(word_tokens)
+        is_exact = (
+            len(encoding.encode(" ".join(sample))) == expected_tokens
+            # a single token word is needed to make up any remaining token count
+            and 1 in word_tokens
+        )
+        return cls(encoding.name, words, first_word_tokens, word_tokens, is_exact)
+
+    @staticmethod
+    def _get_words_within(word_tokens: list[int]) -> list[list[int]]:
+        max_tokens = max(word_tokens)
+        return [[i for i, tokens in enumerate(word_tokens) if tokens <= n] for n in range(max_tokens + 1)]
+
+    def generate_text(self, max_tokens: int) -> str:
+        """
+        Generates text with exactly max_tokens tokens
+        (or fewer if max_tokens is smaller than the token count of every word)
+        """
+        words = self.words
+        word_tokens = self.word_tokens
+
+        if max_tokens <= 0:
+            return ""
+        first_words = self._first_words_within[min(max_tokens, len(self._first_words_within) - 1)]
+        if not first_words:
+            return ""
+        first = random.choice(first_words)
+        indices = [first]
+        remaining = max_tokens - self.first_word_tokens[first]
+
+        # add words in batches that can't exceed the remaining token count
+        word_range = range(len(words))
+        while remaining >= 2 * self._max_word_tokens:
+            batch = random.choices(word_range, k=remaining // self._max_word_tokens)
+            indices.extend(batch)
+            remaining -= sum(word_tokens[i] for i in batch)
 
-    if model_name not in lorem_reference_values:
+        # then add words that fit in the remaining token count
+        words_within = self._words_within
+        while remaining > 0:
+            i = random.choice(words_within[min(remaining, self._max_word_tokens)])
+            indices.append(i)
+            remaining -= word_tokens[i]
+
+        return " ".join([words[i] for i in indices])
+
+
+# LoremCorpus values keyed on encoding name
+lorem_corpora: dict[str, LoremCorpus] = {}
+
+
+def get_lorem_corpus(model_name: str) -> LoremCorpus:
+    encoding_name = get_tokenizer(model_name).encoding.name
+    corpus = lorem_corpora.get(encoding_name)
+    if corpus is None:
+        corpus = LoremCorpus.build(model_name)
+        if not corpus.is_exact:
+            logger.warning(
+                "Lorem word token counts are not additive for model %s - falling back to generating reference text",
+                model_name,
+            )
+        lorem_corpora[encoding_name] = corpus
+    return corpus
+
+
+def get_lorem_reference_values(model_name: str) -> LoremReference:
+    encoding_name = get_tokenizer(model_name).encoding.name
+    reference_values = lorem_reference_values.get(encoding_name)
+    if reference_values is None:
         logger.info("Generating lorem reference values for model %s...", model_name)
         start_time = time.perf_counter()
         token_sizes = [2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 4000]
-        lorem_reference_values[model_name] = generate_lorem_reference_text_values(token_sizes, model_name)
+        reference_values = generate_lorem_reference_text_values(token_sizes, model_name)
         duration = time.perf_counter() - start_time
         logger.info("Generated lorem reference values for model %s (took %ss)", model_name, duration)
-    reference_values = lorem_reference_values[model_name]
+        lorem_reference_values[encoding_name] = reference_values
+    return reference_values
+
+
+def generate_lorem_text(max_tokens: int, model_name: str):
+    corpus = get_lorem_corpus(model_name)
+    if corpus.is_exact:
+        return corpus.generate_text(max_tokens)
+    return _generate_lorem_text_from_reference_values(max_tokens, model_name)
+
+
+def _generate_lorem_text_from_reference_values(max_tokens: int, model_name: str):
+    text = ""
+    target = max_tokens
+    reference_values = get_lorem_reference_values(model_name)
 
     separator = ""
     while target > 0:
@@ -174,7 +305,7 @@ def raw_generate_lorem_text(max_tokens: int, model_name: str) -> str:
         init_word_count = int(factor * target)
         # text = lorem.get_word(count=init_word_count)
         text = raw_lorem_get_word(count=init_word_count)
-        used = num_tokens_from_string(text, model_name)
+        used = num_tokens_from_string(text, model_name, use_cache=False)
         if used > target:
             break
         full_text += sep + text
@@ -186,7 +317,7 @@ def raw_generate_lorem_text(max_tokens: int, model_name: str) -> str:
     # by adding a word at a time
     while True:
         new_text = full_text + " " + raw_lorem_get_word()  # lorem.get_word()
-        if num_tokens_from_string(new_text, model_name) > max_tokens:
+        if num_tokens_from_string(new_text, model_name, use_cache=False) > max_tokens:
             break
         full_text = new_text
 
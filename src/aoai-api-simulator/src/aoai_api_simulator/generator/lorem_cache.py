@@ -0,0 +1,165 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Iterable
+
+from aoai_api_simulator.generator.corpus import get_text_corpus
+from aoai_api_simulator.generator.lorem import (
+    LoremCorpus,
+    LoremReference,
+    get_lorem_corpus,
+    get_lorem_reference_values,
+    lorem_corpora,
+    lorem_reference_values,
+    lorem_words,
+)
+from aoai_api_simulator.generator.openai_tokens import get_tokenizer
+
+# This file contains the warm-up for lorem text generation.
+#
+# The lorem tables (see LoremCorpus) for each encoding are built when the simulator starts rather than on the first
+# request for a model, as loading the encoding and building the tables blocks the event loop.
+# The tables are saved to a cache directory (one file per encoding) so that other worker processes
+# and later runs load the tables rather than building them again.
+
+logger = logging.getLogger(__name__)
+
+# increment when the format of the cache files changes
+_CACHE_VERSION = 1
+
+
+def _get_cache_path(cache_dir: str, encoding_name: str) -> str:
+    return os.path.join(cache_dir, f"lorem-{encoding_name}.json")
+
+
+def _load_from_cache(cache_dir: str, encoding_name: str) -> tuple[LoremCorpus, LoremReference | None] | None:
+    path = _get_cache_path(cache_dir, encoding_name)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning("Failed to load lorem cache file %s: %s", path, e)
+        return None
+
+    if data.get("version") != _CACHE_VERSION or data.get("encoding") != encoding_name or data["words"] != lorem_words:
+        logger.info("Ignoring out of date lorem cache file %s", path)
+        return None
+
+    corpus = LoremCorpus(
+        encoding_name, data["words"], data["first_word_tokens"], data["word_tokens"], data["is_exact"]
+    )
+    reference_values = None
+    if data.get("reference_values"):
+        values = {int(size): texts for size, texts in data["reference_values"].items()}
+        reference_values = LoremReference(encoding_name, values)
+    return corpus, reference_values
+
+
+def _save_to_cache(cache_dir: str, corpus: LoremCorpus, reference_values: LoremReference | None):
+    data = {
+        "version": _CACHE_VERSION,
+        "encoding": corpus.encoding_name,
+        "words": corpus.words,
+        "first_word_tokens": corpus.first_word_tokens,
+        "word_tokens": corpus.word_tokens,
+        "is_exact": corpus.is_exact,
+        "reference_values": reference_values.values if reference_values else None,
+    }
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # write to a temporary file and rename so that other processes never read a partial file
+        with tempfile.NamedTemporaryFile("w", dir=cache_dir, suffix=".tmp", delete=False, encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(f.name, _get_cache_path(cache_dir, corpus.encoding_name))
+    except OSError as e:
+        logger.warning("Failed to save lorem cache file in %s: %s", cache_dir, e)
+
+
+def warm_up_lorem_model(model_name: str, cache_dir: str | None):
+    """
+    Loads (or builds and saves) the lorem tables for the model's encoding
+    """
+    encoding_name = get_tokenizer(model_name).encoding.name
+    if encoding_name in lorem_corpora:
+        corpus = lorem_corpora[encoding_name]
+        if corpus.is_exact or encoding_name in lorem_reference_values:
+            return
+
+    cached = _load_from_cache(cache_dir, encoding_name) if cache_dir else None
+    if cached:
+        corpus, reference_values = cached
+        if corpus.is_exact or reference_values:
+            logger.info("Loaded lorem tables for encoding %s from cache", encoding_name)
+            lorem_corpora[encoding_name] = corpus
+            if reference_values:
+                lorem_reference_values[encoding_name] = reference_values
+            return
+
+    corpus = get_lorem_corpus(model_name)
+    # reference values are only used when the corpus can't generate exact text for the encoding
+    reference_values = None if corpus.is_exact else get_lorem_reference_values(model_name)
+    if cache_dir:
+        _save_to_cache(cache_dir, corpus, reference_values)
+
+
+class LoremWarmUp:
+    """
+    Runs the lorem warm-up (and loads the corpus index if a corpus file is used) for models in a background thread
+    and tracks whether all warm-ups have completed
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = 0
+        # (model name, corpus path) pairs that have been warmed up
+        self._warm_models: set[tuple[str, str | None]] = set()
+
+    @property
+    def is_ready(self) -> bool:
+        """
+        True when lorem generation is warm for all models that warm-up has been started for
+        """
+        return self._pending == 0
+
+    def start(
+        self, model_names: Iterable[str], cache_dir: str | None, corpus_path: str | None = None
+    ) -> threading.Thread | None:
+        """
+        Starts warming up the models that haven't already been warmed up in a background thread
+        """
+        model_names = [name for name in dict.fromkeys(model_names) if (name, corpus_path) not in self._warm_models]
+        if not model_names:
+            return None
+        with self._lock:
+            self._pending += 1
+        thread = threading.Thread(
+            target=self._warm_up, args=(model_names, cache_dir, corpus_path), name="lorem-warm-up", daemon=True
+        )
+        thread.start()
+        return thread
+
+    def _warm_up(self, model_names: list[str], cache_dir: str | None, corpus_path: str | None):
+        try:
+            start_time = time.perf_counter()
+            for model_name in model_names:
+                try:
+                    warm_up_lorem_model(model_name, cache_dir)
+                    if corpus_path:
+                        get_text_corpus(corpus_path, model_name)
+                # pylint: disable-next=broad-exception-caught
+                except Exception:
+                    # requests for the model will build the tables on demand
+                    logger.exception("Failed to warm up lorem generation for model %s", model_name)
+                self._warm_models.add((model_name, corpus_path))
+            logger.info("Lorem generation warmed up for %s (took %ss)", model_names, time.perf_counter() - start_time)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+
+lorem_warm_up = LoremWarmUp()
@@ -0,0 +1,69 @@
+import threading
+from collections import OrderedDict
+from typing import Generic, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class LRUCache(Generic[T]):
+    """
+    Thread-safe bounded cache that evicts the least recently used entries, with hit/miss counters for metrics
+    """
+
+    def __init__(self, name: str, max_size: int):
+        self._name = name
+        self._values: OrderedDict[Hashable, T] = OrderedDict()
+        self._lock = threading.Lock()
+        self._max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def max_size(self) -> int:
+        return self._max_size
+
+    def set_max_size(self, max_size: int):
+        """
+        Set the maximum number of entries (0 disables the cache)
+        """
+        if max_size < 0:
+            raise ValueError(f"{self._name} size must not be negative (got {max_size})")
+        with self._lock:
+            self._max_size = max_size
+            while len(self._values) > max_size:
+                self._values.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def clear(self):
+        """
+        Remove all entries and reset the hit/miss counters
+        """
+        with self._lock:
+            self._values.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def get(self, key: Hashable) -> T | None:
+        """
+        Returns the value for the key (counted as a hit) or None if the key isn't in the cache (counted as a miss)
+        """
+        with self._lock:
+            value = self._values.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._values.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: T):
+        """
+        Adds the value to the cache, evicting the least recently used entry if the cache is full
+        """
+        with self._lock:
+            self._values[key] = value
+            self._values.move_to_end(key)
+            while len(self._values) > self._max_size:
+                self._values.popitem(last=False)
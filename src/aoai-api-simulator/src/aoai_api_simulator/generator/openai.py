@@ -1,10 +1,11 @@
-import asyncio
+import base64
 import json
 import logging
-import random
 import time
+from typing import Callable
 
 import nanoid
+import numpy as np
 from aoai_api_simulator import constants
 from aoai_api_simulator.auth import validate_api_key_header
 from aoai_api_simulator.constants import (
@@ -17,6 +18,7 @@ from aoai_api_simulator.constants import (
     SIMULATOR_KEY_DEPLOYMENT_NAME,
     SIMULATOR_KEY_LIMITER,
     SIMULATOR_KEY_OPENAI_COMPLETION_TOKENS,
+    SIMULATOR_KEY_OPENAI_EMBEDDING_INPUT_TOKENS,
     SIMULATOR_KEY_OPENAI_MAX_TOKENS_EFFECTIVE,
     SIMULATOR_KEY_OPENAI_MAX_TOKENS_REQUESTED,
     SIMULATOR_KEY_OPENAI_PROMPT_TOKENS,
@@ -24,12 +26,22 @@ from aoai_api_simulator.constants import (
     SIMULATOR_KEY_OPENAI_TOTAL_TOKENS,
     SIMULATOR_KEY_OPERATION_NAME,
 )
+from aoai_api_simulator.generator.corpus import get_text_corpus
+from aoai_api_simulator.generator.embeddings import embedding_cache, get_embedding_inputs
 from aoai_api_simulator.generator.lorem import generate_lorem_text
 from aoai_api_simulator.generator.model_catalogue import model_catalogue
+from aoai_api_simulator.generator.openai_streaming import (
+    ChatCompletionChunkTemplate,
+    plan_chunks,
+    stream_chat_completion,
+)
 from aoai_api_simulator.generator.openai_tokens import (
     get_max_completion_tokens,
+    num_tokens_from_input,
     num_tokens_from_messages,
     num_tokens_from_string,
+    num_tokens_per_input,
+    split_into_tokens,
 )
 from aoai_api_simulator.models import (
     OpenAIChatModel,
@@ -50,6 +62,9 @@ logger = logging.getLogger(__name__)
 
 # API docs: https://learn.microsoft.com/en-gb/azure/ai-services/openai/reference
 
+# model used to generate the translation text (as whisper models aren't supported by tiktoken)
+TRANSLATION_TOKENIZER_MODEL = "gpt-3.5-turbo-0301"
+
 deployment_missing_warning_printed = set()
 embedding_deployment_missing_warning_printed = set()
 default_openai_embedding_model = OpenAIDeployment(
@@ -57,6 +72,29 @@ default_openai_embedding_model = OpenAIDeployment(
 )
 
 
+def generate_text(context: RequestContext, max_tokens: int, model_name: str) -> str:
+    """
+    Generates the text for a response with up to max_tokens tokens.
+    Uses spans of the corpus file if CORPUS_PATH is set, otherwise lorem text
+    """
+    if context.config.corpus_path:
+        return get_text_corpus(context.config.corpus_path, model_name).generate_text(max_tokens)
+    return generate_lorem_text(max_tokens=max_tokens, model_name=model_name)
+
+
+def get_lorem_model_names(deployments: dict[str, OpenAIDeployment]) -> list[str]:
+    """
+    Returns the names of the models that lorem text is generated for by the deployments
+    """
+    model_names = []
+    for deployment in deployments.values():
+        if isinstance(deployment.model, OpenAIChatModel):
+            model_names.append(deployment.model.name)
+        elif isinstance(deployment.model, OpenAIWhisperModel):
+            model_names.append(TRANSLATION_TOKENIZER_MODEL)
+    return model_names
+
+
 def get_embedding_deployment_from_name(context: RequestContext, deployment_name: str) -> OpenAIDeployment | None:
     """
     Gets the embedding model for the specified embedding deployment.
@@ -180,6 +218,11 @@ async def calculate_latency_text_endpoints(context: RequestContext, status_code:
     operation_name = context.values.get(constants.SIMULATOR_KEY_OPERATION_NAME)
     config = context.config
 
+    if operation_name == OPENAI_OPERATION_CHAT_COMPLETIONS and (await context.json()).get("stream"):
+        # streamed responses are paced per token as they are sent
+        # (see open_ai_streaming_first_token and open_ai_streaming_inter_token)
+        return
+
     # Determine the target latency for the request
     completion_tokens = context.values.get(constants.SIMULATOR_KEY_OPENAI_COMPLETION_TOKENS)
     if completion_tokens and completion_tokens > 0:
@@ -220,21 +263,62 @@ async def calculate_latency_translation(context: RequestContext, status_code: in
         context.values[constants.TARGET_DURATION_MS] = target_duration_ms
 
 
-def create_embedding_content(index: int, embedding_size: int):
-    """Generates a random embedding"""
-    return {
-        "object": "embedding",
-        "index": index,
-        "embedding": [(random.random() - 0.5) * 4 for _ in range(embedding_size)],
-    }
+def get_prompt_tokens(context: RequestContext, count_tokens: Callable[[], int]) -> int:
+    """
+    Returns the number of prompt tokens for the request.
+    If the prompt has already been tokenized (e.g. by the rate-limiter when determining the cost of the request)
+    then the stored count is used, otherwise count_tokens is called to tokenize the prompt
+    """
+    prompt_tokens = context.values.get(SIMULATOR_KEY_OPENAI_PROMPT_TOKENS)
+    if prompt_tokens is None:
+        prompt_tokens = count_tokens()
+    return prompt_tokens
 
 
+EMBEDDING_ENCODING_FORMATS = ["float", "base64"]
+
+_embedding_rng = np.random.default_rng()
+
+
+def create_embeddings(input_count: int, embedding_size: int) -> np.ndarray:
+    """Generates random embeddings (one row per input) in the range [-2, 2)"""
+    return (_embedding_rng.random((input_count, embedding_size), dtype=np.float32) - 0.5) * 4
+
+
+def embedding_to_json_float(embedding: np.ndarray) -> bytes:
+    """
+    Formats an embedding as a JSON array of floats.
+    Each value is written with a fixed width (sign, digit and 8 decimal places) using array operations
+    as converting each float to a string in Python is the main cost for large embeddings
+    """
+    # values are in the range [-2, 2] so have a single digit before the decimal point
+    scaled = np.rint(np.abs(embedding.astype(np.float64)) * 1e8).astype(np.int64)
+    chars = np.empty((len(embedding), 12), dtype=np.uint8)
+    chars[:, 0] = np.where(embedding < 0, ord("-"), ord(" "))
+    chars[:, 2] = ord(".")
+    for position in range(10, 2, -1):
+        chars[:, position] = scaled % 10 + ord("0")
+        scaled //= 10
+    chars[:, 1] = scaled + ord("0")
+    chars[:, 11] = ord(",")
+    chars[-1, 11] = ord("]")
+    return b"[" + chars.tobytes()
+
+
+def embedding_to_json_base64(embedding: np.ndarray) -> bytes:
+    """Formats an embedding as a JSON string containing the base64-encoded little-endian float32 values"""
+    return b'"' + base64.b64encode(embedding.astype("<f4").tobytes()) + b'"'
+
+
+# pylint: disable-next=too-many-arguments, too-many-positional-arguments
 def create_embeddings_response(
     context: RequestContext,
     deployment_name: str,
     deployment: OpenAIDeployment,
     request_input: str | list,
     dimension: int | None,
+    encoding_format: str = "float",
+    input_tokens: list[int] | None = None,
 ):
     embedding_size = deployment.embedding_size
 
@@ -243,24 +327,28 @@ def create_embeddings_response(
         if deployment.model.supports_custom_dimensions:
             embedding_size = dimension
 
-    embeddings = []
-    if isinstance(request_input, str):
-        tokens = num_tokens_from_string(request_input, deployment.model.name)
-        embeddings.append(create_embedding_content(0, embedding_size=embedding_size))
+    embedding_inputs = get_embedding_inputs(request_input)
+    if input_tokens is None:
+        tokens = get_prompt_tokens(context, lambda: num_tokens_from_input(request_input, deployment.model.name))
     else:
-        tokens = 0
-        index = 0
-        for i in request_input:
-            tokens += num_tokens_from_string(i, deployment.model.name)
-            embeddings.append(create_embedding_content(index, embedding_size=embedding_size))
-            index += 1
-
-    response_data = {
-        "object": "list",
-        "data": embeddings,
-        "model": deployment.model.name,
-        "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
-    }
+        tokens = sum(input_tokens)
+    if context.config.deterministic_embeddings:
+        embeddings = embedding_cache.get_embeddings(deployment.model.name, embedding_size, embedding_inputs)
+    else:
+        embeddings = create_embeddings(len(embedding_inputs), embedding_size)
+    embedding_to_json = embedding_to_json_base64 if encoding_format == "base64" else embedding_to_json_float
+
+    # build the JSON for the response directly as serializing the embeddings with json.dumps is slow
+    data = b", ".join(
+        b'{"object": "embedding", "index": '
+        + str(index).encode()
+        + b', "embedding": '
+        + (embedding_to_json(embedding) if embedding_size > 0 else b"[]")
+        + b"}"
+        for index, embedding in enumerate(embeddings)
+    )
+    metadata = json.dumps({"model": deployment.model.name, "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+    content = b'{"object": "list", "data": [' + data + b"], " + metadata[1:].encode()
 
     # store values in the context for use by the rate-limiter etc
     context.values[SIMULATOR_KEY_LIMITER] = LIMITER_OPENAI_TOKENS
@@ -271,7 +359,7 @@ def create_embeddings_response(
 
     return Response(
         status_code=200,
-        content=json.dumps(response_data),
+        content=content,
         headers={
             "Content-Type": "application/json",
         },
@@ -288,9 +376,10 @@ def create_completion_response(
     """
     Creates a Response object for a completion request and sets context values for the rate-limiter etc
     """
-    text = generate_lorem_text(max_tokens=max_tokens, model_name=model_name)
+    text = generate_text(context, max_tokens=max_tokens, model_name=model_name)
 
-    completion_tokens = num_tokens_from_string(text, model_name)
+    # generated text is unlikely to be repeated so isn't added to the token count cache
+    completion_tokens = num_tokens_from_string(text, model_name, use_cache=False)
     total_tokens = prompt_tokens + completion_tokens
 
     response_body = {
@@ -339,14 +428,15 @@ def create_lorem_chat_completion_response(
     max_tokens: int,
     prompt_messages: list,
     finish_reason: str = "length",
+    include_usage: bool = False,
 ):
     """
     Creates a Response object for a chat completion request by generating
     lorem ipsum text and sets context values for the rate-limiter etc.
-    Handles streaming vs non-streaming
+    Handles streaming vs non-streaming (include_usage adds a usage chunk to streamed responses)
     """
 
-    text = generate_lorem_text(max_tokens=max_tokens, model_name=model_name)
+    text = generate_text(context, max_tokens=max_tokens, model_name=model_name)
 
     return create_chat_completion_response(
         context=context,
@@ -356,6 +446,7 @@ def create_lorem_chat_completion_response(
         prompt_messages=prompt_messages,
         generated_content=text,
         finish_reason=finish_reason,
+        include_usage=include_usage,
     )
 
 
@@ -368,16 +459,22 @@ def create_chat_completion_response(
     prompt_messages: list,
     generated_content: str,
     finish_reason: str = "length",
+    include_usage: bool = False,
 ):
     """
     Creates a Response object for a chat completion request and sets context values for the rate-limiter etc.
-    Handles streaming vs non-streaming
+    Handles streaming vs non-streaming (include_usage adds a usage chunk to streamed responses)
     """
 
-    prompt_tokens = num_tokens_from_messages(prompt_messages, model_name)
+    prompt_tokens = get_prompt_tokens(context, lambda: num_tokens_from_messages(prompt_messages, model_name))
 
     text = "".join(generated_content)
-    completion_tokens = num_tokens_from_string(text, model_name)
+    if streaming:
+        # streamed responses are sent (and paced) per token
+        token_chunks = split_into_tokens(text, model_name)
+        completion_tokens = sum(chunk_tokens for _, chunk_tokens in token_chunks)
+    else:
+        completion_tokens = num_tokens_from_string(text, model_name, use_cache=False)
     total_tokens = prompt_tokens + completion_tokens
 
     # store values in the context for use by the rate-limiter etc
@@ -389,80 +486,15 @@ def create_chat_completion_response(
     context.values[SIMULATOR_KEY_OPENAI_TOTAL_TOKENS] = total_tokens
 
     if streaming:
-
-        async def send_words():
-            space = ""
-            role = "assistant"
-            for word in generated_content.split(" "):
-                chunk_string = json.dumps(
-                    {
-                        "id": "chatcmpl-" + nanoid.non_secure_generate(size=29),
-                        "object": "chat.completion.chunk",
-                        "created": int(time.time()),
-                        "model_name": model_name,
-                        "system_fingerprint": None,
-                        "choices": [
-                            {
-                                "delta": {
-                                    "content": space + word,
-                                    "function_call": None,
-                                    "role": role,
-                                    "tool_calls": None,
-                                    "finish_reason": None,
-                                    "index": 0,
-                                    "logprobs": None,
-                                    "content_filter_results": {
-                                        "hate": {"filtered": False, "severity": "safe"},
-                                        "self_harm": {"filtered": False, "severity": "safe"},
-                                        "sexual": {"filtered": False, "severity": "safe"},
-                                        "violence": {"filtered": False, "severity": "safe"},
-                                    },
-                                },
-                            },
-                        ],
-                    }
-                )
-                role = None
-
-                yield "data: " + chunk_string + "\n"
-                yield "\n"
-                await asyncio.sleep(0.05)
-                space = " "
-
-            chunk_string = json.dumps(
-                {
-                    "id": "chatcmpl-" + nanoid.non_secure_generate(size=29),
-                    "object": "chat.completion.chunk",
-                    "created": int(time.time()),
-                    "model_name": model_name,
-                    "system_fingerprint": None,
-                    "choices": [
-                        {
-                            "delta": {
-                                "content": None,
-                                "function_call": None,
-                                "role": None,
-                                "tool_calls": None,
-                                "finish_reason": finish_reason,
-                                "index": 0,
-                                "logprobs": None,
-                                "content_filter_results": {
-                                    "hate": {"filtered": False, "severity": "safe"},
-                                    "self_harm": {"filtered": False, "severity": "safe"},
-                                    "sexual": {"filtered": False, "severity": "safe"},
-                                    "violence": {"filtered": False, "severity": "safe"},
-                                },
-                            },
-                        },
-                    ],
-                }
-            )
-
-            yield "data: " + chunk_string + "\n"
-            yield "\n"
-            yield "[DONE]"
-
-        return StreamingResponse(content=send_words())
+        return StreamingResponse(
+            content=stream_chat_completion(
+                ChatCompletionChunkTemplate(model_name, include_usage=include_usage),
+                plan_chunks(token_chunks, context.config.latency, context.config.streaming),
+                finish_reason,
+                usage=(prompt_tokens, completion_tokens) if include_usage else None,
+            ),
+            media_type="text/event-stream",
+        )
 
     response_body = {
         "id": "chatcmpl-" + nanoid.non_secure_generate(size=29),
@@ -517,6 +549,44 @@ def _validate_api_key_header(context: RequestContext):
     validate_api_key_header(request=request, header_name="api-key", allowed_key_value=context.config.simulator_api_key)
 
 
+def _embeddings_bad_request_response(message: str) -> Response:
+    return Response(
+        status_code=400,
+        content=json.dumps({"error": {"code": "BadRequest", "message": message}}),
+        headers={
+            "Content-Type": "application/json",
+        },
+    )
+
+
+def _get_embedding_input_tokens(
+    context: RequestContext, deployment: OpenAIDeployment, request_input: str | list
+) -> tuple[list[int], Response | None]:
+    """
+    Returns the number of tokens in each input, or an error response if the inputs exceed the model's limits.
+    If the inputs have already been tokenized (e.g. by the rate-limiter when determining the cost of the request)
+    then the stored counts are used
+    """
+    embedding_inputs = get_embedding_inputs(request_input)
+    if not embedding_inputs:
+        return [], _embeddings_bad_request_response("'input' must not be empty.")
+    if len(embedding_inputs) > deployment.model.max_inputs:
+        return [], _embeddings_bad_request_response(
+            f"Too many inputs. The max number of inputs is {deployment.model.max_inputs}."
+        )
+    input_tokens = context.values.get(SIMULATOR_KEY_OPENAI_EMBEDDING_INPUT_TOKENS)
+    if input_tokens is None or len(input_tokens) != len(embedding_inputs):
+        input_tokens = num_tokens_per_input(embedding_inputs, deployment.model.name)
+    for index, item_tokens in enumerate(input_tokens):
+        if item_tokens > deployment.model.max_input_tokens:
+            return [], _embeddings_bad_request_response(
+                f"This model's maximum context length is {deployment.model.max_input_tokens} tokens, "
+                + f"however you requested {item_tokens} tokens in input[{index}]. "
+                + "Please reduce the length of the input."
+            )
+    return input_tokens, None
+
+
 async def azure_openai_embedding(context: RequestContext) -> Response | None:
     request = context.request
     is_match, path_params = context.is_route_match(
@@ -527,7 +597,7 @@ async def azure_openai_embedding(context: RequestContext) -> Response | None:
 
     _validate_api_key_header(context)
     deployment_name = path_params["deployment"]
-    request_body = await request.json()
+    request_body = await context.json()
     deployment = get_embedding_deployment_from_name(context, deployment_name)
 
     if deployment is None:
@@ -559,6 +629,17 @@ async def azure_openai_embedding(context: RequestContext) -> Response | None:
             },
         )
     request_input = request_body["input"]
+    encoding_format = request_body.get("encoding_format") or "float"
+    if encoding_format not in EMBEDDING_ENCODING_FORMATS:
+        return _embeddings_bad_request_response(
+            f"Invalid value for encoding_format: '{encoding_format}'. "
+            + f"Supported values are: {', '.join(EMBEDDING_ENCODING_FORMATS)}."
+        )
+
+    # validate the input limits before generating any embeddings
+    input_tokens, error_response = _get_embedding_input_tokens(context, deployment, request_input)
+    if error_response:
+        return error_response
 
     response = create_embeddings_response(
         context=context,
@@ -566,6 +647,8 @@ async def azure_openai_embedding(context: RequestContext) -> Response | None:
         deployment=deployment,
         request_input=request_input,
         dimension=request_body["dimensions"] if "dimensions" in request_body else None,
+        encoding_format=encoding_format,
+        input_tokens=input_tokens,
     )
 
     # calculate a simulated latency and store in context.values
@@ -615,8 +698,8 @@ async def azure_openai_completion(context: RequestContext) -> Response | None:
                 "Content-Type": "application/json",
             },
         )
-    request_body = await request.json()
-    prompt_tokens = num_tokens_from_string(request_body["prompt"], model.name)
+    request_body = await context.json()
+    prompt_tokens = get_prompt_tokens(context, lambda: num_tokens_from_string(request_body["prompt"], model.name))
 
     requested_max_tokens, max_tokens = get_max_completion_tokens(request_body, model.name, prompt_tokens=prompt_tokens)
 
@@ -648,7 +731,7 @@ async def azure_openai_chat_completion(context: RequestContext) -> Response | No
 
     _validate_api_key_header(context)
 
-    request_body = await request.json()
+    request_body = await context.json()
     deployment_name = path_params["deployment"]
     model = get_chat_model_from_deployment_name(context, deployment_name)
     if model is None:
@@ -680,7 +763,7 @@ async def azure_openai_chat_completion(context: RequestContext) -> Response | No
         )
 
     messages = request_body["messages"]
-    prompt_tokens = num_tokens_from_messages(messages, model.name)
+    prompt_tokens = get_prompt_tokens(context, lambda: num_tokens_from_messages(messages, model.name))
 
     requested_max_tokens, max_tokens = get_max_completion_tokens(request_body, model.name, prompt_tokens=prompt_tokens)
 
@@ -688,6 +771,7 @@ async def azure_openai_chat_completion(context: RequestContext) -> Response | No
     context.values[SIMULATOR_KEY_OPENAI_MAX_TOKENS_EFFECTIVE] = max_tokens
 
     streaming = request_body.get("stream", False)
+    include_usage = bool((request_body.get("stream_options") or {}).get("include_usage"))
 
     response = create_lorem_chat_completion_response(
         context=context,
@@ -696,6 +780,7 @@ async def azure_openai_chat_completion(context: RequestContext) -> Response | No
         streaming=streaming,
         max_tokens=max_tokens,
         prompt_messages=messages,
+        include_usage=include_usage,
     )
 
     # calculate a simulated latency and store in context.values
@@ -725,7 +810,7 @@ async def azure_openai_translation(context: RequestContext) -> Response | None:
                 "Content-Type": "application/json",
             },
         )
-    request_form = await request.form()
+    request_form = await context.form()
     audio_file = request_form["file"]
     response_format = request_form["response_format"]
 
@@ -774,7 +859,7 @@ def create_translation_response(
     """
 
     # Generate response text based max_tokens_to_generate
-    text = generate_lorem_text(max_tokens=max_tokens_to_generate, model_name="gpt-3.5-turbo-0301")
+    text = generate_text(context, max_tokens=max_tokens_to_generate, model_name=TRANSLATION_TOKENIZER_MODEL)
 
     content = text
     if response_format == "json":
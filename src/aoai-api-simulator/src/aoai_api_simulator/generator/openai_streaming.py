@@ -0,0 +1,176 @@
+import json
+import time
+from json.encoder import encode_basestring_ascii
+from typing import AsyncIterator, Iterator
+
+import nanoid
+from aoai_api_simulator.clock import simulator_clock
+from aoai_api_simulator.models import LatencyConfig, StreamingConfig
+
+# This file contains the server-sent events (SSE) writer for streamed chat completions.
+#
+# The chunks for a streamed response only differ in the delta content (and the role/finish_reason in the
+# first and last chunks), so each chunk type is serialized to JSON once per response and the JSON-escaped
+# content is spliced into the serialized template for each chunk rather than serializing the full chunk.
+#
+# Tokens are released according to the time-to-first-token and inter-token latencies and are sent one
+# token per chunk (as the OpenAI service does) unless the streaming config coalesces them into fewer chunks.
+
+# placeholder for the delta content when serializing a chunk template
+_CONTENT_PLACEHOLDER = "__aoai_api_simulator_content__"
+
+_DONE_EVENT = b"data: [DONE]\n\n"
+
+_content_filter_results = {
+    "hate": {"filtered": False, "severity": "safe"},
+    "self_harm": {"filtered": False, "severity": "safe"},
+    "sexual": {"filtered": False, "severity": "safe"},
+    "violence": {"filtered": False, "severity": "safe"},
+}
+
+
+def _to_event(chunk: dict) -> bytes:
+    return b"data: " + json.dumps(chunk).encode("utf-8") + b"\n\n"
+
+
+class ChatCompletionChunkTemplate:
+    """
+    Pre-serialized chunks for a streamed chat completion response.
+    All chunks for a response share the same id and created time (as with the OpenAI service)
+    """
+
+    def __init__(self, model_name: str, include_usage: bool = False):
+        self.id = "chatcmpl-" + nanoid.non_secure_generate(size=29)
+        self.created = int(time.time())
+        self.model_name = model_name
+        self.include_usage = include_usage
+        # the first chunk includes the role
+        self._first_template = self._create_template({"role": "assistant"})
+        self._template = self._create_template({})
+
+    def _create_chunk(self, choices: list) -> dict:
+        chunk = {
+            "id": self.id,
+            "object": "chat.completion.chunk",
+            "created": self.created,
+            "model": self.model_name,
+            "system_fingerprint": None,
+            "choices": choices,
+        }
+        if self.include_usage:
+            # when usage is requested, all chunks other than the usage chunk have a null usage value
+            chunk["usage"] = None
+        return chunk
+
+    def _create_template(self, delta: dict) -> tuple[bytes, bytes]:
+        choice = {
+            "index": 0,
+            "delta": {**delta, "content": _CONTENT_PLACEHOLDER},
+            "finish_reason": None,
+            "logprobs": None,
+            "content_filter_results": _content_filter_results,
+        }
+        prefix, suffix = _to_event(self._create_chunk([choice])).split(
+            json.dumps(_CONTENT_PLACEHOLDER).encode("utf-8")
+        )
+        return prefix, suffix
+
+    def content_chunk(self, content: str, is_first: bool = False) -> bytes:
+        """
+        Returns the SSE event for a chunk with the delta content
+        """
+        escaped_content = encode_basestring_ascii(content).encode("ascii")
+        prefix, suffix = self._first_template if is_first else self._template
+        return prefix + escaped_content + suffix
+
+    def finish_chunk(self, finish_reason: str) -> bytes:
+        """
+        Returns the SSE event for the final chunk with the finish reason
+        """
+        choice = {"index": 0, "delta": {}, "finish_reason": finish_reason, "logprobs": None}
+        return _to_event(self._create_chunk([choice]))
+
+    def usage_chunk(self, prompt_tokens: int, completion_tokens: int) -> bytes:
+        """
+        Returns the SSE event for the usage chunk sent after the final chunk when usage is requested
+        (see stream_options.include_usage)
+        """
+        chunk = self._create_chunk([])
+        chunk["usage"] = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        return _to_event(chunk)
+
+
+def plan_chunks(
+    token_chunks: list[tuple[str, int]], latency: LatencyConfig, streaming: StreamingConfig
+) -> Iterator[tuple[float, str]]:
+    """
+    Returns the chunks to send as (time in seconds from the start of the stream, content) pairs.
+    token_chunks is the text for each token (see split_into_tokens)
+    """
+    max_tokens = streaming.chunk_tokens if streaming.chunk_mode == "tokens" else None
+    interval_s = streaming.chunk_interval_ms / 1000 if streaming.chunk_mode == "time" else None
+
+    # time that the current token is available to send
+    token_time_s = 0
+    is_first_token = True
+    pending = []
+    pending_tokens = 0
+    pending_start_s = 0
+    for text, tokens in token_chunks:
+        for _ in range(tokens):
+            if is_first_token:
+                delay_ms = latency.open_ai_streaming_first_token.get_value()
+                is_first_token = False
+            else:
+                delay_ms = latency.open_ai_streaming_inter_token.get_value()
+            token_time_s += max(delay_ms, 0) / 1000
+
+        if pending and interval_s is not None and token_time_s > pending_start_s + interval_s:
+            # send the tokens that were available within the interval
+            yield pending_start_s + interval_s, "".join(pending)
+            pending = []
+            pending_tokens = 0
+        if not pending:
+            pending_start_s = token_time_s
+        pending.append(text)
+        pending_tokens += tokens
+        if max_tokens is not None and pending_tokens >= max_tokens:
+            yield token_time_s, "".join(pending)
+            pending = []
+            pending_tokens = 0
+
+    if pending:
+        yield token_time_s, "".join(pending)
+
+
+async def stream_chat_completion(
+    template: ChatCompletionChunkTemplate,
+    chunks: Iterator[tuple[float, str]],
+    finish_reason: str,
+    usage: tuple[int, int] | None = None,
+) -> AsyncIterator[bytes]:
+    """
+    Sends the chunks (see plan_chunks) at their scheduled times followed by the final chunk,
+    the usage chunk (if usage is set to the prompt and completion tokens) and the [DONE] event
+    """
+    # times are relative to the start of the stream so that time spent sending chunks isn't added to the delays
+    start_time = simulator_clock.perf_counter()
+    is_first = True
+    for send_time_s, content in chunks:
+        sleep_s = start_time + send_time_s - simulator_clock.perf_counter()
+        if sleep_s > 0:
+            await simulator_clock.sleep(sleep_s)
+        yield template.content_chunk(content, is_first=is_first)
+        is_first = False
+
+    if is_first:
+        # no content was generated, but the first chunk still sends the role
+        yield template.content_chunk("", is_first=True)
+    yield template.finish_chunk(finish_reason)
+    if usage is not None:
+        yield template.usage_chunk(*usage)
+    yield _DONE_EVENT
@@ -1,8 +1,15 @@
+import codecs
+import hashlib
 import logging
+import os
+from dataclasses import dataclass
 from typing import Tuple
 
 import tiktoken
 
+from aoai_api_simulator.generator.embeddings import get_embedding_inputs
+from aoai_api_simulator.generator.lru_cache import LRUCache
+
 logger = logging.getLogger(__name__)
 
 # For details on the token counting, see https://cookbook.openai.com/examples/how_to_count_tokens_with_tiktoken
@@ -17,6 +24,138 @@ def _warn_once(warning_key: str, message: str):
         warnings[warning_key] = True
 
 
+@dataclass(frozen=True)
+class ModelTokenizer:
+    """
+    The encoding and chat message format used to count tokens for a model
+    """
+
+    encoding: tiktoken.Encoding
+    # the encoding of the model version assumed when counting tokens for chat messages
+    message_encoding: tiktoken.Encoding
+    # the number of tokens added per message and per name in chat messages
+    # (None if counting tokens for chat messages isn't supported for the model)
+    tokens_per_message: int | None
+    tokens_per_name: int | None
+
+
+# ModelTokenizer values keyed on model name
+_tokenizers: dict[str, ModelTokenizer] = {}
+
+
+def _resolve_message_format(model: str) -> tuple[str, int | None, int | None]:
+    """
+    Returns the model to use for the encoding along with the tokens per message and per name for chat messages
+    """
+    if model in {
+        "gpt-3.5-turbo-0613",
+        "gpt-3.5-turbo-16k-0613",
+        "gpt-4-0314",
+        "gpt-4-32k-0314",
+        "gpt-4-0613",
+        "gpt-4-32k-0613",
+    }:
+        return model, 3, 1
+    if model == "gpt-3.5-turbo-0301":
+        # every message follows <|start|>{role/name}\n{content}<|end|>\n
+        # if there's a name, the role is omitted
+        return model, 4, -1
+    if "gpt-3.5-turbo" in model:
+        _warn_once(
+            model, "Warning: gpt-3.5-turbo may update over time. Returning num tokens assuming gpt-3.5-turbo-0613."
+        )
+        return _resolve_message_format("gpt-3.5-turbo-0613")
+    if "gpt-4" in model:
+        _warn_once(model, "Warning: gpt-4 may update over time. Returning num tokens assuming gpt-4-0613.")
+        return _resolve_message_format("gpt-4-0613")
+    if "whisper" in model:
+        return _resolve_message_format("gpt-3.5-turbo-0301")
+    return model, None, None
+
+
+def _get_encoding(model: str) -> tiktoken.Encoding:
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        _warn_once(model, f"Warning: model ({model}) not found. Using cl100k_base encoding.")
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def get_tokenizer(model: str) -> ModelTokenizer:
+    """
+    Returns the tokenizer for the model.
+    Model aliases and encodings are resolved on the first call for each model and then reused
+    """
+    tokenizer = _tokenizers.get(model)
+    if tokenizer is None:
+        message_model, tokens_per_message, tokens_per_name = _resolve_message_format(model)
+        encoding = _get_encoding(model)
+        message_encoding = encoding if message_model == model else _get_encoding(message_model)
+        tokenizer = ModelTokenizer(encoding, message_encoding, tokens_per_message, tokens_per_name)
+        _tokenizers[model] = tokenizer
+    return tokenizer
+
+
+# batches of at least this many texts are tokenized across threads (if there are multiple CPUs)
+_THREADED_BATCH_SIZE = 64
+_TOKENIZER_THREADS = min(8, os.cpu_count() or 1)
+
+
+def _count_tokens_batch(encoding: tiktoken.Encoding, texts: list[str]) -> list[int]:
+    if _TOKENIZER_THREADS > 1 and len(texts) >= _THREADED_BATCH_SIZE:
+        # the tokenizer releases the GIL so large batches can be tokenized in parallel
+        return [len(tokens) for tokens in encoding.encode_batch(texts, num_threads=_TOKENIZER_THREADS)]
+    return [len(encoding.encode(text)) for text in texts]
+
+
+class TokenCountCache(LRUCache[int]):
+    """
+    Bounded LRU cache of token counts keyed on a hash of the text and the encoding name.
+    Used to avoid re-tokenizing text that is repeated across requests (e.g. system prompts and few-shot examples).
+    Only the hash is stored, so the memory used per entry doesn't depend on the length of the text
+    """
+
+    def __init__(self, max_size: int = 10000):
+        super().__init__("Token count cache", max_size)
+
+    def count_tokens(self, encoding: tiktoken.Encoding, text: str) -> int:
+        """
+        Returns the number of tokens in the text, tokenizing the text only if it isn't in the cache
+        """
+        if self._max_size == 0:
+            return len(encoding.encode(text))
+
+        key = (encoding.name, hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest())
+        count = self.get(key)
+        if count is None:
+            count = len(encoding.encode(text))
+            self.put(key, count)
+        return count
+
+    def count_tokens_batch(self, encoding: tiktoken.Encoding, texts: list[str]) -> list[int]:
+        """
+        Returns the number of tokens in each text, tokenizing the texts that aren't in the cache as a batch
+        """
+        if self._max_size == 0:
+            return _count_tokens_batch(encoding, texts)
+
+        keys = [
+            (encoding.name, hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest())
+            for text in texts
+        ]
+        counts = [self.get(key) for key in keys]
+        missing = [index for index, count in enumerate(counts) if count is None]
+        if missing:
+            missing_counts = _count_tokens_batch(encoding, [texts[index] for index in missing])
+            for index, count in zip(missing, missing_counts):
+                counts[index] = count
+                self.put(keys[index], count)
+        return counts
+
+
+token_count_cache = TokenCountCache()
+
+
 def get_max_completion_tokens(request_body, model_name: str, prompt_tokens: int) -> Tuple[int | None, int]:
     """
     Returns a tuple of the requested max tokens and the actual max tokens to use.
@@ -36,49 +175,68 @@ def get_max_completion_tokens(request_body, model_name: str, prompt_tokens: int)
     return requested_max_tokens, max_tokens
 
 
-def num_tokens_from_string(string: str, model: str) -> int:
-    """Returns the number of tokens in a text string."""
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        _warn_once(model, f"Warning: model ({model}) not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
-    num_tokens = len(encoding.encode(string))
-    return num_tokens
+def num_tokens_from_string(string: str, model: str, use_cache: bool = True) -> int:
+    """
+    Returns the number of tokens in a text string.
+    Set use_cache to False for text that is unlikely to be repeated (e.g. randomly generated text)
+    to avoid evicting other entries from the token count cache
+    """
+    encoding = get_tokenizer(model).encoding
+    if use_cache:
+        return token_count_cache.count_tokens(encoding, string)
+    return len(encoding.encode(string))
+
+
+def split_into_tokens(text: str, model: str) -> list[tuple[str, int]]:
+    """
+    Splits the text into the text for each token, returned as (text, token count) pairs.
+    Tokens that end part-way through a UTF-8 character are joined with the following tokens
+    """
+    encoding = get_tokenizer(model).encoding
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    chunks = []
+    pending_tokens = 0
+    for token_bytes in encoding.decode_tokens_bytes(encoding.encode(text)):
+        pending_tokens += 1
+        chunk = decoder.decode(token_bytes)
+        if chunk:
+            chunks.append((chunk, pending_tokens))
+            pending_tokens = 0
+    if pending_tokens:
+        chunks.append((decoder.decode(b"", final=True), pending_tokens))
+    return chunks
+
+
+def num_tokens_from_input(request_input: str | list, model: str) -> int:
+    """
+    Returns the number of tokens in an embeddings input.
+    The input can be a string, a list of strings, a list of tokens or a list of lists of tokens.
+    """
+    return sum(num_tokens_per_input(get_embedding_inputs(request_input), model))
+
+
+def num_tokens_per_input(embedding_inputs: list[str | list[int]], model: str) -> list[int]:
+    """
+    Returns the number of tokens in each embeddings input (see get_embedding_inputs).
+    String inputs are tokenized as a batch rather than one at a time
+    """
+    texts = [item for item in embedding_inputs if isinstance(item, str)]
+    text_counts = iter(token_count_cache.count_tokens_batch(get_tokenizer(model).encoding, texts))
+    counts = []
+    for item in embedding_inputs:
+        if isinstance(item, str):
+            counts.append(next(text_counts))
+        elif isinstance(item, list):
+            counts.append(len(item))
+        else:
+            counts.append(1)
+    return counts
 
 
 def num_tokens_from_messages(messages, model):
     """Return the number of tokens used by a list of messages."""
-    # pylint: disable-next=global-statement
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        _warn_once(model, f"Warning: model ({model}) not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
-    if model in {
-        "gpt-3.5-turbo-0613",
-        "gpt-3.5-turbo-16k-0613",
-        "gpt-4-0314",
-        "gpt-4-32k-0314",
-        "gpt-4-0613",
-        "gpt-4-32k-0613",
-    }:
-        tokens_per_message = 3
-        tokens_per_name = 1
-    elif model == "gpt-3.5-turbo-0301":
-        tokens_per_message = 4  # every message follows <|start|>{role/name}\n{content}<|end|>\n
-        tokens_per_name = -1  # if there's a name, the role is omitted
-    elif "gpt-3.5-turbo" in model:
-        _warn_once(
-            model, "Warning: gpt-3.5-turbo may update over time. Returning num tokens assuming gpt-3.5-turbo-0613."
-        )
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo-0613")
-    elif "gpt-4" in model:
-        _warn_once(model, "Warning: gpt-4 may update over time. Returning num tokens assuming gpt-4-0613.")
-        return num_tokens_from_messages(messages, model="gpt-4-0613")
-    elif "whisper" in model:
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo-0301")
-    else:
+    tokenizer = get_tokenizer(model)
+    if tokenizer.tokens_per_message is None:
         raise NotImplementedError(
             f"num_tokens_from_messages() is not implemented for model {model}. "
             + "See https://github.com/openai/openai-python/blob/main/chatml.md for information "
@@ -86,10 +244,10 @@ def num_tokens_from_messages(messages, model):
         )
     num_tokens = 0
     for message in messages:
-        num_tokens += tokens_per_message
+        num_tokens += tokenizer.tokens_per_message
         for key, value in message.items():
-            num_tokens += len(encoding.encode(value))
+            num_tokens += token_count_cache.count_tokens(tokenizer.message_encoding, value)
             if key == "name":
-                num_tokens += tokens_per_name
+                num_tokens += tokenizer.tokens_per_name
     num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
     return num_tokens
@@ -1,7 +1,5 @@
-import asyncio
-import time
-
 from aoai_api_simulator import constants
+from aoai_api_simulator.clock import simulator_clock
 from aoai_api_simulator.metrics import simulator_metrics
 from aoai_api_simulator.models import RequestContext
 from fastapi import Response
@@ -12,6 +10,7 @@ class LatencyGenerator:
     LatencyGenerator is a context manager that adds simulated latency to the response.
     The latency added is based on the context.values[TARGET_DURATION_MS] value.
     Additionaly, the generator emits metrics for the response (base latency and added latency).
+    Durations are measured in simulated time (see SimulatorClock) so that time dilation is applied to the latency.
     """
 
     __context: RequestContext
@@ -26,7 +25,7 @@ class LatencyGenerator:
         self.__response = response
 
     async def __aenter__(self):
-        self.__start_time = time.perf_counter()
+        self.__start_time = simulator_clock.perf_counter()
         return self
 
     async def __aexit__(self, exc_type, exc_value, traceback):
@@ -40,7 +39,7 @@ class LatencyGenerator:
             return
 
         extra_latency_s = 0
-        base_end_time = time.perf_counter()
+        base_end_time = simulator_clock.perf_counter()
         base_duration_s = base_end_time - self.__start_time
 
         deployment_name = self.__context.values.get(constants.SIMULATOR_KEY_DEPLOYMENT_NAME)
@@ -56,9 +55,9 @@ class LatencyGenerator:
                 extra_latency_s = target_duration_s - base_duration_s
 
         if extra_latency_s and extra_latency_s > 0:
-            await asyncio.sleep(extra_latency_s)
+            await simulator_clock.sleep(extra_latency_s)
 
-        full_end_time = time.perf_counter()
+        full_end_time = simulator_clock.perf_counter()
         simulator_metrics.histogram_latency_base.record(
             base_duration_s,
             attributes={
@@ -1,16 +1,24 @@
+# pylint: disable=too-many-lines
+import bisect
 import inspect
 import json
 import logging
 import math
-import time
+import re
+import secrets
+from abc import ABC, abstractmethod
+from collections import deque
 from dataclasses import dataclass
-from typing import Awaitable, Callable
+from typing import Awaitable, MutableSequence
 
 from aoai_api_simulator import constants
+from aoai_api_simulator.clock import simulator_clock
+from aoai_api_simulator.limiters_cost import determine_token_cost
 from aoai_api_simulator.metrics import simulator_metrics
 from aoai_api_simulator.models import (
     Config,
     OpenAIDeployment,
+    RateLimitConfig,
     RequestContext,
 )
 from fastapi import Response
@@ -31,6 +39,38 @@ async def apply_limits(context: RequestContext, response: Response) -> Awaitable
     return response
 
 
+async def apply_pre_limits(context: RequestContext) -> "LimitAdmission | None":
+    """
+    Checks the request against limiters that support admission before the response is generated.
+    Returns None if no limiter applies to the request. If the returned admission has a response
+    then the request was rejected and that response should be returned without generating a response.
+    """
+    for limiter_name, limiter in context.config.limiters.items():
+        if isinstance(limiter, AdmissionLimiter):
+            admission = await limiter.admit(context)
+            if admission:
+                admission.limiter_name = limiter_name
+                return admission
+    return None
+
+
+async def settle_limits(
+    context: RequestContext, admission: "LimitAdmission", response: Response | None
+) -> Response | None:
+    """
+    Settles the limits for a request that was admitted by apply_pre_limits once the response
+    has been generated (response is None if no response was generated)
+    """
+    limiter = context.config.limiters[admission.limiter_name]
+    limiter_name = context.values.get(constants.SIMULATOR_KEY_LIMITER)
+    if response is not None and response.status_code < 300 and limiter_name != admission.limiter_name:
+        # The response was generated for a different limiter (e.g. by a custom generator)
+        # so release the admission and apply the limiter for the response
+        await limiter.settle(context, admission, None)
+        return await apply_limits(context, response)
+    return await limiter.settle(context, admission, response)
+
+
 def no_op_limiter(_: RequestContext, response: Response) -> None:
     return response
 
@@ -38,62 +78,6 @@ def no_op_limiter(_: RequestContext, response: Response) -> None:
 deployment_warnings_issues: dict[str, bool] = {}
 
 
-async def determine_token_cost(context: RequestContext):
-    operation_name = context.values.get(constants.SIMULATOR_KEY_OPERATION_NAME)
-    if operation_name is None:
-        logger.info("No operation name found in context for request: %s", context.request.url.path)
-        return 0
-
-    if operation_name == constants.OPENAI_OPERATION_TRANSLATION:
-        # Don't apply token limits to translations
-        # Also, don't read the body as it may be a stream
-        return 0
-
-    # Check whether the request has set max_tokens
-    # If so, use that as the rate-limiting token value
-    request_body = await context.request.json()
-    max_tokens = request_body.get("max_tokens")
-    if max_tokens:
-        token_cost = max_tokens
-    else:
-        # otherwise, calculate the rate-limiting token cost
-
-        # TODO: update this to enable plugging in different behaviour for different models
-        # This behaviour works for PAYG with the following models
-        #  - text-embedding-ada-002
-        #  - text-embedding-3-small
-        #  - text-embedding-3-large
-        #  - gpt-3.5-turbo
-
-        operation_name = context.values.get(constants.SIMULATOR_KEY_OPERATION_NAME)
-
-        if operation_name == constants.OPENAI_OPERATION_CHAT_COMPLETIONS:
-            token_cost = 16
-        elif operation_name == constants.OPENAI_OPERATION_COMPLETIONS:
-            token_cost = 16
-        elif operation_name == constants.OPENAI_OPERATION_EMBEDDINGS:
-            request_body = await context.request.json()
-            request_input = request_body.get("input")
-            if request_input is None:
-                logger.warning("openai_limiter: input not found in request body for embedding request")
-                token_cost = 0
-            else:
-                if isinstance(request_input, list):
-                    # TODO - validate whether we should sum the ceil values or ceil the sum
-                    token_cost = sum(math.ceil(len(input_str) / 4) for input_str in request_input)
-                else:
-                    token_cost = math.ceil(len(request_input) / 4)
-        else:
-            # TODO: implement calculations for other endpoints
-            logger.warning(
-                "openai_limiter: unhanndled endpoint %s (operation_name: %s)", context.request.url.path, operation_name
-            )
-            token_cost = 0
-
-    context.values[constants.SIMULATOR_KEY_OPENAI_RATE_LIMIT_TOKENS] = token_cost
-    return token_cost
-
-
 @dataclass
 class WindowEntry:
     timestamp: float
@@ -109,77 +93,200 @@ class WindowAddResult:
     retry_reason: str | None  # "tokens" or "requests"
 
 
-# pylint: disable-next=too-few-public-methods
+@dataclass
+class LimitAdmission:
+    limiter_name: str | None
+    deployment_name: str
+    token_cost: int
+    timestamp: float
+    window_result: WindowAddResult
+    response: Response | None  # the rate-limit response if the request was rejected
+
+
+class AdmissionLimiter(ABC):
+    """
+    Base class for limiters that can check requests before the response is generated.
+
+    admit is called before the response is generated and checks the estimated cost of the request
+    against the limits, so that rejected requests don't incur the cost of generating a response.
+    settle is called once the response has been generated to finalise the usage for admitted requests.
+    Instances are also callable as (single-phase) limiters for requests that weren't admitted up front.
+    """
+
+    @abstractmethod
+    async def admit(self, context: RequestContext) -> LimitAdmission | None:
+        """
+        Checks the request against the limits before the response is generated.
+        Returns None if the limiter doesn't apply to the request
+        """
+
+    @abstractmethod
+    async def settle(
+        self, context: RequestContext, admission: LimitAdmission, response: Response | None
+    ) -> Response | None:
+        """
+        Finalises the usage for an admitted request once the response has been generated.
+        response is None if no response was generated (e.g. an error occurred)
+        """
+
+    @abstractmethod
+    async def __call__(self, context: RequestContext, response: Response) -> Response:
+        """
+        Applies the limits to a request that wasn't admitted before the response was generated
+        """
+
+
+# pylint: disable-next=too-few-public-methods, too-many-instance-attributes
 class TokensPerMinuteSlidingWindow:
     """
     Represents a time window for rate-limiting based on tokens-per-minute and requests-per-10-seconds
+
+    Entries are stored in parallel lists (timestamps and the cumulative token cost before each entry)
+    with a head offset marking the oldest entry still in the window. This keeps expiry amortized O(1)
+    and allows the 10s request count and the "time when full" lookups to be answered with bisect
+    rather than scanning the full history on each request.
+    Timestamps are expected to be non-decreasing (as they are when taken from the clock).
+
+    Removed requests (e.g. requests that failed after being admitted) are kept in the entry lists and recorded
+    as tombstones (the indexes of the removed entries) that are subtracted from the window counts, so that
+    removing a request doesn't rewrite the cumulative token counts. Tombstones are discarded when they leave
+    the window.
     """
 
-    _requests: list[WindowEntry]
+    _timestamps: list[float]
+    _cumulative_tokens: list[int]  # total token cost of all entries _before_ the entry at the same index
+    _head: int  # index of the oldest entry in the window
+    _total_tokens: int  # total token cost of all entries added (cumulative_tokens values are relative to this)
     _requests_per_10_seconds: int
+    _requests_needed_for_full: int
     _tokens_per_minute: int
+    _released_indexes: list[int]  # indexes of the removed entries still in the window (in ascending order)
+    # total token cost of the removed entries _before_ the removed entry at the same index
+    _released_cumulative_tokens: list[int]
+    # total token cost of all removed entries (released_cumulative_tokens values are relative to this)
+    _released_total_tokens: int
+
+    # compact the backing lists once this many purged entries have accumulated at the head
+    _compact_threshold = 1024
 
     def __init__(self, requests_per_10_seconds: int, tokens_per_minute: int):
+        self.set_limits(requests_per_10_seconds, tokens_per_minute)
+        self._timestamps = []
+        self._cumulative_tokens = []
+        self._head = 0
+        self._total_tokens = 0
+        self._released_indexes = []
+        self._released_cumulative_tokens = []
+        self._released_total_tokens = 0
+
+    def set_limits(self, requests_per_10_seconds: int, tokens_per_minute: int):
+        """
+        Change the limits for the window. Requests already in the window count against the new limits
+        """
         self._requests_per_10_seconds = requests_per_10_seconds
+        # number of stored requests that (with the current request) fill the 10s request limit
+        self._requests_needed_for_full = max(math.floor(requests_per_10_seconds), 1)
         self._tokens_per_minute = tokens_per_minute
-        self._requests = []
 
     def _purge(self, cut_off: float):
-        while len(self._requests) > 0 and self._requests[0].timestamp <= cut_off:
-            self._requests.pop(0)
-
-    def _calculate_window_counts_for_request(self, token_cost: int, timestamp: float) -> tuple[int, int, float, float]:
-        # Iterate the the list in reverse order
+        timestamps = self._timestamps
+        if self._head == len(timestamps) or timestamps[self._head] > cut_off:
+            return
+        self._head = bisect.bisect_right(timestamps, cut_off, lo=self._head)
+
+        released_indexes = self._released_indexes
+        if released_indexes and released_indexes[0] < self._head:
+            released_count = bisect.bisect_left(released_indexes, self._head)
+            del released_indexes[:released_count]
+            del self._released_cumulative_tokens[:released_count]
+
+        if self._head >= self._compact_threshold and self._head * 2 >= len(self._timestamps):
+            del self._timestamps[: self._head]
+            del self._cumulative_tokens[: self._head]
+            self._released_indexes = [index - self._head for index in released_indexes]
+            self._head = 0
+
+    def _calculate_window_counts_for_request(self, token_cost: int, timestamp: float) -> tuple[int, int]:
         # Track:
         #  - the number of requests in the last 10 seconds (including this request)
         #  - the number of tokens in the last 60 seconds (including this request)
+        timestamps = self._timestamps
+        head = self._head
+        count = len(timestamps)
+
+        request_count_in_10s = 1 + count - bisect.bisect_right(timestamps, timestamp - 10, lo=head)
+        # all the requests are in the last 60s (as we purged any that are older)
+        token_count_in_60s = token_cost
+        if head < count:
+            token_count_in_60s += self._total_tokens - self._cumulative_tokens[head]
+
+        if self._released_indexes:
+            start_index_10s = count + 1 - request_count_in_10s
+            request_count_in_10s -= self._get_released_counts_from(start_index_10s)[0]
+            token_count_in_60s -= self._released_total_tokens - self._released_cumulative_tokens[0]
+
+        return request_count_in_10s, token_count_in_60s
+
+    def _get_released_counts_from(self, index: int) -> tuple[int, int]:
+        """
+        Returns the number and token cost of the removed entries from the entry at index onwards
+        """
+        released_index = bisect.bisect_left(self._released_indexes, index)
+        released_count = len(self._released_indexes) - released_index
+        if released_count == 0:
+            return 0, 0
+        return released_count, self._released_total_tokens - self._released_cumulative_tokens[released_index]
+
+    def _calculate_full_times_for_request(self, token_cost: int) -> tuple[float, float]:
+        # Track:
         #  - the time when we have requests_per_10_seconds requests (including this request)
         #  - the time when we have tokens_per_minute tokens (including this request)
+        timestamps = self._timestamps
+        head = self._head
+        count = len(timestamps)
+
+        # Working back from the newest request, we're full once we have counted
+        # requests_per_10_seconds requests (including this request)
+        requests_needed = self._requests_needed_for_full
+        # Working back from the newest request, we're full at the first request i where
+        # token_cost + tokens(i..newest) > tokens_per_minute, i.e. cumulative_tokens[i] < target
+        target = self._total_tokens + token_cost - self._tokens_per_minute
+        if self._released_indexes:
+            # exclude the removed entries from i..newest (this is only needed when over the limit
+            # and the number of removed entries in the window is small, so the extra lookups are cheap)
+            entries = range(head, count)
+            requests_full_index = head - 1 + bisect.bisect_right(
+                entries, -requests_needed, key=lambda i: self._get_released_counts_from(i)[0] + i - count
+            )
+            full_index = head - 1 + bisect.bisect_left(
+                entries, target, key=lambda i: self._cumulative_tokens[i] + self._get_released_counts_from(i)[1]
+            )
+        else:
+            requests_full_index = count - requests_needed
+            full_index = bisect.bisect_left(self._cumulative_tokens, target, lo=head, hi=count) - 1
 
-        request_count_in_10s = 1
-        token_count_in_60s = token_cost
-        requests_count = 1
-        tokens_count = token_cost
-        requests_full_time = -math.inf
-        tokens_full_time = -math.inf
-        for i in range(len(self._requests) - 1, -1, -1):
-            request = self._requests[i]
-
-            if requests_count <= self._requests_per_10_seconds:
-                requests_count += 1
-
-            if tokens_count <= self._tokens_per_minute:
-                tokens_count += request.token_cost
-
-            if requests_full_time == -math.inf and requests_count > self._requests_per_10_seconds:
-                # we're full at the last request
-                # so have space once this request expires
-                requests_full_time = self._requests[i].timestamp
-            if tokens_full_time == -math.inf and tokens_count > self._tokens_per_minute:
-                # we're full at the last request
-                # so have space once this request expires
-                tokens_full_time = self._requests[i].timestamp
-
-            if request.timestamp > timestamp - 10:
-                request_count_in_10s += 1
-            # if request.timestamp > timestamp - 60:
-            # all the requests are in the last 60s (as we purged any that are older)
-            token_count_in_60s += request.token_cost
-
-        return request_count_in_10s, token_count_in_60s, requests_full_time, tokens_full_time
+        requests_full_time = timestamps[requests_full_index] if requests_full_index >= head else -math.inf
+        tokens_full_time = timestamps[full_index] if full_index >= head else -math.inf
+
+        return requests_full_time, tokens_full_time
+
+    def _append(self, timestamp: float, token_cost: int):
+        self._timestamps.append(timestamp)
+        self._cumulative_tokens.append(self._total_tokens)
+        self._total_tokens += token_cost
 
     def add_request(self, token_cost: int, timestamp: float = -1) -> WindowAddResult:
         """
         Add a request to the window
         """
         if timestamp == -1:
-            timestamp = time.time()
+            timestamp = simulator_clock.time()
 
         # remove items older than a minute
         self._purge(timestamp - 60)
 
-        request_count_in_10s, token_count_in_60s, requests_full_time, tokens_full_time = (
-            self._calculate_window_counts_for_request(token_cost=token_cost, timestamp=timestamp)
+        request_count_in_10s, token_count_in_60s = self._calculate_window_counts_for_request(
+            token_cost=token_cost, timestamp=timestamp
         )
 
         # If requests_full_duration is less than 10 then we need less than 10 seconds of history
@@ -188,6 +295,8 @@ class TokensPerMinuteSlidingWindow:
         # to exceed the tokens_per_minute limit, i.e. we already used the limit for the current 60s window
         # if requests_full_duration < 10 or tokens_full_duration < 60:
         if token_count_in_60s > self._tokens_per_minute or request_count_in_10s > self._requests_per_10_seconds:
+            requests_full_time, tokens_full_time = self._calculate_full_times_for_request(token_cost=token_cost)
+
             # Edge case where we've hit the max tokens and the current request is for max_tokens
             # but haven't hit the request limit
             # in this case, we wait until the last saved request is out of the window
@@ -196,7 +305,7 @@ class TokensPerMinuteSlidingWindow:
                 and requests_full_time == -math.inf
                 and tokens_full_time == -math.inf
             ):
-                tokens_full_time = self._requests[-1].timestamp
+                tokens_full_time = self._timestamps[-1]
 
             # calculate the duration to have a full request count
             requests_full_duration = timestamp - requests_full_time
@@ -226,9 +335,7 @@ class TokensPerMinuteSlidingWindow:
             )
 
         # We have enough capacity to add the request
-        self._requests.append(WindowEntry(timestamp, token_cost))
-        # token_count_in_60s += token_cost
-        # request_count_in_10s += 1
+        self._append(timestamp, token_cost)
         return WindowAddResult(
             success=True,
             retry_after=None,
@@ -237,6 +344,39 @@ class TokensPerMinuteSlidingWindow:
             remaining_requests=self._requests_per_10_seconds - request_count_in_10s,
         )
 
+    def remove_request(self, token_cost: int, timestamp: float):
+        """
+        Remove a request previously added to the window (e.g. when an admitted request fails).
+        Does nothing if the request is no longer in the window
+        """
+        timestamps = self._timestamps
+        cumulative_tokens = self._cumulative_tokens
+        released_indexes = self._released_indexes
+        count = len(timestamps)
+        index = bisect.bisect_left(timestamps, timestamp, lo=self._head)
+        while index < count and timestamps[index] == timestamp:
+            next_cumulative_tokens = cumulative_tokens[index + 1] if index + 1 < count else self._total_tokens
+            released_index = bisect.bisect_left(released_indexes, index)
+            is_released = released_index < len(released_indexes) and released_indexes[released_index] == index
+            if next_cumulative_tokens - cumulative_tokens[index] == token_cost and not is_released:
+                # record a tombstone for the entry rather than removing it from the lists
+                released_indexes.insert(released_index, index)
+                released_cumulative_tokens = self._released_cumulative_tokens
+                released_cumulative_tokens.insert(
+                    released_index,
+                    (
+                        released_cumulative_tokens[released_index]
+                        if released_index < len(released_cumulative_tokens)
+                        else self._released_total_tokens
+                    ),
+                )
+                # update the later tombstones (removed requests are normally the most recent, so this is short)
+                for later_index in range(released_index + 1, len(released_cumulative_tokens)):
+                    released_cumulative_tokens[later_index] += token_cost
+                self._released_total_tokens += token_cost
+                return
+            index += 1
+
 
 # pylint: disable-next=too-few-public-methods
 class RequestsPerMinuteSlidingWindow:
@@ -244,16 +384,22 @@ class RequestsPerMinuteSlidingWindow:
     Represents a time window for rate-limiting based on requests-per-minute
     """
 
-    _requests: list[WindowEntry]
+    _requests: deque[WindowEntry]
     _requests_per_minute: int
 
     def __init__(self, requests_per_minute: int):
         self._requests_per_minute = requests_per_minute
-        self._requests = []
+        self._requests = deque()
+
+    def set_limits(self, requests_per_minute: int):
+        """
+        Change the limit for the window. Requests already in the window count against the new limit
+        """
+        self._requests_per_minute = requests_per_minute
 
     def _purge(self, cut_off: float):
         while len(self._requests) > 0 and self._requests[0].timestamp <= cut_off:
-            self._requests.pop(0)
+            self._requests.popleft()
 
     def add_request(self, timestamp: float = -1) -> WindowAddResult:
         """
@@ -261,7 +407,7 @@ class RequestsPerMinuteSlidingWindow:
         """
 
         if timestamp == -1:
-            timestamp = time.time()
+            timestamp = simulator_clock.time()
 
         # remove items older than a minute
         self._purge(timestamp - 60)
@@ -284,133 +430,632 @@ class RequestsPerMinuteSlidingWindow:
             remaining_tokens=None,
         )
 
+    def remove_request(self, timestamp: float):
+        """
+        Remove a request previously added to the window (e.g. when an admitted request fails).
+        Does nothing if the request is no longer in the window
+        """
+        try:
+            self._requests.remove(WindowEntry(timestamp, 0))
+        except ValueError:
+            pass
 
-def create_openai_tokens_limiter(
-    deployments: dict[str, OpenAIDeployment],
-) -> Callable[[RequestContext, Response], Response | None]:
-    # dict of TokensPerMinuteSlidingWindow objects keyed on deployment name
-    deployment_limits: dict[str, TokensPerMinuteSlidingWindow] = {}
 
-    for deployment in deployments.values():
-        # only handle token-based limited models
-        if deployment.model.is_token_limited:
-            tokens_per_minute = deployment.tokens_per_minute
-            requests_per_10s = math.ceil(tokens_per_minute / 1000)  # 1/6 * (6 * TPM / 1000)
-            deployment_limits[deployment.name] = TokensPerMinuteSlidingWindow(
-                requests_per_10_seconds=requests_per_10s, tokens_per_minute=tokens_per_minute
+class _PerSecondBuckets:
+    """
+    Ring buffer of per-second counters covering a window of window_seconds.
+
+    Values added at timestamp t are stored in the bucket for second floor(t).
+    A bucket is counted until the clock reaches the start of the second window_seconds + 1 after it,
+    i.e. the window spans window_seconds + 1 buckets. This means that the buckets never under-count
+    the values in the exact sliding window (but may over-count by up to 1 second's worth of values).
+
+    All state is held in a flat sequence of ints (starting at offset) so that it can be backed by
+    either a list or shared memory: [current_second, total, bucket_0, ..., bucket_n]
+    """
+
+    _storage: MutableSequence[int]
+    _offset: int
+    _size: int
+
+    def __init__(self, window_seconds: int, storage: MutableSequence[int] | None = None, offset: int = 0):
+        self._size = window_seconds + 1
+        self._storage = storage if storage is not None else [0] * _PerSecondBuckets.slot_count(window_seconds)
+        self._offset = offset
+
+    @staticmethod
+    def slot_count(window_seconds: int) -> int:
+        """Returns the number of ints of storage needed for a window of window_seconds"""
+        return window_seconds + 3
+
+    @property
+    def total(self) -> int:
+        return self._storage[self._offset + 1]
+
+    def advance(self, second: int):
+        """Move the window forward to the specified second, expiring buckets that have left the window"""
+        storage = self._storage
+        offset = self._offset
+        current_second = storage[offset]
+        if second <= current_second:
+            # time hasn't moved (or has gone backwards) - keep adding to the current bucket
+            return
+        size = self._size
+        values_offset = offset + 2
+        if second - current_second >= size:
+            for index in range(size):
+                storage[values_offset + index] = 0
+            storage[offset + 1] = 0
+        else:
+            total = storage[offset + 1]
+            for expired_second in range(current_second + 1, second + 1):
+                index = values_offset + expired_second % size
+                total -= storage[index]
+                storage[index] = 0
+            storage[offset + 1] = total
+        storage[offset] = second
+
+    def add(self, value: int):
+        storage = self._storage
+        offset = self._offset
+        storage[offset + 2 + storage[offset] % self._size] += value
+        storage[offset + 1] += value
+
+    def remove(self, value: int, second: int):
+        """Remove a value previously added at second (if that bucket is still in the window)"""
+        storage = self._storage
+        offset = self._offset
+        current_second = storage[offset]
+        if second > current_second or second <= current_second - self._size:
+            return
+        index = offset + 2 + second % self._size
+        value = min(value, storage[index])
+        storage[index] -= value
+        storage[offset + 1] -= value
+
+    def time_until_freed(self, amount: int, timestamp: float) -> float | None:
+        """
+        Returns the time (from timestamp) until at least amount has expired from the window.
+        If the window doesn't hold that amount, returns the time until the newest non-empty bucket expires.
+        Returns None if the window is empty
+        """
+        storage = self._storage
+        size = self._size
+        values_offset = self._offset + 2
+        current_second = storage[self._offset]
+        freed = 0
+        last_non_empty_second = None
+        for second in range(current_second - size + 1, current_second + 1):
+            value = storage[values_offset + second % size]
+            if value == 0:
+                continue
+            freed += value
+            last_non_empty_second = second
+            if freed >= amount:
+                break
+        if last_non_empty_second is None:
+            return None
+        return last_non_empty_second + size - timestamp
+
+
+# pylint: disable-next=too-few-public-methods
+class TokensPerMinuteBucketedWindow:
+    """
+    Approximate alternative to TokensPerMinuteSlidingWindow that tracks tokens and requests in per-second
+    buckets rather than storing an entry per request.
+    Memory use is fixed regardless of request rate and the cost of adding a request doesn't grow with traffic.
+
+    The buckets never admit more than the configured limits in any window, but because requests are
+    grouped by second, requests may be throttled up to 1 second earlier than with the exact sliding window
+    and retry_after may be up to 1 second longer than the exact value.
+    """
+
+    _requests_per_10_seconds: int
+    _tokens_per_minute: int
+    _tokens: _PerSecondBuckets
+    _requests: _PerSecondBuckets
+
+    # number of ints of storage needed for the window state
+    storage_size = _PerSecondBuckets.slot_count(60) + _PerSecondBuckets.slot_count(10)
+
+    def __init__(
+        self, requests_per_10_seconds: int, tokens_per_minute: int, storage: MutableSequence[int] | None = None
+    ):
+        self._requests_per_10_seconds = requests_per_10_seconds
+        self._tokens_per_minute = tokens_per_minute
+        if storage is None:
+            storage = [0] * self.storage_size
+        self._tokens = _PerSecondBuckets(60, storage, offset=0)
+        self._requests = _PerSecondBuckets(10, storage, offset=_PerSecondBuckets.slot_count(60))
+
+    def set_limits(self, requests_per_10_seconds: int, tokens_per_minute: int):
+        """
+        Change the limits for the window. Requests already in the window count against the new limits
+        """
+        self._requests_per_10_seconds = requests_per_10_seconds
+        self._tokens_per_minute = tokens_per_minute
+
+    def add_request(self, token_cost: int, timestamp: float = -1) -> WindowAddResult:
+        """
+        Add a request to the window
+        """
+        if timestamp == -1:
+            timestamp = simulator_clock.time()
+
+        second = math.floor(timestamp)
+        self._tokens.advance(second)
+        self._requests.advance(second)
+
+        request_count_in_10s = self._requests.total + 1
+        token_count_in_60s = self._tokens.total + token_cost
+
+        if token_count_in_60s > self._tokens_per_minute or request_count_in_10s > self._requests_per_10_seconds:
+            # If a window is empty then the limit is exceeded by this request alone
+            # so use the full window duration as the time to reset
+            time_to_reset_requests = -math.inf
+            if request_count_in_10s > self._requests_per_10_seconds:
+                time_to_reset_requests = self._requests.time_until_freed(
+                    request_count_in_10s - self._requests_per_10_seconds, timestamp
+                )
+                if time_to_reset_requests is None:
+                    time_to_reset_requests = 10
+            time_to_reset_tokens = -math.inf
+            if token_count_in_60s > self._tokens_per_minute:
+                time_to_reset_tokens = self._tokens.time_until_freed(
+                    token_count_in_60s - self._tokens_per_minute, timestamp
+                )
+                if time_to_reset_tokens is None:
+                    time_to_reset_tokens = 60
+
+            if time_to_reset_requests > time_to_reset_tokens:
+                reason = "requests"
+                retry_after = math.ceil(time_to_reset_requests)
+            else:
+                reason = "tokens"
+                retry_after = math.ceil(time_to_reset_tokens)
+
+            return WindowAddResult(
+                success=False,
+                retry_after=retry_after,
+                retry_reason=reason,
+                remaining_tokens=None,
+                remaining_requests=None,
             )
 
-    async def limiter(context: RequestContext, response: Response) -> Awaitable[Response]:
-        deployment_name = context.values.get(constants.SIMULATOR_KEY_DEPLOYMENT_NAME)
-        if not deployment_name:
-            logger.warning("openai_limiter: deployment name not found in context")
+        self._tokens.add(token_cost)
+        self._requests.add(1)
+        return WindowAddResult(
+            success=True,
+            retry_after=None,
+            retry_reason=None,
+            remaining_tokens=self._tokens_per_minute - token_count_in_60s,
+            remaining_requests=self._requests_per_10_seconds - request_count_in_10s,
+        )
 
-        window: TokensPerMinuteSlidingWindow = deployment_limits.get(deployment_name)
-        if not window:
-            if not deployment_warnings_issues.get(deployment_name):
-                logger.warning("Deployment %s not found in limiters - not applying rate limits", deployment_name)
-                deployment_warnings_issues[deployment_name] = True
-            return response
+    def remove_request(self, token_cost: int, timestamp: float):
+        """
+        Remove a request previously added to the window (e.g. when an admitted request fails).
+        Does nothing if the request is no longer in the window
+        """
+        second = math.floor(timestamp)
+        self._tokens.remove(token_cost, second)
+        self._requests.remove(1, second)
+
+
+# pylint: disable-next=too-few-public-methods
+class RequestsPerMinuteBucketedWindow:
+    """
+    Approximate alternative to RequestsPerMinuteSlidingWindow that tracks requests in per-second buckets.
+    See TokensPerMinuteBucketedWindow for details of the approximation.
+    """
+
+    _requests_per_minute: int
+    _requests: _PerSecondBuckets
+
+    # number of ints of storage needed for the window state
+    storage_size = _PerSecondBuckets.slot_count(60)
+
+    def __init__(self, requests_per_minute: int, storage: MutableSequence[int] | None = None):
+        self._requests_per_minute = requests_per_minute
+        self._requests = _PerSecondBuckets(60, storage)
+
+    def set_limits(self, requests_per_minute: int):
+        """
+        Change the limit for the window. Requests already in the window count against the new limit
+        """
+        self._requests_per_minute = requests_per_minute
+
+    def add_request(self, timestamp: float = -1) -> WindowAddResult:
+        """
+        Add a request to the window
+        """
+        if timestamp == -1:
+            timestamp = simulator_clock.time()
 
-        token_cost = await determine_token_cost(context)
-        window_result = window.add_request(token_cost=token_cost)
-        if not window_result.success:
-            cost = token_cost if window_result.retry_reason == "tokens" else 1
-            simulator_metrics.histogram_rate_limit.record(
-                cost,
-                attributes={
-                    "deployment": deployment_name,
-                    "reason": window_result.retry_reason,
-                },
+        self._requests.advance(math.floor(timestamp))
+
+        if self._requests.total >= self._requests_per_minute:
+            time_to_reset = self._requests.time_until_freed(
+                self._requests.total + 1 - self._requests_per_minute, timestamp
+            )
+            return WindowAddResult(
+                success=False,
+                retry_after=math.ceil(time_to_reset) if time_to_reset is not None else 60,
+                retry_reason="requests",
+                remaining_tokens=None,
+                remaining_requests=None,
             )
 
-            content = {
-                "error": {
-                    "code": "429",
-                    "message": "Requests to the OpenAI API Simulator have exceeded call rate limit. "
-                    + f"Please retry after {window_result.retry_after} seconds.",
-                }
+        self._requests.add(1)
+        return WindowAddResult(
+            success=True,
+            retry_after=None,
+            retry_reason=None,
+            remaining_requests=self._requests_per_minute - self._requests.total,
+            remaining_tokens=None,
+        )
+
+    def remove_request(self, timestamp: float):
+        """
+        Remove a request previously added to the window (e.g. when an admitted request fails).
+        Does nothing if the request is no longer in the window
+        """
+        self._requests.remove(1, math.floor(timestamp))
+
+
+class LimiterStore(ABC):
+    """
+    Creates the windows that hold the rate-limiting state for deployments.
+
+    Windows have an add_request method that returns a WindowAddResult and a remove_request method
+    to release a previously added request (these may return awaitables for stores that need to perform I/O).
+    Windows also have a set_limits method (taking the same limits as the create method) to change the limits
+    in place without discarding the requests already in the window
+    """
+
+    @abstractmethod
+    def create_tokens_window(self, deployment: OpenAIDeployment, requests_per_10_seconds: int, tokens_per_minute: int):
+        pass
+
+    @abstractmethod
+    def create_requests_window(self, deployment: OpenAIDeployment, requests_per_minute: int):
+        pass
+
+
+class InMemoryLimiterStore(LimiterStore):
+    """
+    Default store that holds rate-limiting state in the worker process
+    """
+
+    def create_tokens_window(
+        self, deployment: OpenAIDeployment, requests_per_10_seconds: int, tokens_per_minute: int
+    ) -> TokensPerMinuteSlidingWindow | TokensPerMinuteBucketedWindow:
+        if deployment.rate_limit_mode == constants.RATE_LIMIT_MODE_BUCKETED:
+            return TokensPerMinuteBucketedWindow(
+                requests_per_10_seconds=requests_per_10_seconds, tokens_per_minute=tokens_per_minute
+            )
+        return TokensPerMinuteSlidingWindow(
+            requests_per_10_seconds=requests_per_10_seconds, tokens_per_minute=tokens_per_minute
+        )
+
+    def create_requests_window(
+        self, deployment: OpenAIDeployment, requests_per_minute: int
+    ) -> RequestsPerMinuteSlidingWindow | RequestsPerMinuteBucketedWindow:
+        if deployment.rate_limit_mode == constants.RATE_LIMIT_MODE_BUCKETED:
+            return RequestsPerMinuteBucketedWindow(requests_per_minute)
+        return RequestsPerMinuteSlidingWindow(requests_per_minute)
+
+
+def get_limiter_store(rate_limit: RateLimitConfig | None) -> LimiterStore:
+    if rate_limit is None or rate_limit.store == constants.RATE_LIMIT_STORE_MEMORY:
+        return InMemoryLimiterStore()
+    if rate_limit.store == constants.RATE_LIMIT_STORE_SHARED_MEMORY:
+        # imported here as the shared memory store builds on the windows in this module
+        # pylint: disable-next=import-outside-toplevel
+        from aoai_api_simulator.limiters_shared_memory import SharedMemoryLimiterStore
+
+        return SharedMemoryLimiterStore(rate_limit.shared_memory_dir)
+    if rate_limit.store == constants.RATE_LIMIT_STORE_REDIS:
+        # imported here as the redis package is only required when using the redis store
+        # pylint: disable-next=import-outside-toplevel
+        from aoai_api_simulator.limiters_redis import RedisLimiterStore
+
+        return RedisLimiterStore(url=rate_limit.redis_url, key_prefix=rate_limit.redis_key_prefix)
+    raise ValueError(f"Unsupported rate limit store: {rate_limit.store}")
+
+
+# Matches the OpenAI routes that are rate-limited and maps the operation part of the path to the operation name
+_openai_route = re.compile(
+    r"^/openai/deployments/(?P<deployment>[^/]+)/"
+    r"(?P<operation>embeddings|completions|chat/completions|audio/translations)$"
+)
+_openai_route_operations = {
+    "embeddings": constants.OPENAI_OPERATION_EMBEDDINGS,
+    "completions": constants.OPENAI_OPERATION_COMPLETIONS,
+    "chat/completions": constants.OPENAI_OPERATION_CHAT_COMPLETIONS,
+    "audio/translations": constants.OPENAI_OPERATION_TRANSLATION,
+}
+
+
+def _has_valid_api_key(context: RequestContext) -> bool:
+    request_api_key = context.request.headers.get("api-key")
+    return bool(request_api_key) and secrets.compare_digest(request_api_key, context.config.simulator_api_key)
+
+
+async def _resolve(value):
+    # window methods return awaitables for stores that need to perform I/O
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+class _OpenAIDeploymentLimiter(AdmissionLimiter):
+    """
+    Base class for the OpenAI limiters that hold a window per deployment
+    """
+
+    # the operations (e.g. OPENAI_OPERATION_EMBEDDINGS) that the limiter applies to
+    _operations: set[str]
+    # whether to include x-ratelimit-reset-* headers in rate-limit responses
+    _include_reset_headers: bool
+
+    def __init__(self, deployments: dict[str, OpenAIDeployment], store: LimiterStore | None = None):
+        self._store = store if store is not None else InMemoryLimiterStore()
+        # dict of windows (e.g. TokensPerMinuteSlidingWindow) keyed on deployment name
+        self._deployment_limits = {}
+        # rate_limit_mode that each window was created for, keyed on deployment name
+        self._deployment_modes = {}
+        self.update_deployments(deployments)
+
+    @abstractmethod
+    def _get_window_limits(self, deployment: OpenAIDeployment) -> dict[str, int] | None:
+        """
+        Returns the limits to create the window for the deployment with (or None if the limiter doesn't apply)
+        """
+
+    @abstractmethod
+    def _create_window(self, deployment: OpenAIDeployment, limits: dict[str, int]):
+        pass
+
+    def update_deployments(self, deployments: dict[str, OpenAIDeployment]):
+        """
+        Update the windows to match the deployments without discarding the rate-limiting state.
+        Existing windows are kept (with their limits updated in place) so that requests already in
+        the window continue to count. Windows are created for new deployments (or when the rate_limit_mode
+        changes) and removed for deployments that no longer exist
+        """
+        deployment_limits = {}
+        deployment_modes = {}
+        for deployment in deployments.values():
+            limits = self._get_window_limits(deployment)
+            if limits is None:
+                continue
+            window = self._deployment_limits.get(deployment.name)
+            if window is not None and self._deployment_modes[deployment.name] == deployment.rate_limit_mode:
+                window.set_limits(**limits)
+            else:
+                window = self._create_window(deployment, limits)
+            deployment_limits[deployment.name] = window
+            deployment_modes[deployment.name] = deployment.rate_limit_mode
+
+        # replace (rather than mutate) the dictionaries as requests may be in progress
+        self._deployment_limits = deployment_limits
+        self._deployment_modes = deployment_modes
+
+    @abstractmethod
+    async def _determine_cost(self, context: RequestContext) -> int:
+        pass
+
+    @abstractmethod
+    def _add_request(self, window, token_cost: int, timestamp: float):
+        pass
+
+    @abstractmethod
+    def _remove_request(self, window, token_cost: int, timestamp: float):
+        pass
+
+    def _create_limit_response(self, deployment_name: str, token_cost: int, window_result: WindowAddResult):
+        cost = token_cost if window_result.retry_reason == "tokens" else 1
+        simulator_metrics.histogram_rate_limit.record(
+            cost,
+            attributes={
+                "deployment": deployment_name,
+                "reason": window_result.retry_reason,
+            },
+        )
+
+        # retry_after is in simulated time so convert to real time for the client
+        retry_after_s = simulator_clock.to_real_duration(window_result.retry_after)
+        retry_after = str(math.ceil(retry_after_s))
+        content = {
+            "error": {
+                "code": "429",
+                "message": "Requests to the OpenAI API Simulator have exceeded call rate limit. "
+                + f"Please retry after {retry_after} seconds.",
             }
+        }
 
+        headers = {"Retry-After": retry_after, "retry-after-ms": str(math.ceil(retry_after_s * 1000))}
+        if self._include_reset_headers:
             retry_after_header = (
                 "x-ratelimit-reset-tokens" if window_result.retry_reason == "tokens" else "x-ratelimit-reset-requests"
             )
-            return Response(
-                status_code=429,
-                content=json.dumps(content),
-                headers={
-                    "Retry-After": str(window_result.retry_after),
-                    retry_after_header: str(window_result.retry_after),
-                },
-            )
-        response.headers["x-ratelimit-remaining-tokens"] = str(window_result.remaining_tokens)
-        response.headers["x-ratelimit-remaining-requests"] = str(window_result.remaining_requests)
-        return response
-
-    return limiter
+            headers[retry_after_header] = retry_after
+        return Response(status_code=429, content=json.dumps(content), headers=headers)
 
+    def _set_remaining_headers(self, response: Response, window_result: WindowAddResult):
+        if window_result.remaining_tokens is not None:
+            response.headers["x-ratelimit-remaining-tokens"] = str(window_result.remaining_tokens)
+        response.headers["x-ratelimit-remaining-requests"] = str(window_result.remaining_requests)
 
-def create_openai_requests_limiter(
-    deployments: dict[str, OpenAIDeployment],
-) -> Callable[[RequestContext, Response], Response | None]:
-    # dict of RequestsPerMinuteSlidingWindow objects keyed on deployment name
-    deployment_limits: dict[str, RequestsPerMinuteSlidingWindow] = {}
+    async def _check(self, context: RequestContext, deployment_name: str, window) -> LimitAdmission:
+        token_cost = await self._determine_cost(context)
+        # take the timestamp once the cost is known (rather than when the request arrived) so that concurrent
+        # requests are added to the window in timestamp order regardless of how long their costs take
+        timestamp = simulator_clock.time()
+        window_result = await _resolve(self._add_request(window, token_cost, timestamp))
+        return LimitAdmission(
+            limiter_name=None,
+            deployment_name=deployment_name,
+            token_cost=token_cost,
+            timestamp=timestamp,
+            window_result=window_result,
+            response=(
+                None
+                if window_result.success
+                else self._create_limit_response(deployment_name, token_cost, window_result)
+            ),
+        )
 
-    for deployment in deployments.values():
-        # only handle request-based limited models
-        if not deployment.model.is_token_limited:
-            requests_per_minute = deployment.requests_per_minute
-            deployment_limits[deployment.name] = RequestsPerMinuteSlidingWindow(requests_per_minute)
+    async def admit(self, context: RequestContext) -> LimitAdmission | None:
+        request = context.request
+        if request.method != "POST":
+            return None
+        match = _openai_route.match(request.url.path)
+        if not match:
+            return None
+        operation_name = _openai_route_operations[match["operation"]]
+        deployment_name = match["deployment"]
+        window = self._deployment_limits.get(deployment_name)
+        if window is None or operation_name not in self._operations:
+            return None
+        if not _has_valid_api_key(context):
+            # leave the request to be rejected when generating the response
+            # so that unauthenticated requests don't count towards the limits
+            return None
+
+        context.values[constants.SIMULATOR_KEY_OPERATION_NAME] = operation_name
+        context.values[constants.SIMULATOR_KEY_DEPLOYMENT_NAME] = deployment_name
+        try:
+            return await self._check(context, deployment_name, window)
+        except ValueError:
+            # The request body is invalid (e.g. not JSON) - leave the request to be handled
+            # when generating the response
+            return None
+
+    async def settle(self, context: RequestContext, admission: LimitAdmission, response: Response | None):
+        if response is None or response.status_code >= 300:
+            # Only successful requests count towards the limits
+            window = self._deployment_limits[admission.deployment_name]
+            await _resolve(self._remove_request(window, admission.token_cost, admission.timestamp))
+            return response
+        self._set_remaining_headers(response, admission.window_result)
+        return response
 
-    async def limiter(context: RequestContext, response: Response) -> Awaitable[Response]:
+    async def __call__(self, context: RequestContext, response: Response) -> Response:
         deployment_name = context.values.get(constants.SIMULATOR_KEY_DEPLOYMENT_NAME)
         if not deployment_name:
             logger.warning("openai_limiter: deployment name not found in context")
 
-        window: RequestsPerMinuteSlidingWindow = deployment_limits.get(deployment_name)
+        window = self._deployment_limits.get(deployment_name)
         if not window:
             if not deployment_warnings_issues.get(deployment_name):
                 logger.warning("Deployment %s not found in limiters - not applying rate limits", deployment_name)
                 deployment_warnings_issues[deployment_name] = True
             return response
 
-        window_result = window.add_request()
-        if not window_result.success:
-            simulator_metrics.histogram_rate_limit.record(
-                1,
-                attributes={
-                    "deployment": deployment_name,
-                    "reason": window_result.retry_reason,
-                },
-            )
+        admission = await self._check(context, deployment_name, window)
+        if admission.response:
+            return admission.response
+        self._set_remaining_headers(response, admission.window_result)
+        return response
 
-            content = {
-                "error": {
-                    "code": "429",
-                    "message": "Requests to the OpenAI API Simulator have exceeded call rate limit. "
-                    + f"Please retry after {window_result.retry_after} seconds.",
-                }
-            }
 
-            return Response(
-                status_code=429,
-                content=json.dumps(content),
-                headers={
-                    "Retry-After": str(window_result.retry_after),
-                },
-            )
-        response.headers["x-ratelimit-remaining-requests"] = str(window_result.remaining_requests)
-        return response
+class OpenAITokensLimiter(_OpenAIDeploymentLimiter):
+    """
+    Limiter for OpenAI deployments that are rate-limited using tokens-per-minute (and requests-per-10-seconds)
+    """
+
+    _operations = {
+        constants.OPENAI_OPERATION_EMBEDDINGS,
+        constants.OPENAI_OPERATION_COMPLETIONS,
+        constants.OPENAI_OPERATION_CHAT_COMPLETIONS,
+    }
+    _include_reset_headers = True
+
+    def _get_window_limits(self, deployment: OpenAIDeployment) -> dict[str, int] | None:
+        # only handle token-based limited models
+        if not deployment.model.is_token_limited:
+            return None
+        tokens_per_minute = deployment.tokens_per_minute
+        requests_per_10s = math.ceil(tokens_per_minute / 1000)  # 1/6 * (6 * TPM / 1000)
+        return {"requests_per_10_seconds": requests_per_10s, "tokens_per_minute": tokens_per_minute}
+
+    def _create_window(self, deployment: OpenAIDeployment, limits: dict[str, int]):
+        return self._store.create_tokens_window(deployment, **limits)
+
+    async def _determine_cost(self, context: RequestContext) -> int:
+        return await determine_token_cost(context)
+
+    def _add_request(self, window, token_cost: int, timestamp: float):
+        return window.add_request(token_cost=token_cost, timestamp=timestamp)
 
-    return limiter
+    def _remove_request(self, window, token_cost: int, timestamp: float):
+        return window.remove_request(token_cost=token_cost, timestamp=timestamp)
+
+
+class OpenAIRequestsLimiter(_OpenAIDeploymentLimiter):
+    """
+    Limiter for OpenAI deployments that are rate-limited using requests-per-minute (e.g. whisper)
+    """
+
+    _operations = {constants.OPENAI_OPERATION_TRANSLATION}
+    _include_reset_headers = False
+
+    def _get_window_limits(self, deployment: OpenAIDeployment) -> dict[str, int] | None:
+        # only handle request-based limited models
+        if deployment.model.is_token_limited:
+            return None
+        return {"requests_per_minute": deployment.requests_per_minute}
 
+    def _create_window(self, deployment: OpenAIDeployment, limits: dict[str, int]):
+        return self._store.create_requests_window(deployment, **limits)
 
-def get_default_limiters(config: Config):
+    async def _determine_cost(self, context: RequestContext) -> int:
+        return 0
+
+    def _add_request(self, window, token_cost: int, timestamp: float):
+        return window.add_request(timestamp=timestamp)
+
+    def _remove_request(self, window, token_cost: int, timestamp: float):
+        return window.remove_request(timestamp=timestamp)
+
+
+def create_openai_tokens_limiter(
+    deployments: dict[str, OpenAIDeployment],
+    store: LimiterStore | None = None,
+) -> OpenAITokensLimiter:
+    return OpenAITokensLimiter(deployments, store)
+
+
+def create_openai_requests_limiter(
+    deployments: dict[str, OpenAIDeployment],
+    store: LimiterStore | None = None,
+) -> OpenAIRequestsLimiter:
+    return OpenAIRequestsLimiter(deployments, store)
+
+
+def get_default_limiters(config: Config, previous_config: Config | None = None):
     # Dictionary of limiters keyed by name
     # Each limiter is a function that takes a response and returns a boolean indicating
     # whether the request should be allowed
     # Limiter returns Response object if request should be blocked or None otherwise
+
+    # When updating a config (e.g. via the config API) the existing limiters are updated in place so that
+    # the rate-limiting state isn't lost (which would allow a burst of requests above the limits)
+    if previous_config is not None and previous_config.rate_limit == config.rate_limit:
+        tokens_limiter = previous_config.limiters.get(constants.LIMITER_OPENAI_TOKENS)
+        requests_limiter = previous_config.limiters.get(constants.LIMITER_OPENAI_REQUESTS)
+        if isinstance(tokens_limiter, OpenAITokensLimiter) and isinstance(requests_limiter, OpenAIRequestsLimiter):
+            tokens_limiter.update_deployments(config.openai_deployments or {})
+            requests_limiter.update_deployments(config.openai_deployments or {})
+            return {
+                constants.LIMITER_OPENAI_TOKENS: tokens_limiter,
+                constants.LIMITER_OPENAI_REQUESTS: requests_limiter,
+            }
+
+    store = get_limiter_store(config.rate_limit)
     return {
-        constants.LIMITER_OPENAI_TOKENS: create_openai_tokens_limiter(config.openai_deployments or {}),
-        constants.LIMITER_OPENAI_REQUESTS: create_openai_requests_limiter(config.openai_deployments or {}),
+        constants.LIMITER_OPENAI_TOKENS: create_openai_tokens_limiter(config.openai_deployments or {}, store),
+        constants.LIMITER_OPENAI_REQUESTS: create_openai_requests_limiter(config.openai_deployments or {}, store),
     }
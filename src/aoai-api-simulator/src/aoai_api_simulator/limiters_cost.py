@@ -0,0 +1,158 @@
+import logging
+import math
+
+from aoai_api_simulator import constants
+from aoai_api_simulator.generator.embeddings import get_embedding_inputs
+from aoai_api_simulator.generator.openai_tokens import (
+    get_max_completion_tokens,
+    num_tokens_from_input,
+    num_tokens_from_messages,
+    num_tokens_from_string,
+    num_tokens_per_input,
+)
+from aoai_api_simulator.models import RequestContext
+
+# This file contains the logic for determining the token cost of a request for rate-limiting.
+#
+# As with the service, the cost of a request is the number of prompt tokens plus the effective max_tokens
+# for the completion (embeddings only have prompt tokens).
+# In "tokenizer" mode (the default) the prompt is tokenized with the deployment's tokenizer and the count is
+# stored in context.values so that the generator doesn't need to tokenize the prompt again.
+# Equally, if the generator has already counted the prompt tokens (e.g. when the limits are applied after
+# the response is generated) then that count is reused.
+# In "heuristic" mode the prompt tokens are estimated as 4 characters per token to avoid the tokenizer cost.
+
+logger = logging.getLogger(__name__)
+
+# When max_tokens isn't set, the service uses 16 as the estimate of the completion tokens for rate-limiting
+_DEFAULT_COMPLETION_TOKENS = 16
+
+_token_cost_operations = {
+    constants.OPENAI_OPERATION_CHAT_COMPLETIONS,
+    constants.OPENAI_OPERATION_COMPLETIONS,
+    constants.OPENAI_OPERATION_EMBEDDINGS,
+}
+
+
+async def determine_token_cost(context: RequestContext) -> int:
+    operation_name = context.values.get(constants.SIMULATOR_KEY_OPERATION_NAME)
+    if operation_name is None:
+        logger.info("No operation name found in context for request: %s", context.request.url.path)
+        return 0
+
+    if operation_name == constants.OPENAI_OPERATION_TRANSLATION:
+        # Don't apply token limits to translations
+        # Also, don't read the body as it may be a stream
+        return 0
+
+    if operation_name not in _token_cost_operations:
+        # TODO: implement calculations for other endpoints
+        logger.warning(
+            "openai_limiter: unhandled endpoint %s (operation_name: %s)", context.request.url.path, operation_name
+        )
+        token_cost = 0
+    else:
+        request_body = await context.json()
+        model_name = _get_model_name(context)
+        prompt_tokens = _get_prompt_tokens(context, operation_name, request_body, model_name)
+        token_cost = prompt_tokens
+        if operation_name != constants.OPENAI_OPERATION_EMBEDDINGS:
+            token_cost += _get_completion_tokens(request_body, model_name, prompt_tokens)
+
+    context.values[constants.SIMULATOR_KEY_OPENAI_RATE_LIMIT_TOKENS] = token_cost
+    return token_cost
+
+
+def _get_model_name(context: RequestContext) -> str | None:
+    deployment_name = context.values.get(constants.SIMULATOR_KEY_DEPLOYMENT_NAME)
+    deployment = context.config.openai_deployments.get(deployment_name) if context.config.openai_deployments else None
+    return deployment.model.name if deployment else None
+
+
+def _get_prompt_tokens(context: RequestContext, operation_name: str, request_body: dict, model_name: str | None) -> int:
+    prompt_tokens = context.values.get(constants.SIMULATOR_KEY_OPENAI_PROMPT_TOKENS)
+    if prompt_tokens is not None:
+        # The prompt has already been tokenized (e.g. by the generator)
+        return prompt_tokens
+
+    if context.config.rate_limit.cost_mode == constants.RATE_LIMIT_COST_MODE_TOKENIZER and model_name:
+        try:
+            prompt_tokens = _count_prompt_tokens(context, operation_name, request_body, model_name)
+        except (AttributeError, KeyError, NotImplementedError, TypeError) as e:
+            # e.g. a chat request for an embedding deployment, message content that isn't a string
+            # (such as a list of content parts) or an invalid request body
+            # The request will be rejected when the response is generated, so fall back to the estimate
+            logger.debug("openai_limiter: unable to tokenize prompt (%s) - using estimate", e)
+        else:
+            # store the count so that the generator doesn't need to tokenize the prompt again
+            context.values[constants.SIMULATOR_KEY_OPENAI_PROMPT_TOKENS] = prompt_tokens
+            return prompt_tokens
+
+    return estimate_prompt_tokens(operation_name, request_body)
+
+
+def _count_prompt_tokens(context: RequestContext, operation_name: str, request_body: dict, model_name: str) -> int:
+    if operation_name == constants.OPENAI_OPERATION_EMBEDDINGS:
+        # store the count for each input so that the generator can check the input limits without re-tokenizing
+        input_tokens = num_tokens_per_input(get_embedding_inputs(request_body["input"]), model_name)
+        context.values[constants.SIMULATOR_KEY_OPENAI_EMBEDDING_INPUT_TOKENS] = input_tokens
+        return sum(input_tokens)
+    return count_prompt_tokens(operation_name, request_body, model_name)
+
+
+def _get_completion_tokens(request_body: dict, model_name: str | None, prompt_tokens: int) -> int:
+    requested_max_tokens = request_body.get("max_tokens")
+    if not requested_max_tokens:
+        return _DEFAULT_COMPLETION_TOKENS
+    if not model_name:
+        return requested_max_tokens
+    _, max_tokens = get_max_completion_tokens(request_body, model_name, prompt_tokens=prompt_tokens)
+    return max(max_tokens, 0)
+
+
+def count_prompt_tokens(operation_name: str, request_body: dict, model_name: str) -> int:
+    """
+    Returns the number of prompt tokens for a request using the tokenizer for the model
+    """
+    if operation_name == constants.OPENAI_OPERATION_CHAT_COMPLETIONS:
+        return num_tokens_from_messages(request_body["messages"], model_name)
+    if operation_name == constants.OPENAI_OPERATION_COMPLETIONS:
+        return num_tokens_from_string(request_body["prompt"], model_name)
+    if operation_name == constants.OPENAI_OPERATION_EMBEDDINGS:
+        return num_tokens_from_input(request_body["input"], model_name)
+    return 0
+
+
+def estimate_prompt_tokens(operation_name: str, request_body: dict) -> int:
+    """
+    Returns an estimate of the number of prompt tokens for a request based on the prompt length
+    (assuming 4 characters per token) without using a tokenizer
+    """
+    if operation_name == constants.OPENAI_OPERATION_CHAT_COMPLETIONS:
+        messages = request_body.get("messages") or []
+        characters = sum(
+            len(value) for message in messages for value in message.values() if isinstance(value, str)
+        )
+        return math.ceil(characters / 4)
+    if operation_name == constants.OPENAI_OPERATION_COMPLETIONS:
+        prompt = request_body.get("prompt") or ""
+        return math.ceil(len(prompt) / 4)
+    if operation_name == constants.OPENAI_OPERATION_EMBEDDINGS:
+        request_input = request_body.get("input")
+        if request_input is None:
+            logger.warning("openai_limiter: input not found in request body for embedding request")
+            return 0
+        if isinstance(request_input, str):
+            return math.ceil(len(request_input) / 4)
+        # TODO - validate whether we should sum the ceil values or ceil the sum
+        return sum(_estimate_input_item_tokens(item) for item in request_input)
+    return 0
+
+
+def _estimate_input_item_tokens(item: str | list | int) -> int:
+    if isinstance(item, str):
+        return math.ceil(len(item) / 4)
+    if isinstance(item, list):
+        # the item is already tokenized
+        return len(item)
+    return 1
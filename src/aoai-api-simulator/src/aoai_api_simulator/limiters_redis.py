@@ -0,0 +1,278 @@
+import math
+
+from aoai_api_simulator.clock import simulator_clock
+from aoai_api_simulator.limiters import LimiterStore, WindowAddResult
+from aoai_api_simulator.models import OpenAIDeployment
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # pragma: no cover
+    redis_asyncio = None
+
+# This file contains a Redis-backed store for rate-limiting state.
+# The store allows multiple simulator instances (e.g. replicas behind a load balancer) to enforce
+# a single set of limits for each deployment.
+#
+# Each window uses the same per-second bucket approach as TokensPerMinuteBucketedWindow in limiters.py.
+# The buckets for a window are held in a Redis hash and a Lua script performs the
+# expire/check/add steps for both the token and request limits atomically in a single round-trip.
+#
+# Hash fields (for each of the "t" (tokens) and "r" (requests) windows):
+#   <window>s    - the current second for the window
+#   <window>t    - the total of the buckets in the window
+#   <window><n>  - the value of bucket n (missing buckets are zero)
+
+_ADD_REQUEST_SCRIPT = """
+local key = KEYS[1]
+local timestamp = tonumber(ARGV[1])
+local token_cost = tonumber(ARGV[2])
+local token_limit = tonumber(ARGV[3])
+local request_limit = tonumber(ARGV[4])
+local request_window_seconds = tonumber(ARGV[5])
+local ttl_ms = tonumber(ARGV[6])
+local second = math.floor(timestamp)
+
+local function advance(window, size)
+    local current_second = tonumber(redis.call("HGET", key, window .. "s")) or 0
+    if second <= current_second then
+        return tonumber(redis.call("HGET", key, window .. "t")) or 0
+    end
+    local total = 0
+    if second - current_second >= size then
+        for index = 0, size - 1 do
+            redis.call("HDEL", key, window .. index)
+        end
+    else
+        total = tonumber(redis.call("HGET", key, window .. "t")) or 0
+        for expired_second = current_second + 1, second do
+            local field = window .. (expired_second % size)
+            total = total - (tonumber(redis.call("HGET", key, field)) or 0)
+            redis.call("HDEL", key, field)
+        end
+    end
+    redis.call("HSET", key, window .. "s", second, window .. "t", total)
+    return total
+end
+
+local function time_until_freed(window, size, amount)
+    local freed = 0
+    local last_non_empty_second = nil
+    for bucket_second = second - size + 1, second do
+        local value = tonumber(redis.call("HGET", key, window .. (bucket_second % size))) or 0
+        if value ~= 0 then
+            freed = freed + value
+            last_non_empty_second = bucket_second
+            if freed >= amount then
+                break
+            end
+        end
+    end
+    if last_non_empty_second == nil then
+        return nil
+    end
+    return last_non_empty_second + size - timestamp
+end
+
+local token_size = 61
+local request_size = request_window_seconds + 1
+
+local token_count = token_cost
+if token_limit >= 0 then
+    token_count = advance("t", token_size) + token_cost
+end
+local request_count = advance("r", request_size) + 1
+
+local tokens_exceeded = token_limit >= 0 and token_count > token_limit
+local requests_exceeded = request_count > request_limit
+if tokens_exceeded or requests_exceeded then
+    -- If a window is empty then the limit is exceeded by this request alone
+    -- so use the full window duration as the time to reset
+    local time_to_reset_requests = -math.huge
+    if requests_exceeded then
+        time_to_reset_requests = time_until_freed("r", request_size, request_count - request_limit)
+            or request_window_seconds
+    end
+    local time_to_reset_tokens = -math.huge
+    if tokens_exceeded then
+        time_to_reset_tokens = time_until_freed("t", token_size, token_count - token_limit) or 60
+    end
+    redis.call("PEXPIRE", key, ttl_ms)
+    if time_to_reset_requests > time_to_reset_tokens then
+        return {0, math.ceil(time_to_reset_requests), "requests"}
+    end
+    return {0, math.ceil(time_to_reset_tokens), "tokens"}
+end
+
+if token_limit >= 0 then
+    redis.call("HINCRBY", key, "t" .. (second % token_size), token_cost)
+    redis.call("HINCRBY", key, "tt", token_cost)
+end
+redis.call("HINCRBY", key, "r" .. (second % request_size), 1)
+redis.call("HINCRBY", key, "rt", 1)
+redis.call("PEXPIRE", key, ttl_ms)
+return {1, token_limit - token_count, request_limit - request_count}
+"""
+
+# Removes a previously added request (if its buckets are still in the windows)
+# A token cost of -1 indicates that there is no token window
+_REMOVE_REQUEST_SCRIPT = """
+local key = KEYS[1]
+local second = math.floor(tonumber(ARGV[1]))
+local token_cost = tonumber(ARGV[2])
+local request_window_seconds = tonumber(ARGV[3])
+
+local function remove(window, size, value)
+    local current_second = tonumber(redis.call("HGET", key, window .. "s")) or 0
+    if second > current_second or second <= current_second - size then
+        return
+    end
+    local field = window .. (second % size)
+    value = math.min(value, tonumber(redis.call("HGET", key, field)) or 0)
+    if value > 0 then
+        redis.call("HINCRBY", key, field, -value)
+        redis.call("HINCRBY", key, window .. "t", -value)
+    end
+end
+
+if token_cost >= 0 then
+    remove("t", 61, token_cost)
+end
+remove("r", request_window_seconds + 1, 1)
+return 1
+"""
+
+# Keep keys for a little longer than the longest window so that idle deployments are cleaned up
+_KEY_TTL_MS = 120_000
+
+
+def _to_window_add_result(result: list, is_token_limited: bool) -> WindowAddResult:
+    if result[0] == 1:
+        return WindowAddResult(
+            success=True,
+            retry_after=None,
+            retry_reason=None,
+            remaining_tokens=result[1] if is_token_limited else None,
+            remaining_requests=result[2],
+        )
+    reason = result[2].decode("utf-8") if isinstance(result[2], bytes) else result[2]
+    return WindowAddResult(
+        success=False,
+        retry_after=result[1],
+        retry_reason=reason,
+        remaining_tokens=None,
+        remaining_requests=None,
+    )
+
+
+class RedisTokensPerMinuteWindow:
+    """
+    Bucketed tokens-per-minute and requests-per-10-seconds window with the state held in Redis
+    """
+
+    def __init__(self, scripts, key: str, requests_per_10_seconds: int, tokens_per_minute: int):
+        self._add_script, self._remove_script = scripts
+        self._key = key
+        self._requests_per_10_seconds = requests_per_10_seconds
+        self._tokens_per_minute = tokens_per_minute
+
+    def set_limits(self, requests_per_10_seconds: int, tokens_per_minute: int):
+        """
+        Change the limits for the window. Requests already in the window count against the new limits
+        """
+        self._requests_per_10_seconds = requests_per_10_seconds
+        self._tokens_per_minute = tokens_per_minute
+
+    async def add_request(self, token_cost: int, timestamp: float = -1) -> WindowAddResult:
+        """
+        Add a request to the window
+        """
+        if timestamp == -1:
+            timestamp = simulator_clock.time()
+        result = await self._add_script(
+            keys=[self._key],
+            args=[timestamp, token_cost, self._tokens_per_minute, self._requests_per_10_seconds, 10, _KEY_TTL_MS],
+        )
+        return _to_window_add_result(result, is_token_limited=True)
+
+    async def remove_request(self, token_cost: int, timestamp: float):
+        """
+        Remove a request previously added to the window (e.g. when an admitted request fails)
+        """
+        await self._remove_script(keys=[self._key], args=[timestamp, token_cost, 10])
+
+
+class RedisRequestsPerMinuteWindow:
+    """
+    Bucketed requests-per-minute window with the state held in Redis
+    """
+
+    def __init__(self, scripts, key: str, requests_per_minute: int):
+        self._add_script, self._remove_script = scripts
+        self._key = key
+        self._requests_per_minute = requests_per_minute
+
+    def set_limits(self, requests_per_minute: int):
+        """
+        Change the limit for the window. Requests already in the window count against the new limit
+        """
+        self._requests_per_minute = requests_per_minute
+
+    async def add_request(self, timestamp: float = -1) -> WindowAddResult:
+        """
+        Add a request to the window
+        """
+        if timestamp == -1:
+            timestamp = simulator_clock.time()
+        # token limit of -1 disables the token window
+        result = await self._add_script(
+            keys=[self._key],
+            args=[timestamp, 0, -1, self._requests_per_minute, 60, _KEY_TTL_MS],
+        )
+        return _to_window_add_result(result, is_token_limited=False)
+
+    async def remove_request(self, timestamp: float):
+        """
+        Remove a request previously added to the window (e.g. when an admitted request fails)
+        """
+        await self._remove_script(keys=[self._key], args=[timestamp, -1, 60])
+
+
+class RedisLimiterStore(LimiterStore):
+    """
+    Store that holds rate-limiting state in Redis (or a Redis-compatible server) so that
+    limits are enforced across all simulator instances that share the server.
+    Windows are always bucketed as the state needs to be a fixed size.
+    """
+
+    def __init__(self, url: str | None = None, key_prefix: str = "aoai-api-simulator", client=None):
+        if client is None:
+            if redis_asyncio is None:
+                raise ValueError("The redis package is required for the redis rate limit store (pip install redis)")
+            client = redis_asyncio.from_url(url)
+        self._client = client
+        self._key_prefix = key_prefix
+        # register_script uses EVALSHA (falling back to EVAL if the script isn't loaded)
+        self._scripts = (client.register_script(_ADD_REQUEST_SCRIPT), client.register_script(_REMOVE_REQUEST_SCRIPT))
+
+    def _get_key(self, kind: str, deployment_name: str) -> str:
+        # Redis keys are binary-safe so use the exact name (different names mustn't share a key)
+        return f"{self._key_prefix}:{kind}:{deployment_name}"
+
+    def create_tokens_window(
+        self, deployment: OpenAIDeployment, requests_per_10_seconds: int, tokens_per_minute: int
+    ) -> RedisTokensPerMinuteWindow:
+        return RedisTokensPerMinuteWindow(
+            self._scripts,
+            key=self._get_key("tokens", deployment.name),
+            requests_per_10_seconds=math.ceil(requests_per_10_seconds),
+            tokens_per_minute=tokens_per_minute,
+        )
+
+    def create_requests_window(
+        self, deployment: OpenAIDeployment, requests_per_minute: int
+    ) -> RedisRequestsPerMinuteWindow:
+        return RedisRequestsPerMinuteWindow(
+            self._scripts,
+            key=self._get_key("requests", deployment.name),
+            requests_per_minute=requests_per_minute,
+        )
@@ -0,0 +1,140 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import re
+import threading
+from contextlib import contextmanager
+from typing import BinaryIO
+
+from aoai_api_simulator.limiters import (
+    LimiterStore,
+    RequestsPerMinuteBucketedWindow,
+    TokensPerMinuteBucketedWindow,
+    WindowAddResult,
+)
+from aoai_api_simulator.models import OpenAIDeployment
+
+# This file contains a shared memory store for rate-limiting state.
+# The store allows multiple worker processes on a host (e.g. gunicorn workers) to enforce
+# a single set of limits for each deployment.
+# The window state for each deployment is held in a memory-mapped file in the shared memory directory.
+
+
+# pylint: disable-next=too-few-public-methods
+class _SharedMemoryCounters:
+    """
+    A block of int64 counters in a memory-mapped file that can be shared between processes
+    (e.g. gunicorn workers), with a lock that serializes access across processes and threads.
+    """
+
+    _mmap: mmap.mmap
+    _lock_file: BinaryIO
+    _thread_lock: threading.Lock
+    counters: memoryview
+
+    def __init__(self, path: str, size: int):
+        byte_size = size * 8
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            with _flock(fd):
+                # A new file is zero-filled, which is a valid (empty) window state
+                if os.fstat(fd).st_size != byte_size:
+                    os.ftruncate(fd, byte_size)
+            self._mmap = mmap.mmap(fd, byte_size, flags=mmap.MAP_SHARED)
+        finally:
+            os.close(fd)
+        # flock requires a file descriptor - keep one open for the lifetime of the counters
+        self._lock_file = open(path, "rb")  # pylint: disable=consider-using-with
+        self._thread_lock = threading.Lock()
+        self.counters = memoryview(self._mmap).cast("q")
+
+    @contextmanager
+    def lock(self):
+        with self._thread_lock, _flock(self._lock_file.fileno()):
+            yield
+
+
+@contextmanager
+def _flock(fd: int):
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def _get_shared_memory_path(shared_memory_dir: str, kind: str, deployment_name: str) -> str:
+    safe_name = re.sub(r"[^A-Za-z0-9_.-]", "_", deployment_name)
+    # include a hash of the exact name as different names can have the same safe name (e.g. gpt/4 and gpt_4)
+    name_hash = hashlib.sha256(deployment_name.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(shared_memory_dir, f"{kind}-{safe_name}-{name_hash}.bin")
+
+
+# pylint: disable-next=too-few-public-methods
+class SharedMemoryTokensPerMinuteWindow(TokensPerMinuteBucketedWindow):
+    """
+    TokensPerMinuteBucketedWindow with the window state held in shared memory so that
+    all worker processes on a host enforce a single set of limits for a deployment
+    """
+
+    def __init__(self, requests_per_10_seconds: int, tokens_per_minute: int, path: str):
+        self._shared = _SharedMemoryCounters(path, self.storage_size)
+        super().__init__(requests_per_10_seconds, tokens_per_minute, storage=self._shared.counters)
+
+    def add_request(self, token_cost: int, timestamp: float = -1) -> WindowAddResult:
+        with self._shared.lock():
+            return super().add_request(token_cost=token_cost, timestamp=timestamp)
+
+    def remove_request(self, token_cost: int, timestamp: float):
+        with self._shared.lock():
+            super().remove_request(token_cost=token_cost, timestamp=timestamp)
+
+
+# pylint: disable-next=too-few-public-methods
+class SharedMemoryRequestsPerMinuteWindow(RequestsPerMinuteBucketedWindow):
+    """
+    RequestsPerMinuteBucketedWindow with the window state held in shared memory so that
+    all worker processes on a host enforce a single set of limits for a deployment
+    """
+
+    def __init__(self, requests_per_minute: int, path: str):
+        self._shared = _SharedMemoryCounters(path, self.storage_size)
+        super().__init__(requests_per_minute, storage=self._shared.counters)
+
+    def add_request(self, timestamp: float = -1) -> WindowAddResult:
+        with self._shared.lock():
+            return super().add_request(timestamp=timestamp)
+
+    def remove_request(self, timestamp: float):
+        with self._shared.lock():
+            super().remove_request(timestamp=timestamp)
+
+
+class SharedMemoryLimiterStore(LimiterStore):
+    """
+    Store that holds rate-limiting state in shared memory so that limits are enforced across
+    all worker processes on a host.
+    Windows are always bucketed as the state needs to be a fixed size.
+    """
+
+    def __init__(self, shared_memory_dir: str):
+        self._shared_memory_dir = shared_memory_dir
+
+    def create_tokens_window(
+        self, deployment: OpenAIDeployment, requests_per_10_seconds: int, tokens_per_minute: int
+    ) -> SharedMemoryTokensPerMinuteWindow:
+        return SharedMemoryTokensPerMinuteWindow(
+            requests_per_10_seconds=requests_per_10_seconds,
+            tokens_per_minute=tokens_per_minute,
+            path=_get_shared_memory_path(self._shared_memory_dir, "tokens", deployment.name),
+        )
+
+    def create_requests_window(
+        self, deployment: OpenAIDeployment, requests_per_minute: int
+    ) -> SharedMemoryRequestsPerMinuteWindow:
+        return SharedMemoryRequestsPerMinuteWindow(
+            requests_per_minute=requests_per_minute,
+            path=_get_shared_memory_path(self._shared_memory_dir, "requests", deployment.name),
+        )
@@ -1,15 +1,32 @@
 from dataclasses import dataclass
+from typing import Iterable
+
 from opentelemetry import metrics
 
+from aoai_api_simulator.generator.embeddings import embedding_cache
+from aoai_api_simulator.generator.openai_tokens import token_count_cache
+
 
 @dataclass
-class SimulatorMetrics:
+class SimulatorMetrics:  # pylint: disable=too-many-instance-attributes
     histogram_latency_base: metrics.Histogram
     histogram_latency_full: metrics.Histogram
     histogram_tokens_used: metrics.Histogram
     histogram_tokens_requested: metrics.Histogram
     histogram_tokens_rate_limit: metrics.Histogram
     histogram_rate_limit: metrics.Histogram
+    counter_token_count_cache: metrics.ObservableCounter
+    counter_embedding_cache: metrics.ObservableCounter
+
+
+def _observe_token_count_cache(_: metrics.CallbackOptions) -> Iterable[metrics.Observation]:
+    yield metrics.Observation(token_count_cache.hits, {"result": "hit"})
+    yield metrics.Observation(token_count_cache.misses, {"result": "miss"})
+
+
+def _observe_embedding_cache(_: metrics.CallbackOptions) -> Iterable[metrics.Observation]:
+    yield metrics.Observation(embedding_cache.hits, {"result": "hit"})
+    yield metrics.Observation(embedding_cache.misses, {"result": "miss"})
 
 
 def _get_simulator_metrics() -> SimulatorMetrics:
@@ -51,6 +68,20 @@ def _get_simulator_metrics() -> SimulatorMetrics:
             description="Number of requests that were rate-limited",
             unit="requests",
         ),
+        # dimensions: result (hit or miss)
+        counter_token_count_cache=meter.create_observable_counter(
+            name="aoai-api-simulator.tokens.count-cache",
+            callbacks=[_observe_token_count_cache],
+            description="Number of token count lookups that were served from the cache (hit) or tokenized (miss)",
+            unit="lookups",
+        ),
+        # dimensions: result (hit or miss)
+        counter_embedding_cache=meter.create_observable_counter(
+            name="aoai-api-simulator.embeddings.cache",
+            callbacks=[_observe_embedding_cache],
+            description="Number of deterministic embeddings that were served from the cache (hit) or generated (miss)",
+            unit="embeddings",
+        ),
     )
 
 
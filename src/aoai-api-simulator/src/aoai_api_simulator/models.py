@@ -1,27 +1,48 @@
+import json
+import os
 import random
+import tempfile
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from typing import Annotated, Awaitable, Callable
 
 import nanoid
+from aoai_api_simulator.constants import (
+    RATE_LIMIT_COST_MODE_TOKENIZER,
+    RATE_LIMIT_MODE_SLIDING,
+    RATE_LIMIT_STORE_MEMORY,
+    RECORDING_FORMAT_YAML,
+)
 
 # from aoai_api_simulator.pipeline import RequestContext
 from fastapi import Request, Response
+from httpx import Response as httpx_Response
 from pydantic import Field, field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from requests import Response as requests_Response
+from starlette.datastructures import FormData
 from starlette.routing import Match, Route
 
 
+# Marker for RequestContext values that haven't been parsed yet (as None is a valid JSON value)
+_NOT_PARSED = object()
+
+
 class RequestContext:
     _config: "Config"
     _request: Request
     _values: dict[str, any]
+    _body: bytes | None
+    _json: any
+    _form: FormData | None
 
     def __init__(self, config: "Config", request: Request):
         self._config = config
         self._request = request
         self._values = {}
+        self._body = None
+        self._json = _NOT_PARSED
+        self._form = None
 
     @property
     def config(self) -> "Config":
@@ -35,6 +56,33 @@ class RequestContext:
     def values(self) -> dict[str, any]:
         return self._values
 
+    async def body(self) -> bytes:
+        """
+        Returns the raw request body.
+        The body is read once and cached so that generators, limiters etc can share it
+        """
+        if self._body is None:
+            self._body = await self._request.body()
+        return self._body
+
+    async def json(self) -> any:
+        """
+        Returns the request body parsed as JSON.
+        The body is parsed once and cached so that generators, limiters etc can share it
+        """
+        if self._json is _NOT_PARSED:
+            self._json = json.loads(await self.body())
+        return self._json
+
+    async def form(self) -> FormData:
+        """
+        Returns the request body parsed as form data.
+        The body is parsed once and cached so that generators, limiters etc can share it
+        """
+        if self._form is None:
+            self._form = await self._request.form()
+        return self._form
+
     def _strip_path_query(self, path: str) -> str:
         query_start = path.find("?")
         if query_start != -1:
@@ -79,8 +127,18 @@ class RecordingConfig(BaseSettings):
 
     dir: str = Field(default=".recording", alias="RECORDING_DIR")
     autosave: bool = Field(default=True, alias="RECORDING_AUTOSAVE")
+    format: str = Field(default=RECORDING_FORMAT_YAML, alias="RECORDING_FORMAT", pattern="^(yaml|indexed|sqlite)$")
+    # store large response bodies in YAML recordings once per distinct body (see record_replay/body_store.py)
+    deduplicate_bodies: bool = Field(default=False, alias="RECORDING_DEDUPLICATE_BODIES")
     aoai_api_key: str | None = Field(default=None, alias="AZURE_OPENAI_KEY")
     aoai_api_endpoint: str | None = Field(default=None, alias="AZURE_OPENAI_ENDPOINT")
+    # settings for the pooled HTTP client used to forward requests (see record_replay/forwarding.py)
+    forward_max_connections: int = Field(default=100, ge=1, alias="RECORDING_FORWARD_MAX_CONNECTIONS")
+    forward_max_keepalive_connections: int = Field(
+        default=20, ge=0, alias="RECORDING_FORWARD_MAX_KEEPALIVE_CONNECTIONS"
+    )
+    forward_timeout: float = Field(default=30, gt=0, alias="RECORDING_FORWARD_TIMEOUT_SECONDS")
+    forward_retries: int = Field(default=2, ge=0, alias="RECORDING_FORWARD_RETRIES")
     forwarders: (
         list[
             Callable[
@@ -89,6 +147,8 @@ class RecordingConfig(BaseSettings):
                 | Awaitable[Response]
                 | requests_Response
                 | Awaitable[requests_Response]
+                | httpx_Response
+                | Awaitable[httpx_Response]
                 | dict
                 | Awaitable[dict]
                 | None,
@@ -98,6 +158,37 @@ class RecordingConfig(BaseSettings):
     ) = []
 
 
+def _default_shared_memory_dir() -> str:
+    base_dir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base_dir, "aoai-api-simulator-limits")
+
+
+class RateLimitConfig(BaseSettings):
+    """
+    Defines where rate-limiting state is stored and how request costs are determined
+
+    store: "memory" to keep state in each worker process, "shared-memory" to share state
+           between all worker processes on a host, or "redis" to share state between all simulator instances
+    shared_memory_dir: the directory for the shared memory files when store is "shared-memory"
+    redis_url: the URL of the Redis server when store is "redis"
+    redis_key_prefix: the prefix for the Redis keys when store is "redis"
+    cost_mode: "tokenizer" to calculate the token cost of requests using the deployment's tokenizer,
+               or "heuristic" to estimate the prompt tokens from the prompt length
+    """
+
+    model_config = SettingsConfigDict(extra="ignore")
+
+    store: str = Field(
+        default=RATE_LIMIT_STORE_MEMORY, alias="RATE_LIMIT_STORE", pattern="^(memory|shared-memory|redis)$"
+    )
+    shared_memory_dir: str = Field(default_factory=_default_shared_memory_dir, alias="RATE_LIMIT_SHARED_MEMORY_DIR")
+    redis_url: str = Field(default="redis://localhost:6379/0", alias="RATE_LIMIT_REDIS_URL")
+    redis_key_prefix: str = Field(default="aoai-api-simulator", alias="RATE_LIMIT_REDIS_KEY_PREFIX")
+    cost_mode: str = Field(
+        default=RATE_LIMIT_COST_MODE_TOKENIZER, alias="RATE_LIMIT_COST_MODE", pattern="^(tokenizer|heuristic)$"
+    )
+
+
 class CompletionLatency(BaseSettings):
     mean: float = Field(default=15, alias="LATENCY_OPENAI_COMPLETIONS_MEAN")
     std_dev: float = Field(default=2, alias="LATENCY_OPENAI_COMPLETIONS_STD_DEV")
@@ -130,6 +221,22 @@ class TranslationLatency(BaseSettings):
         return random.normalvariate(self.mean, self.std_dev)
 
 
+class StreamingFirstTokenLatency(BaseSettings):
+    mean: float = Field(default=400, alias="LATENCY_OPENAI_STREAMING_FIRST_TOKEN_MEAN")
+    std_dev: float = Field(default=100, alias="LATENCY_OPENAI_STREAMING_FIRST_TOKEN_STD_DEV")
+
+    def get_value(self) -> float:
+        return random.normalvariate(self.mean, self.std_dev)
+
+
+class StreamingInterTokenLatency(BaseSettings):
+    mean: float = Field(default=19, alias="LATENCY_OPENAI_STREAMING_INTER_TOKEN_MEAN")
+    std_dev: float = Field(default=6, alias="LATENCY_OPENAI_STREAMING_INTER_TOKEN_STD_DEV")
+
+    def get_value(self) -> float:
+        return random.normalvariate(self.mean, self.std_dev)
+
+
 class LatencyConfig(BaseSettings):
     """
     Defines the latency for different types of requests
@@ -138,18 +245,38 @@ class LatencyConfig(BaseSettings):
     open_ai_completions: the latency for OpenAI completions - mean is the number of milliseconds per token
     open_ai_chat_completions: the latency for OpenAI chat completions - mean is the number of milliseconds per token
     open_ai_translations: the latency for OpenAI translations - mean is the number of milliseconds per MB of input aud
+    open_ai_streaming_first_token: the latency for streamed OpenAI chat completions before the first token is sent
+        - mean is the number of milliseconds
+    open_ai_streaming_inter_token: the latency for streamed OpenAI chat completions between tokens
+        - mean is the number of milliseconds per token
     """
 
     open_ai_completions: CompletionLatency = Field(default=CompletionLatency())
     open_ai_chat_completions: ChatCompletionLatency = Field(default=ChatCompletionLatency())
     open_ai_embeddings: EmbeddingLatency = Field(default=EmbeddingLatency())
     open_ai_translations: TranslationLatency = Field(default=TranslationLatency())
+    open_ai_streaming_first_token: StreamingFirstTokenLatency = Field(default=StreamingFirstTokenLatency())
+    open_ai_streaming_inter_token: StreamingInterTokenLatency = Field(default=StreamingInterTokenLatency())
+
+
+class StreamingConfig(BaseSettings):
+    """
+    Defines how the tokens for streamed chat completions are grouped into chunks
+
+    chunk_mode: "tokens" to send chunk_tokens tokens per chunk (1 matches the OpenAI service)
+        or "time" to send the tokens available in each chunk_interval_ms interval per chunk
+    """
+
+    chunk_mode: str = Field(default="tokens", alias="STREAMING_CHUNK_MODE", pattern="^(tokens|time)$")
+    chunk_tokens: int = Field(default=1, alias="STREAMING_CHUNK_TOKENS", ge=1)
+    chunk_interval_ms: float = Field(default=50, alias="STREAMING_CHUNK_INTERVAL_MS", gt=0)
 
 
 class PatchableConfig(BaseSettings):
     simulator_mode: str = Field(default="generate", alias="SIMULATOR_MODE", pattern="^(generate|record|replay)$")
     simulator_api_key: str = Field(default="", alias="SIMULATOR_API_KEY")
     recording: RecordingConfig = Field(default=RecordingConfig())
+    rate_limit: RateLimitConfig = Field(default=RateLimitConfig())
     openai_deployments: dict[str, "OpenAIDeployment"] | None = Field(default=None)
     latency: Annotated[LatencyConfig, Field(default=LatencyConfig())]
     allow_undefined_openai_deployments: bool = Field(default=True, alias="ALLOW_UNDEFINED_OPENAI_DEPLOYMENTS")
@@ -173,6 +300,18 @@ class Config(PatchableConfig):
     generators: list[Callable[[RequestContext], Response | Awaitable[Response] | None]] = None
     limiters: dict[str, Callable[[RequestContext, Response], Response | None]] = {}
     extension_path: Annotated[str | None, Field(default=None, alias="EXTENSION_PATH")]
+    time_dilation: float = Field(default=1.0, alias="TIME_DILATION", gt=0)
+    streaming: StreamingConfig = Field(default=StreamingConfig())
+    token_count_cache_size: int = Field(default=10000, alias="TOKEN_COUNT_CACHE_SIZE", ge=0)
+    # generate embeddings from a hash of the input so that identical inputs get the same vector
+    deterministic_embeddings: bool = Field(default=False, alias="DETERMINISTIC_EMBEDDINGS")
+    embedding_cache_size: int = Field(default=1000, alias="EMBEDDING_CACHE_SIZE", ge=0)
+    # path to a UTF-8 text file to generate response text from (instead of lorem text)
+    corpus_path: str | None = Field(default=None, alias="CORPUS_PATH")
+    # directory to cache the lorem generation tables in (empty to disable)
+    lorem_cache_dir: str = Field(
+        default_factory=lambda: os.path.join(tempfile.gettempdir(), "aoai-api-simulator-lorem"), alias="LOREM_CACHE_DIR"
+    )
 
 
 @dataclass
@@ -195,6 +334,9 @@ class OpenAIChatModel(OpenAIModel):
 @dataclass
 class OpenAIEmbeddingModel(OpenAIModel):
     supports_custom_dimensions: bool
+    # the maximum number of inputs per request and the maximum number of tokens per input
+    max_inputs: int = 2048
+    max_input_tokens: int = 8191
 
     @property
     def is_token_limited(self) -> bool:
@@ -215,6 +357,7 @@ class OpenAIDeployment:
     tokens_per_minute: int = 0
     embedding_size: int = 0
     requests_per_minute: int = 0
+    rate_limit_mode: str = RATE_LIMIT_MODE_SLIDING
 
 
 # re-using Starlette's Route class to define a route
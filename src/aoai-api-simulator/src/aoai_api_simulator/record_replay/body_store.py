@@ -0,0 +1,62 @@
+import gzip
+import hashlib
+import os
+from dataclasses import dataclass, field
+
+# This file contains the content-addressed store for recorded response bodies (RECORDING_DEDUPLICATE_BODIES).
+#
+# Large response bodies (e.g. embeddings and long chat completions) are stored once per distinct body as a
+# gzip-compressed blob in <recording_dir>/bodies, named by the SHA-256 hash of the body, and recordings only
+# store the hash. Identical responses recorded for different requests (or in different recordings) share
+# the same blob. Blobs are read and decompressed when the response is replayed rather than when the
+# recording is loaded.
+
+BODY_STORE_DIR_NAME = "bodies"
+BLOB_FILE_EXTENSION = ".gz"
+# smaller bodies are kept in the recording as they gain little from compression
+MIN_BLOB_BODY_SIZE = 1024
+
+
+class BodyStore:
+    def __init__(self, store_dir: str):
+        self._store_dir = store_dir
+
+    def get_blob_path(self, digest: str) -> str:
+        # use the first two characters of the hash as a sub-directory to keep the directories small
+        return os.path.join(self._store_dir, digest[:2], digest + BLOB_FILE_EXTENSION)
+
+    def put(self, body: str | bytes) -> str:
+        """
+        Stores the body (if it isn't already stored) and returns the hash used to load it
+        """
+        data = body.encode("utf-8") if isinstance(body, str) else bytes(body)
+        digest = hashlib.sha256(data).hexdigest()
+        blob_path = self.get_blob_path(digest)
+        if not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            # write to a temporary file and replace so that a partially written blob is never loaded
+            temp_path = f"{blob_path}.{os.getpid()}.tmp"
+            with open(temp_path, "wb") as f:
+                # mtime=0 so that the blob content only depends on the body
+                f.write(gzip.compress(data, mtime=0))
+            os.replace(temp_path, blob_path)
+        return digest
+
+    def get(self, digest: str, is_text: bool) -> str | bytes:
+        with open(self.get_blob_path(digest), "rb") as f:
+            data = gzip.decompress(f.read())
+        return data.decode("utf-8") if is_text else data
+
+
+@dataclass(frozen=True)
+class BodyReference:
+    """
+    A reference to a body in a BodyStore
+    """
+
+    store: BodyStore = field(compare=False, repr=False)
+    digest: str
+    is_text: bool
+
+    def load(self) -> str | bytes:
+        return self.store.get(self.digest, self.is_text)
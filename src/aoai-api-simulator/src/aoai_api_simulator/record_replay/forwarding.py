@@ -0,0 +1,127 @@
+import asyncio
+import logging
+
+import httpx
+from aoai_api_simulator.models import RecordingConfig
+
+# This file contains the HTTP client used by forwarders in record mode.
+#
+# Requests are forwarded with a shared httpx.AsyncClient so that forwarding doesn't block the event loop
+# (other requests continue to be handled while waiting for the upstream service) and connections to the
+# upstream service are kept alive and reused across requests.
+# The number of connections (and so the number of concurrent forwarded requests) is limited by
+# RECORDING_FORWARD_MAX_CONNECTIONS - requests wait for a connection from the pool when the limit is reached.
+#
+# Custom forwarders (e.g. examples/forwarder_doc_intelligence) can use forwarding_client to share the pool.
+
+logger = logging.getLogger(__name__)
+
+
+class ForwardingClient:
+    """
+    Pooled async HTTP client for forwarding requests to upstream services
+    """
+
+    def __init__(self):
+        self._config = RecordingConfig()
+        self._client: httpx.AsyncClient | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        # tasks closing replaced clients (referenced so that they aren't garbage collected before completing)
+        self._close_tasks: set[asyncio.Task] = set()
+
+    @staticmethod
+    def _get_client_settings(config: RecordingConfig) -> tuple:
+        return (
+            config.forward_max_connections,
+            config.forward_max_keepalive_connections,
+            config.forward_timeout,
+            config.forward_retries,
+        )
+
+    def configure(self, config: RecordingConfig):
+        """
+        Set the connection limits, timeout and retries for the client.
+        If the settings have changed, the current client is closed and a new client is created when next used
+        """
+        settings_changed = self._get_client_settings(config) != self._get_client_settings(self._config)
+        self._config = config
+        if settings_changed:
+            self._close_client()
+
+    def _close_client(self):
+        """
+        Close the current client (and its pooled connections) on the event loop it was created on
+        """
+        client, loop = self._client, self._loop
+        self._client = None
+        self._loop = None
+        if client is None:
+            return
+
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if loop is running_loop:
+            task = loop.create_task(client.aclose())
+            self._close_tasks.add(task)
+            task.add_done_callback(self._close_tasks.discard)
+        elif not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+        else:
+            # the connections were bound to the closed loop and can no longer be used
+            logger.debug("Forwarding client event loop is closed - not closing the client")
+
+    def _create_client(self) -> httpx.AsyncClient:
+        config = self._config
+        logger.info(
+            "🔌 Creating forwarding client (max connections: %s, timeout: %ss, retries: %s)",
+            config.forward_max_connections,
+            config.forward_timeout,
+            config.forward_retries,
+        )
+        limits = httpx.Limits(
+            max_connections=config.forward_max_connections,
+            max_keepalive_connections=config.forward_max_keepalive_connections,
+        )
+        # the transport only retries failures to connect so requests are never sent to the upstream service twice
+        transport = httpx.AsyncHTTPTransport(limits=limits, retries=config.forward_retries)
+        return httpx.AsyncClient(transport=transport, timeout=config.forward_timeout)
+
+    def get_client(self) -> httpx.AsyncClient:
+        """
+        Returns the client for the running event loop
+        """
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            # connections are bound to the event loop they were created on,
+            # so create a new client if the loop has changed (e.g. when the server is restarted in tests)
+            self._close_client()
+            self._client = self._create_client()
+            self._loop = loop
+        return self._client
+
+    async def request(self, method: str, url: str, headers: dict[str, str], content: bytes) -> httpx.Response:
+        """
+        Forwards the request and returns the response with the body read
+        """
+        return await self.get_client().request(method, url, headers=headers, content=content)
+
+    async def aclose(self):
+        """
+        Close the client (and its pooled connections)
+        """
+        if self._client is not None and self._loop is asyncio.get_running_loop():
+            await self._client.aclose()
+            self._client = None
+            self._loop = None
+        else:
+            self._close_client()
+        # wait for replaced clients to be closed
+        loop = asyncio.get_running_loop()
+        close_tasks = [task for task in self._close_tasks if task.get_loop() is loop]
+        if close_tasks:
+            await asyncio.gather(*close_tasks)
+
+
+forwarding_client = ForwardingClient()
@@ -1,15 +1,16 @@
 import inspect
 import logging
 import time
-from typing import Awaitable, Callable
+from typing import Awaitable, Callable, MutableMapping
 
 import fastapi
+import httpx
 import requests
 from aoai_api_simulator import constants
 from aoai_api_simulator.models import RequestContext
 from aoai_api_simulator.record_replay.models import RecordedResponse, get_request_hash, hash_body, hash_request_parts
 from aoai_api_simulator.record_replay.openai import forward_to_azure_openai
-from aoai_api_simulator.record_replay.persistence import YamlRecordingPersister
+from aoai_api_simulator.record_replay.persistence import RecordingPersister
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +25,8 @@ def get_default_forwarders() -> (
             | Awaitable[fastapi.Response]
             | requests.Response
             | Awaitable[requests.Response]
+            | httpx.Response
+            | Awaitable[httpx.Response]
             | dict
             | Awaitable[dict]
             | None,
@@ -32,7 +35,7 @@ def get_default_forwarders() -> (
 ):
     # Return a list of functions to call when recording and no matching saved request is found
     #
-    # If the function returns a Response object (from FastAPI or requests package)
+    # If the function returns a Response object (from FastAPI, httpx or requests package)
     # it will be used as the response for the request
     #
     # If the function returns a dict then it should have a "response" property
@@ -59,7 +62,7 @@ class ForwardedResponse:
 
 
 class RecordReplayHandler:
-    _recordings: dict[str, dict[int, RecordedResponse]]
+    _recordings: dict[str, MutableMapping[int, RecordedResponse]]
     _forwarders: list[
         Callable[
             [RequestContext],
@@ -67,6 +70,8 @@ class RecordReplayHandler:
             | Awaitable[fastapi.Response]
             | requests.Response
             | Awaitable[requests.Response]
+            | httpx.Response
+            | Awaitable[httpx.Response]
             | dict
             | Awaitable[dict]
             | None,
@@ -76,7 +81,7 @@ class RecordReplayHandler:
     def __init__(
         self,
         simulator_mode: str,
-        persister: YamlRecordingPersister,
+        persister: RecordingPersister,
         forwarders: list[
             Callable[
                 [RequestContext],
@@ -84,6 +89,8 @@ class RecordReplayHandler:
                 | Awaitable[fastapi.Response]
                 | requests.Response
                 | Awaitable[requests.Response]
+                | httpx.Response
+                | Awaitable[httpx.Response]
                 | dict
                 | Awaitable[dict]
                 | None,
@@ -99,14 +106,14 @@ class RecordReplayHandler:
         # recordings keyed by URL, within a recording, requests are keyed by hash of request values
         self._recordings = {}
 
-    async def _get_recording_for_url(self, url: str) -> dict[int, RecordedResponse] | None:
+    async def _get_recording_for_url(self, url: str) -> MutableMapping[int, RecordedResponse] | None:
         recording = self._recordings.get(url)
-        if recording:
+        if recording is not None:
             return recording
 
         expect_recording_file = self._simulator_mode == "replay"
         recording = self._persister.load_recording_for_url(url, expect_recording_file)
-        if not recording:
+        if recording is None:
             return None
 
         self._recordings[url] = recording
@@ -116,9 +123,10 @@ class RecordReplayHandler:
         request = context.request
         url = request.url.path
         recording = await self._get_recording_for_url(url)
-        request_hash = await get_request_hash(request)
+        request_hash = await get_request_hash(context)
 
-        if recording:
+        # (recordings can be backed by files or a database, so avoid checking the length of the recording)
+        if recording is not None:
             # request_hash = await get_request_hash(request)
             response_info = recording.get(request_hash)
             if response_info:
@@ -127,7 +135,7 @@ class RecordReplayHandler:
                     context.values[key] = value
                 context.values[constants.TARGET_DURATION_MS] = response_info.duration_ms
                 return fastapi.Response(
-                    content=response_info.body, status_code=response_info.status_code, headers=headers
+                    content=response_info.get_body(), status_code=response_info.status_code, headers=headers
                 )
             logger.debug("No recorded response found for request %s %s", request.method, url)
         else:
@@ -169,7 +177,7 @@ class RecordReplayHandler:
     ):
         response = forwarded_response.response
         request = context.request
-        request_body = await request.body()
+        request_body = await context.body()
         body = response.body
         # limit the request headers we persist - avoid persisting secrets and keep recording size low
         allowed_request_headers = ["content-type", "accept"]
@@ -209,19 +217,28 @@ class RecordReplayHandler:
     def store_recorded_response(self, request: fastapi.Request, recorded_response: RecordedResponse):
         logger.info("📝 Storing recording for %s %s", request.method, request.url)
         recording = self._recordings.get(request.url.path)
-        if not recording:
+        if recording is None:
             recording = {}
             self._recordings[request.url.path] = recording
         recording[recorded_response.request_hash] = recorded_response
 
         if self._autosave:
-            # Save the recording to disk
-            self._persister.save_recording(request.url.path, recording)
+            # Append the recorded response to the journal on disk
+            # (the journal is compacted into the recording file by save_recordings)
+            self._persister.append_recorded_response(request.url.path, recorded_response)
 
     def save_recordings(self):
         for url, recording in self._recordings.items():
             self._persister.save_recording(url, recording)
 
+    def shutdown(self):
+        """
+        Compact the autosave journals into the recording files and close the persister
+        """
+        if self._simulator_mode == "record" and self._autosave:
+            self.save_recordings()
+        self._persister.close()
+
     async def forward_request(self, context: RequestContext) -> ForwardedResponse:
         for forwarder in self._forwarders:
             response = forwarder(context)
@@ -244,6 +261,13 @@ class RecordReplayHandler:
                     response = fastapi.Response(
                         content=response.text, status_code=response.status_code, headers=response.headers
                     )
+                elif isinstance(response, httpx.Response):
+                    # convert httpx response to FastAPI response
+                    # (httpx decodes the content, so drop the content-encoding header)
+                    headers = {k: v for k, v in response.headers.items() if k.lower() != "content-encoding"}
+                    response = fastapi.Response(
+                        content=response.content, status_code=response.status_code, headers=headers
+                    )
                 else:
                     raise ValueError(f"Unhandled response type from forwarder: {type(response)}")
 
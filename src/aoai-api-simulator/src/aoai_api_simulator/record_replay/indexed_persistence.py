@@ -0,0 +1,287 @@
+import json
+import logging
+import mmap
+import os
+import struct
+from collections.abc import MutableMapping
+from typing import Iterable, Iterator
+
+import numpy as np
+
+from .models import RecordedResponse
+from .persistence import JOURNAL_SUFFIX, RecordingPersister, trim_full_request
+
+# This file contains the indexed recording format (RECORDING_FORMAT=indexed).
+#
+# Loading a YAML recording parses the whole file and re-hashes every request before the first request for the
+# URL can be replayed, which takes minutes for multi-GB recordings and holds every response body in memory.
+# The indexed format stores each recording as two files:
+#
+# - <recording>.dat - the recorded responses, each as a length-prefixed JSON metadata block and the raw body
+# - <recording>.idx - a header followed by (request hash, offset, length) entries sorted by request hash
+#
+# Both files are memory-mapped when a recording is loaded, so opening a recording only reads the index header.
+# Requests are looked up with a binary search of the index and only the matching response is read and decoded.
+# The memory-mapped pages are shared by all worker processes replaying the same recording.
+#
+# With autosave, recorded responses are appended to <recording>.dat.journal in the same record format and
+# compacted into the indexed files when the recordings are saved (see persistence.py).
+#
+# Use tools/recording-converter to convert existing YAML recordings to the indexed format.
+
+logger = logging.getLogger(__name__)
+
+DATA_FILE_EXTENSION = ".dat"
+INDEX_FILE_EXTENSION = ".idx"
+
+# magic value, number of entries and the data file size (to detect an index that doesn't match the data file)
+_INDEX_HEADER = struct.Struct("<8sQQ")
+_INDEX_MAGIC = b"AOAIREC1"
+# request hash, offset and length of the record in the data file
+# (request hashes are MD5 hex digests, stored in the index as the 16 digest bytes)
+_INDEX_ENTRY = struct.Struct("<16sQQ")
+
+# metadata and body lengths
+_RECORD_HEADER = struct.Struct("<II")
+
+_BODY_TYPE_NONE = 0
+_BODY_TYPE_TEXT = 1
+_BODY_TYPE_BYTES = 2
+
+
+def encode_record(recorded_response: RecordedResponse) -> bytes:
+    """
+    Returns the recorded response in the record format used for the data and journal files
+    """
+    body = recorded_response.get_body()
+    if body is None:
+        body_type, body_bytes = _BODY_TYPE_NONE, b""
+    elif isinstance(body, str):
+        body_type, body_bytes = _BODY_TYPE_TEXT, body.encode("utf-8")
+    else:
+        body_type, body_bytes = _BODY_TYPE_BYTES, bytes(body)
+
+    full_request = dict(trim_full_request(recorded_response.full_request))
+    if isinstance(full_request.get("body"), bytes):
+        # binary request bodies (e.g. audio files) are only stored as the body hash
+        full_request["body"] = None
+
+    metadata = json.dumps(
+        {
+            "request_hash": recorded_response.request_hash,
+            "status_code": recorded_response.status_code,
+            "headers": recorded_response.headers,
+            "body_type": body_type,
+            "duration_ms": recorded_response.duration_ms,
+            "context_values": recorded_response.context_values,
+            "full_request": full_request,
+        }
+    ).encode("utf-8")
+    return _RECORD_HEADER.pack(len(metadata), len(body_bytes)) + metadata + body_bytes
+
+
+def decode_record(buffer, offset: int = 0) -> tuple[RecordedResponse, int]:
+    """
+    Returns the recorded response at the offset in the buffer and the offset of the next record
+    """
+    metadata_length, body_length = _RECORD_HEADER.unpack_from(buffer, offset)
+    metadata_start = offset + _RECORD_HEADER.size
+    body_start = metadata_start + metadata_length
+    body_end = body_start + body_length
+    if body_end > len(buffer):
+        raise ValueError("Incomplete recording record")
+
+    metadata = json.loads(bytes(buffer[metadata_start:body_start]))
+    body_type = metadata["body_type"]
+    body = bytes(buffer[body_start:body_end])
+    if body_type == _BODY_TYPE_NONE:
+        body = None
+    elif body_type == _BODY_TYPE_TEXT:
+        body = body.decode("utf-8")
+
+    recorded_response = RecordedResponse(
+        request_hash=metadata["request_hash"],
+        status_code=metadata["status_code"],
+        headers=metadata["headers"],
+        body=body,
+        duration_ms=metadata["duration_ms"],
+        context_values=metadata["context_values"],
+        full_request=metadata["full_request"],
+    )
+    return recorded_response, body_end
+
+
+def _hash_to_key(request_hash: str) -> bytes | None:
+    try:
+        return bytes.fromhex(request_hash)
+    except (TypeError, ValueError):
+        return None
+
+
+def _map_file(path: str) -> mmap.mmap | None:
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # empty files can't be memory-mapped
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class IndexedRecording(MutableMapping[int, RecordedResponse]):
+    """
+    A recording backed by memory-mapped index and data files.
+    Responses are decoded when they are looked up, and responses added in record mode are kept in memory
+    until the recording is saved.
+    """
+
+    def __init__(self, data_path: str, index_path: str):
+        self._index_map = _map_file(index_path)
+        if self._index_map is None or len(self._index_map) < _INDEX_HEADER.size:
+            raise ValueError(f"Invalid recording index file: {index_path}")
+        magic, count, data_size = _INDEX_HEADER.unpack_from(self._index_map)
+        if magic != _INDEX_MAGIC or len(self._index_map) != _INDEX_HEADER.size + count * _INDEX_ENTRY.size:
+            raise ValueError(f"Invalid recording index file: {index_path}")
+
+        self._data_map = _map_file(data_path)
+        if (0 if self._data_map is None else len(self._data_map)) != data_size:
+            raise ValueError(f"Recording index file {index_path} doesn't match the data file {data_path}")
+
+        self._count = count
+        # view of the first 8 bytes of each hash as a big-endian integer (in the same order as the hashes)
+        # for the binary search - this reads the index from the memory-mapped file without copying it
+        self._hash_prefixes = np.ndarray(
+            shape=(count,),
+            dtype=">u8",
+            buffer=self._index_map,
+            offset=_INDEX_HEADER.size,
+            strides=(_INDEX_ENTRY.size,),
+        )
+        self._added: dict[int, RecordedResponse] = {}
+        self._removed: set[int] = set()
+
+    def _get_entry(self, i: int) -> tuple[bytes, int, int]:
+        return _INDEX_ENTRY.unpack_from(self._index_map, _INDEX_HEADER.size + i * _INDEX_ENTRY.size)
+
+    def _find(self, request_hash: int) -> RecordedResponse | None:
+        key = _hash_to_key(request_hash)
+        if key is None or len(key) != 16 or request_hash in self._removed:
+            return None
+        prefix = key[:8]
+        i = int(np.searchsorted(self._hash_prefixes, np.uint64(int.from_bytes(prefix, "big"))))
+        # check the full hash for each entry with the same prefix
+        while i < self._count:
+            entry_key, offset, _ = self._get_entry(i)
+            if entry_key == key:
+                recorded_response, _ = decode_record(self._data_map, offset)
+                return recorded_response
+            if entry_key[:8] != prefix:
+                break
+            i += 1
+        return None
+
+    def __getitem__(self, request_hash: int) -> RecordedResponse:
+        recorded_response = self._added.get(request_hash)
+        if recorded_response is None:
+            recorded_response = self._find(request_hash)
+            if recorded_response is None:
+                raise KeyError(request_hash)
+        return recorded_response
+
+    def __setitem__(self, request_hash: int, recorded_response: RecordedResponse):
+        if request_hash not in self._added and self._find(request_hash) is not None:
+            # the added response replaces the response in the index
+            self._removed.add(request_hash)
+        self._added[request_hash] = recorded_response
+
+    def __delitem__(self, request_hash: int):
+        if request_hash in self._added:
+            del self._added[request_hash]
+        elif self._find(request_hash) is not None:
+            self._removed.add(request_hash)
+        else:
+            raise KeyError(request_hash)
+
+    def __iter__(self) -> Iterator[int]:
+        for i in range(self._count):
+            request_hash = self._get_entry(i)[0].hex()
+            if request_hash not in self._removed:
+                yield request_hash
+        yield from self._added
+
+    def __len__(self) -> int:
+        return self._count - len(self._removed) + len(self._added)
+
+
+def write_indexed_recording(base_path: str, recorded_responses: Iterable[RecordedResponse]):
+    """
+    Writes the recorded responses to the data and index files for the recording
+    """
+    data_path = base_path + DATA_FILE_EXTENSION
+    index_path = base_path + INDEX_FILE_EXTENSION
+
+    entries = []
+    offset = 0
+    with open(data_path + ".tmp", "wb") as f:
+        for recorded_response in recorded_responses:
+            key = _hash_to_key(recorded_response.request_hash)
+            if key is None:
+                raise ValueError(f"Invalid request hash: {recorded_response.request_hash}")
+            record = encode_record(recorded_response)
+            f.write(record)
+            entries.append((key, offset, len(record)))
+            offset += len(record)
+
+    entries.sort()
+    with open(index_path + ".tmp", "wb") as f:
+        f.write(_INDEX_HEADER.pack(_INDEX_MAGIC, len(entries), offset))
+        f.write(b"".join(_INDEX_ENTRY.pack(*entry) for entry in entries))
+
+    os.replace(data_path + ".tmp", data_path)
+    os.replace(index_path + ".tmp", index_path)
+
+
+class IndexedRecordingPersister(RecordingPersister):
+    def get_recording_file_path(self, url: str):
+        return self.get_recording_base_path(url) + DATA_FILE_EXTENSION
+
+    def load_recording_for_url(self, url: str, expect_recording_file: bool):
+        base_path = self.get_recording_base_path(url)
+        journal_path = base_path + DATA_FILE_EXTENSION + JOURNAL_SUFFIX
+        has_recording_file = os.path.exists(base_path + INDEX_FILE_EXTENSION)
+        has_journal = os.path.exists(journal_path)
+        if not has_recording_file and not has_journal:
+            if expect_recording_file:
+                logger.warning("No recording file found at %s", base_path + INDEX_FILE_EXTENSION)
+            return None
+
+        recording = self.load_recording_files(base_path) if has_recording_file else {}
+        if has_journal:
+            # add the responses that haven't been compacted into the recording files
+            self._load_journal(journal_path, recording)
+        return recording
+
+    def load_recording_files(self, base_path: str) -> IndexedRecording:
+        return IndexedRecording(base_path + DATA_FILE_EXTENSION, base_path + INDEX_FILE_EXTENSION)
+
+    def _load_journal(self, journal_path: str, recording: MutableMapping[int, RecordedResponse]):
+        with open(journal_path, "rb") as f:
+            journal = f.read()
+        offset = 0
+        try:
+            while offset < len(journal):
+                recorded_response, offset = decode_record(journal, offset)
+                recording[recorded_response.request_hash] = recorded_response
+        except (struct.error, ValueError) as e:
+            # the last record may be incomplete if the simulator stopped while writing it
+            logger.warning("Ignoring incomplete record in recording journal %s: %s", journal_path, e)
+
+    def save_recording(self, url: str, recording: MutableMapping[int, RecordedResponse]):
+        base_path = self.get_recording_base_path(url)
+        self.ensure_recording_dir_exists()
+        write_indexed_recording(base_path, recording.values())
+        logger.info("💾 Recording saved to %s", base_path + INDEX_FILE_EXTENSION)
+
+        # the journal entries are now in the recording files
+        self._remove_journal(base_path + DATA_FILE_EXTENSION)
+
+    def append_recorded_response(self, url: str, recorded_response: RecordedResponse):
+        self._append_to_journal(self.get_recording_file_path(url), encode_record(recorded_response))
@@ -1,7 +1,9 @@
 import hashlib
 from dataclasses import dataclass
 
-from fastapi import Request
+from aoai_api_simulator.models import RequestContext
+
+from .body_store import BodyReference
 
 
 @dataclass
@@ -16,6 +18,16 @@ class RecordedResponse:
     # full_request currently here for compatibility with VCR serialization format
     # it _is_ handy for human inspection to have the URL/body etc. in the recording
     full_request: dict
+    # set (instead of body) when the body is stored in a BodyStore - the body is loaded by get_body
+    body_reference: BodyReference | None = None
+
+    def get_body(self) -> str | bytes | None:
+        """
+        Returns the body, loading it from the body store if the recording only has a reference to the body
+        """
+        if self.body_reference is not None:
+            return self.body_reference.load()
+        return self.body
 
 
 def hash_body(headers: dict, body: bytes) -> int:
@@ -59,6 +71,7 @@ def hash_request_parts(
     return result
 
 
-async def get_request_hash(request: Request):
-    body = await request.body()
+async def get_request_hash(context: RequestContext):
+    request = context.request
+    body = await context.body()
     return hash_request_parts(request.method, request.url.path, request.headers, body=body)
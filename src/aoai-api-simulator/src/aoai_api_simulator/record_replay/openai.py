@@ -1,7 +1,6 @@
 import json
 import logging
 
-import requests
 from aoai_api_simulator.constants import (
     LIMITER_OPENAI_REQUESTS,
     LIMITER_OPENAI_TOKENS,
@@ -17,6 +16,7 @@ from aoai_api_simulator.constants import (
     SIMULATOR_KEY_OPERATION_NAME,
 )
 from aoai_api_simulator.models import RequestContext
+from aoai_api_simulator.record_replay.forwarding import forwarding_client
 
 # This file contains a default openai forwarder
 # You can configure your own forwarders by creating a forwarder_config.py file and setting the
@@ -150,15 +150,9 @@ async def forward_to_azure_openai(context: RequestContext) -> dict:
     }
     fwd_headers["api-key"] = aoai_api_key
 
-    body = await request.body()
+    body = await context.body()
 
-    response = requests.request(
-        request.method,
-        url,
-        headers=fwd_headers,
-        data=body,
-        timeout=30,
-    )
+    response = await forwarding_client.request(request.method, url, headers=fwd_headers, content=body)
 
     for header in aoai_response_headers_to_remove:
         if response.headers.get(header):
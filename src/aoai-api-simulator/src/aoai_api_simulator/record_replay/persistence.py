@@ -1,99 +1,260 @@
 import logging
 import os
+import time
+from abc import ABC, abstractmethod
+from typing import BinaryIO, MutableMapping
 
 import yaml
 from fastapi.datastructures import URL
 
+from .body_store import BODY_STORE_DIR_NAME, MIN_BLOB_BODY_SIZE, BodyReference, BodyStore
 from .models import RecordedResponse, hash_body, hash_request_parts
 
 logger = logging.getLogger(__name__)
 
+# With autosave, each recorded interaction is appended to a journal file next to the recording file
+# (<recording>.journal, e.g. containing one YAML document per interaction) rather than rewriting the whole
+# recording file, so that recording N requests costs O(N) rather than O(N^2) I/O.
+# The journal is compacted into the recording file when the recordings are saved (via /++/save-recordings
+# or when the simulator shuts down) and is replayed on top of the recording file when loading, so
+# interactions recorded before a crash aren't lost.
+JOURNAL_SUFFIX = ".journal"
 
-class YamlRecordingPersister:
-    def __init__(self, recording_dir: str):
+
+def trim_full_request(request: dict) -> dict:
+    """
+    Ensures the request has a body hash and skips the full body for large requests
+    """
+    if "body" in request:
+        if "body_hash" not in request:
+            request["body_hash"] = hash_body(request["headers"], request["body"])
+
+        if len(request.get("body") or "") > 1024:
+            request["body"] = None
+    return request
+
+
+def _to_interaction_body(recorded_response: RecordedResponse, body_store: BodyStore | None) -> dict:
+    if body_store is None:
+        return {"string": recorded_response.get_body()}
+
+    body_reference = recorded_response.body_reference
+    # bodies already in the store are saved without loading them
+    if body_reference is None or body_reference.store is not body_store:
+        body = recorded_response.get_body()
+        if body is None or len(body) <= MIN_BLOB_BODY_SIZE:
+            return {"string": body}
+        body_reference = BodyReference(body_store, body_store.put(body), isinstance(body, str))
+    interaction_body = {"blob": body_reference.digest}
+    if body_reference.is_text:
+        # the encoding is only set for text bodies so that the body is loaded as the same type
+        interaction_body["encoding"] = "utf-8"
+    return interaction_body
+
+
+def _to_interaction(recorded_response: RecordedResponse, body_store: BodyStore | None = None) -> dict:
+    request = trim_full_request(recorded_response.full_request)
+    return {
+        "request": request,
+        "response": {
+            "status": {"code": recorded_response.status_code},
+            "headers": recorded_response.headers,
+            "body": _to_interaction_body(recorded_response, body_store),
+            "duration_ms": recorded_response.duration_ms,
+        },
+        "context_values": recorded_response.context_values,
+    }
+
+
+def _from_interaction(interaction: dict, body_store: BodyStore) -> RecordedResponse:
+    request = interaction["request"]
+    response = interaction["response"]
+    uri_string = request["uri"]
+    # Allow for old recordings without body hash (or edited recordings with just the body)
+    # Also handle large recordings that omit the body and only have the hash
+    if "body_hash" not in request:
+        if "body" not in request:
+            raise ValueError(f"No body or body hash found in recording for request {uri_string}")
+        request["body_hash"] = hash_body(request["headers"], request["body"])
+
+    request_hash = hash_request_parts(
+        request["method"],
+        # parse URL to get path without host for matching against incoming request
+        URL(uri_string).path,
+        request["headers"],
+        body_hash=request["body_hash"],
+    )
+    context_values = interaction.get("context_values", {})
+
+    # bodies in the body store are only loaded when the response is replayed
+    body = response["body"]
+    digest = body.get("blob")
+    body_reference = None if digest is None else BodyReference(body_store, digest, "encoding" in body)
+
+    return RecordedResponse(
+        request_hash=request_hash,
+        status_code=response["status"]["code"],
+        headers=response["headers"],
+        body=body.get("string"),
+        context_values=context_values,
+        full_request=request,
+        duration_ms=response.get("duration_ms", 0),  # didn't exist in earlier recordings so default to 0
+        body_reference=body_reference,
+    )
+
+
+class RecordingPersister(ABC):
+    """
+    Base class for loading and saving recordings, with one recording (keyed by request hash) per URL path
+    """
+
+    _journals: dict[str, BinaryIO]
+
+    def __init__(self, recording_dir: str, journal_fsync_interval_s: float = 1):
         self._recording_dir = recording_dir
+        # journal appends are flushed immediately but only fsynced at most once per interval
+        self._journal_fsync_interval_s = journal_fsync_interval_s
+        self._journals = {}
+        self._last_fsync_time = 0
 
-    def save_recording(self, url: str, recording: dict[int, RecordedResponse]):
-        interactions = []
-        for recorded_response in recording.values():
-            request = recorded_response.full_request
-            # skip the full body for large requests (ensure we have a hash)
-            if "body" in request:
-                if "body_hash" not in request:
-                    request["body_hash"] = hash_body(request["headers"], request["body"])
-
-                if len(request.get("body") or "") > 1024:
-                    request["body"] = None
-
-            interaction = {
-                "request": request,
-                "response": {
-                    "status": {"code": recorded_response.status_code},
-                    "headers": recorded_response.headers,
-                    "body": {"string": recorded_response.body},
-                    "duration_ms": recorded_response.duration_ms,
-                },
-                "context_values": recorded_response.context_values,
-            }
-            interactions.append(interaction)
-        recording_data = {"interactions": interactions, "version": 1}
+    @abstractmethod
+    def load_recording_for_url(
+        self, url: str, expect_recording_file: bool
+    ) -> MutableMapping[int, RecordedResponse] | None:
+        pass
 
-        recording_path = self.get_recording_file_path(url)
-        self.ensure_recording_dir_exists()
-        with open(recording_path, "w", encoding="utf-8") as f:
-            yaml.dump(recording_data, stream=f, Dumper=yaml.CDumper)
-        logger.info("💾 Recording saved to %s", recording_path)
+    @abstractmethod
+    def save_recording(self, url: str, recording: MutableMapping[int, RecordedResponse]):
+        """
+        Save the recording for the URL (compacting the journal for the URL)
+        """
+
+    @abstractmethod
+    def append_recorded_response(self, url: str, recorded_response: RecordedResponse):
+        """
+        Append the recorded response to the journal for the URL (see save_recording to compact the journal)
+        """
 
     def ensure_recording_dir_exists(self):
         if not os.path.exists(self._recording_dir):
             os.mkdir(self._recording_dir)
 
-    def get_recording_file_path(self, url: str):
+    def get_recording_base_path(self, url: str) -> str:
+        """
+        Returns the path for the recording files for the URL without the file extension
+        """
         query_start = url.find("?")
         if query_start != -1:
             url = url[:query_start]
-        recording_file_name = url.strip("/").replace("/", "_") + ".yaml"
-        recording_file_path = os.path.join(self._recording_dir, recording_file_name)
-        return recording_file_path
+        return os.path.join(self._recording_dir, url.strip("/").replace("/", "_"))
+
+    def _append_to_journal(self, recording_path: str, data: bytes):
+        journal = self._journals.get(recording_path)
+        if journal is None:
+            self.ensure_recording_dir_exists()
+            # pylint: disable-next=consider-using-with
+            journal = open(recording_path + JOURNAL_SUFFIX, "ab")
+            self._journals[recording_path] = journal
+
+        journal.write(data)
+        journal.flush()
+
+        now = time.monotonic()
+        if now - self._last_fsync_time >= self._journal_fsync_interval_s:
+            self.sync_journals()
+            self._last_fsync_time = now
+
+    def sync_journals(self):
+        """
+        Flush the journal files to disk
+        """
+        for journal in self._journals.values():
+            os.fsync(journal.fileno())
+
+    def _remove_journal(self, recording_path: str):
+        journal = self._journals.pop(recording_path, None)
+        if journal is not None:
+            journal.close()
+        journal_path = recording_path + JOURNAL_SUFFIX
+        if os.path.exists(journal_path):
+            os.remove(journal_path)
+
+    def close(self):
+        """
+        Close the open journal files
+        """
+        self.sync_journals()
+        for journal in self._journals.values():
+            journal.close()
+        self._journals = {}
+
+
+class YamlRecordingPersister(RecordingPersister):
+    def __init__(self, recording_dir: str, journal_fsync_interval_s: float = 1, deduplicate_bodies: bool = False):
+        super().__init__(recording_dir, journal_fsync_interval_s)
+        # recordings that reference the body store are always loaded, deduplicate_bodies controls saving
+        self._body_store = BodyStore(os.path.join(recording_dir, BODY_STORE_DIR_NAME))
+        self._deduplicate_bodies = deduplicate_bodies
+
+    def _get_interaction(self, recorded_response: RecordedResponse) -> dict:
+        return _to_interaction(recorded_response, self._body_store if self._deduplicate_bodies else None)
+
+    def save_recording(self, url: str, recording: MutableMapping[int, RecordedResponse]):
+        interactions = [self._get_interaction(recorded_response) for recorded_response in recording.values()]
+        recording_data = {"interactions": interactions, "version": 1}
+
+        recording_path = self.get_recording_file_path(url)
+        self.ensure_recording_dir_exists()
+        # write to a temporary file and replace so that the recording isn't lost if saving fails
+        temp_path = recording_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            yaml.dump(recording_data, stream=f, Dumper=yaml.CDumper)
+        os.replace(temp_path, recording_path)
+        logger.info("💾 Recording saved to %s", recording_path)
+
+        # the journal entries are now in the recording file
+        self._remove_journal(recording_path)
+
+    def append_recorded_response(self, url: str, recorded_response: RecordedResponse):
+        interaction = yaml.dump(self._get_interaction(recorded_response), Dumper=yaml.CDumper, explicit_start=True)
+        self._append_to_journal(self.get_recording_file_path(url), interaction.encode("utf-8"))
+
+    def get_recording_file_path(self, url: str):
+        return self.get_recording_base_path(url) + ".yaml"
 
     def load_recording_for_url(self, url: str, expect_recording_file: bool):
         recording_file_path = self.get_recording_file_path(url)
-        if not os.path.exists(recording_file_path):
+        journal_path = recording_file_path + JOURNAL_SUFFIX
+        has_recording_file = os.path.exists(recording_file_path)
+        has_journal = os.path.exists(journal_path)
+        if not has_recording_file and not has_journal:
             if expect_recording_file:
                 logger.warning("No recording file found at %s", recording_file_path)
             return None
 
+        recording = self.load_recording_file(recording_file_path) if has_recording_file else {}
+        if has_journal:
+            # add the interactions that haven't been compacted into the recording file
+            self._load_journal(journal_path, recording)
+        return recording
+
+    def load_recording_file(self, recording_file_path: str) -> dict[int, RecordedResponse]:
+        recording = {}
         with open(recording_file_path, "r", encoding="utf-8") as f:
             recording_data = yaml.load(f, Loader=yaml.CLoader)
-            interactions = recording_data["interactions"]
-            recording = {}
-            for interaction in interactions:
-                request = interaction["request"]
-                response = interaction["response"]
-                uri_string = request["uri"]
-                # Allow for old recordings without body hash (or edited recordings with just the body)
-                # Also handle large recordings that omit the body and only have the hash
-                if "body_hash" not in request:
-                    if "body" not in request:
-                        raise ValueError(f"No body or body hash found in recording for request {uri_string}")
-                    request["body_hash"] = hash_body(request["headers"], request["body"])
-
-                request_hash = hash_request_parts(
-                    request["method"],
-                    # parse URL to get path without host for matching against incoming request
-                    URL(uri_string).path,
-                    request["headers"],
-                    body_hash=request["body_hash"],
-                )
-                context_values = interaction.get("context_values", {})
-
-                recording[request_hash] = RecordedResponse(
-                    request_hash=request_hash,
-                    status_code=response["status"]["code"],
-                    headers=response["headers"],
-                    body=response["body"].get("string"),
-                    context_values=context_values,
-                    full_request=request,
-                    duration_ms=response.get("duration_ms", 0),  # didn't exist in earlier recordings so default to 0
-                )
-            return recording
+            for interaction in recording_data["interactions"]:
+                recorded_response = _from_interaction(interaction, self._body_store)
+                recording[recorded_response.request_hash] = recorded_response
+        return recording
+
+    def _load_journal(self, journal_path: str, recording: dict[int, RecordedResponse]):
+        with open(journal_path, "r", encoding="utf-8") as f:
+            try:
+                for interaction in yaml.load_all(f, Loader=yaml.CLoader):
+                    if interaction is None:
+                        continue
+                    recorded_response = _from_interaction(interaction, self._body_store)
+                    recording[recorded_response.request_hash] = recorded_response
+            except yaml.YAMLError as e:
+                # the last entry may be incomplete if the simulator stopped while writing it
+                logger.warning("Ignoring incomplete entry in recording journal %s: %s", journal_path, e)
@@ -0,0 +1,250 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import MutableMapping
+from typing import Iterable, Iterator
+
+from aoai_api_simulator import constants
+
+from .models import RecordedResponse
+from .persistence import RecordingPersister, trim_full_request
+
+# This file contains the SQLite recording format (RECORDING_FORMAT=sqlite).
+#
+# All recordings are stored in a single SQLite database in the recording directory, with one row per recorded
+# response keyed by the request hash. The URL, deployment, operation, status code and token counts are stored
+# in indexed columns so that recorded traffic can be queried with SQL (e.g. to select a subset of the
+# recording for a benchmark) without loading the recording files.
+#
+# Replayed requests are looked up with a primary key query, so only the rows for replayed requests are read.
+# With autosave, recorded responses are inserted as they are recorded and committed in batches (at most once
+# per journal_fsync_interval_s) rather than appended to a journal file.
+
+logger = logging.getLogger(__name__)
+
+DATABASE_FILE_NAME = "recordings.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS interactions (
+    request_hash TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    method TEXT,
+    deployment TEXT,
+    operation TEXT,
+    status_code INTEGER NOT NULL,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    total_tokens INTEGER,
+    duration_ms INTEGER NOT NULL,
+    headers TEXT NOT NULL,
+    body BLOB,
+    context_values TEXT NOT NULL,
+    full_request TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS interactions_url ON interactions (url);
+CREATE INDEX IF NOT EXISTS interactions_deployment ON interactions (deployment);
+CREATE INDEX IF NOT EXISTS interactions_operation ON interactions (operation);
+CREATE INDEX IF NOT EXISTS interactions_status_code ON interactions (status_code);
+CREATE INDEX IF NOT EXISTS interactions_total_tokens ON interactions (total_tokens);
+"""
+
+_INSERT = """
+INSERT OR REPLACE INTO interactions (
+    request_hash, url, method, deployment, operation, status_code, prompt_tokens, completion_tokens, total_tokens,
+    duration_ms, headers, body, context_values, full_request
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+_SELECT = """
+SELECT request_hash, status_code, headers, body, duration_ms, context_values, full_request
+FROM interactions
+"""
+
+
+def _to_row(url: str, recorded_response: RecordedResponse) -> tuple:
+    full_request = dict(trim_full_request(recorded_response.full_request))
+    if isinstance(full_request.get("body"), bytes):
+        # binary request bodies (e.g. audio files) are only stored as the body hash
+        full_request["body"] = None
+
+    context_values = recorded_response.context_values
+    # the body is stored as TEXT, BLOB or NULL depending on the type so that it round-trips unchanged
+    return (
+        recorded_response.request_hash,
+        url,
+        full_request.get("method"),
+        context_values.get(constants.SIMULATOR_KEY_DEPLOYMENT_NAME),
+        context_values.get(constants.SIMULATOR_KEY_OPERATION_NAME),
+        recorded_response.status_code,
+        context_values.get(constants.SIMULATOR_KEY_OPENAI_PROMPT_TOKENS),
+        context_values.get(constants.SIMULATOR_KEY_OPENAI_COMPLETION_TOKENS),
+        context_values.get(constants.SIMULATOR_KEY_OPENAI_TOTAL_TOKENS),
+        recorded_response.duration_ms,
+        json.dumps(recorded_response.headers),
+        recorded_response.get_body(),
+        json.dumps(context_values),
+        json.dumps(full_request),
+    )
+
+
+def _from_row(row: tuple) -> RecordedResponse:
+    request_hash, status_code, headers, body, duration_ms, context_values, full_request = row
+    return RecordedResponse(
+        request_hash=request_hash,
+        status_code=status_code,
+        headers=json.loads(headers),
+        body=body,
+        duration_ms=duration_ms,
+        context_values=json.loads(context_values),
+        full_request=json.loads(full_request),
+    )
+
+
+class SqliteRecording(MutableMapping[int, RecordedResponse]):
+    """
+    The recording for a URL backed by the recordings database.
+    Responses are read when they are looked up, and responses added in record mode are kept in memory
+    until the recording is saved.
+    """
+
+    def __init__(self, persister: "SqliteRecordingPersister", url: str):
+        self._persister = persister
+        self._url = url
+        self._added: dict[int, RecordedResponse] = {}
+
+    def _find(self, request_hash: int) -> RecordedResponse | None:
+        row = self._persister.query_one(_SELECT + " WHERE request_hash = ? AND url = ?", (request_hash, self._url))
+        return None if row is None else _from_row(row)
+
+    def __getitem__(self, request_hash: int) -> RecordedResponse:
+        recorded_response = self._added.get(request_hash)
+        if recorded_response is None:
+            recorded_response = self._find(request_hash)
+            if recorded_response is None:
+                raise KeyError(request_hash)
+        return recorded_response
+
+    def __setitem__(self, request_hash: int, recorded_response: RecordedResponse):
+        self._added[request_hash] = recorded_response
+
+    def __delitem__(self, request_hash: int):
+        if self._added.pop(request_hash, None) is None and self._find(request_hash) is None:
+            raise KeyError(request_hash)
+        self._persister.execute(
+            "DELETE FROM interactions WHERE request_hash = ? AND url = ?", (request_hash, self._url)
+        )
+
+    def _get_saved_hashes(self) -> list[int]:
+        rows = self._persister.query_all("SELECT request_hash FROM interactions WHERE url = ?", (self._url,))
+        return [row[0] for row in rows]
+
+    def __iter__(self) -> Iterator[int]:
+        saved_hashes = self._get_saved_hashes()
+        yield from saved_hashes
+        saved_hash_set = set(saved_hashes)
+        yield from (request_hash for request_hash in self._added if request_hash not in saved_hash_set)
+
+    def __len__(self) -> int:
+        saved_hashes = set(self._get_saved_hashes())
+        return len(saved_hashes) + sum(1 for request_hash in self._added if request_hash not in saved_hashes)
+
+    def take_added(self) -> list[RecordedResponse]:
+        """
+        Returns the responses added since the recording was loaded (or last saved) and clears them
+        """
+        added = list(self._added.values())
+        self._added = {}
+        return added
+
+
+class SqliteRecordingPersister(RecordingPersister):
+    def __init__(self, recording_dir: str, journal_fsync_interval_s: float = 1):
+        super().__init__(recording_dir, journal_fsync_interval_s)
+        self._connection: sqlite3.Connection | None = None
+        # the connection is shared by the event loop and the threads used for sync endpoints (e.g. save-recordings)
+        self._lock = threading.Lock()
+        self._last_commit_time = 0
+
+    def get_database_path(self) -> str:
+        return os.path.join(self._recording_dir, DATABASE_FILE_NAME)
+
+    def _get_connection(self, create: bool) -> sqlite3.Connection | None:
+        if self._connection is None:
+            database_path = self.get_database_path()
+            if not create and not os.path.exists(database_path):
+                return None
+            self.ensure_recording_dir_exists()
+            self._connection = sqlite3.connect(database_path, check_same_thread=False)
+            # WAL allows the database to be read by other processes (e.g. other workers) while recording
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(_SCHEMA)
+        return self._connection
+
+    def query_one(self, sql: str, parameters: tuple) -> tuple | None:
+        with self._lock:
+            return self._get_connection(create=True).execute(sql, parameters).fetchone()
+
+    def query_all(self, sql: str, parameters: tuple) -> list[tuple]:
+        with self._lock:
+            return self._get_connection(create=True).execute(sql, parameters).fetchall()
+
+    def execute(self, sql: str, parameters: tuple):
+        with self._lock:
+            self._get_connection(create=True).execute(sql, parameters)
+
+    def load_recording_for_url(self, url: str, expect_recording_file: bool):
+        with self._lock:
+            connection = self._get_connection(create=False)
+            has_recording = (
+                connection is not None
+                and connection.execute("SELECT 1 FROM interactions WHERE url = ? LIMIT 1", (url,)).fetchone()
+                is not None
+            )
+        if not has_recording:
+            if expect_recording_file:
+                logger.warning("No recording found for %s in %s", url, self.get_database_path())
+            return None
+        return SqliteRecording(self, url)
+
+    def insert_recorded_responses(self, url: str, recorded_responses: Iterable[RecordedResponse]):
+        """
+        Inserts (or replaces) the recorded responses in a single transaction
+        """
+        with self._lock:
+            connection = self._get_connection(create=True)
+            connection.executemany(_INSERT, (_to_row(url, r) for r in recorded_responses))
+            connection.commit()
+
+    def save_recording(self, url: str, recording: MutableMapping[int, RecordedResponse]):
+        if isinstance(recording, SqliteRecording):
+            # only the added responses need to be saved
+            recorded_responses = recording.take_added()
+        else:
+            recorded_responses = recording.values()
+        self.insert_recorded_responses(url, recorded_responses)
+        logger.info("💾 Recording for %s saved to %s", url, self.get_database_path())
+
+    def append_recorded_response(self, url: str, recorded_response: RecordedResponse):
+        with self._lock:
+            connection = self._get_connection(create=True)
+            connection.execute(_INSERT, _to_row(url, recorded_response))
+            # commit in batches rather than for each response
+            now = time.monotonic()
+            if now - self._last_commit_time >= self._journal_fsync_interval_s:
+                connection.commit()
+                self._last_commit_time = now
+
+    def sync_journals(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.commit()
+
+    def close(self):
+        self.sync_journals()
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
@@ -0,0 +1,184 @@
+import json
+import logging
+import random
+
+import pytest
+from aoai_api_simulator import constants
+from aoai_api_simulator.config_loader import _load_openai_deployments
+from aoai_api_simulator.limiters import RequestsPerMinuteBucketedWindow, TokensPerMinuteBucketedWindow
+
+
+def add_success_request(
+    window: TokensPerMinuteBucketedWindow,
+    token_count: int,
+    timestamp: float,
+    expected_remaining_requests=None,
+    expected_remaining_tokens=None,
+):
+    result = window.add_request(token_cost=token_count, timestamp=timestamp)
+    assert result.success
+    assert result.retry_reason is None
+    assert result.retry_after is None
+    if expected_remaining_requests is not None:
+        assert result.remaining_requests == expected_remaining_requests
+    if expected_remaining_tokens is not None:
+        assert result.remaining_tokens == expected_remaining_tokens
+    return result
+
+
+def test_allow_requests_within_limits():
+    window = TokensPerMinuteBucketedWindow(requests_per_10_seconds=10, tokens_per_minute=100)
+
+    add_success_request(window, timestamp=1, token_count=5, expected_remaining_requests=9, expected_remaining_tokens=95)
+    add_success_request(window, timestamp=2, token_count=5, expected_remaining_requests=8, expected_remaining_tokens=90)
+
+
+def test_block_when_too_many_requests():
+    window = TokensPerMinuteBucketedWindow(requests_per_10_seconds=10, tokens_per_minute=100)
+
+    add_success_request(window, timestamp=2, token_count=5)
+    for _ in range(8):
+        add_success_request(window, timestamp=3, token_count=5)
+    add_success_request(window, timestamp=4, token_count=5)
+
+    result = window.add_request(timestamp=5, token_cost=5)
+    assert not result.success
+    assert result.retry_reason == "requests"
+    # exact sliding window gives 7 (the t=2 request leaves the 10s window at t=12)
+    # buckets can add up to 1s
+    assert 7 <= result.retry_after <= 8
+
+
+def test_block_when_too_many_tokens():
+    window = TokensPerMinuteBucketedWindow(requests_per_10_seconds=10, tokens_per_minute=100)
+
+    add_success_request(window, timestamp=10, token_count=20)
+    add_success_request(window, timestamp=20, token_count=20)
+    add_success_request(window, timestamp=30, token_count=20)
+    add_success_request(window, timestamp=40, token_count=40)
+
+    # exact sliding window values are 20, 30 and 50
+    result = window.add_request(timestamp=50, token_cost=20)
+    assert not result.success
+    assert result.retry_reason == "tokens"
+    assert 20 <= result.retry_after <= 21
+
+    result = window.add_request(timestamp=50, token_cost=40)
+    assert not result.success
+    assert 30 <= result.retry_after <= 31
+
+    result = window.add_request(timestamp=50, token_cost=100)
+    assert not result.success
+    assert 50 <= result.retry_after <= 51
+
+    # after the retry_after period the request is allowed
+    add_success_request(window, timestamp=50 + 21, token_count=20)
+
+
+def test_retry_after_is_honoured():
+    window = TokensPerMinuteBucketedWindow(requests_per_10_seconds=1000, tokens_per_minute=1000)
+
+    add_success_request(window, timestamp=0.5, token_count=1000)
+    result = window.add_request(timestamp=30.7, token_cost=10)
+    assert not result.success
+    add_success_request(window, timestamp=30.7 + result.retry_after, token_count=10)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_never_exceeds_limits(seed: int):
+    # The bucketed window may throttle slightly early, but never admits more than the limits
+    # in any 60s (tokens) or 10s (requests) sliding window
+    rng = random.Random(seed)
+    tokens_per_minute = 1000
+    requests_per_10_seconds = 20
+    window = TokensPerMinuteBucketedWindow(
+        requests_per_10_seconds=requests_per_10_seconds, tokens_per_minute=tokens_per_minute
+    )
+
+    accepted = []
+    timestamp = 0.0
+    for _ in range(5000):
+        timestamp += rng.choice([0, 0.01, 0.1, 0.3, 1, 2.5])
+        token_cost = rng.randint(1, 100)
+        result = window.add_request(token_cost=token_cost, timestamp=timestamp)
+        if result.success:
+            accepted.append((timestamp, token_cost))
+            tokens_in_60s = sum(cost for ts, cost in accepted if ts > timestamp - 60)
+            requests_in_10s = sum(1 for ts, _ in accepted if ts > timestamp - 10)
+            assert tokens_in_60s <= tokens_per_minute
+            assert requests_in_10s <= requests_per_10_seconds
+        else:
+            assert result.retry_after >= 1
+
+
+def test_requests_per_minute_allow_and_block():
+    window = RequestsPerMinuteBucketedWindow(requests_per_minute=3)
+
+    assert window.add_request(timestamp=1).remaining_requests == 2
+    assert window.add_request(timestamp=2).remaining_requests == 1
+    assert window.add_request(timestamp=3).remaining_requests == 0
+
+    result = window.add_request(timestamp=4)
+    assert not result.success
+    assert result.retry_reason == "requests"
+    # exact sliding window gives 57 (the t=1 request leaves the window at t=61)
+    assert 57 <= result.retry_after <= 58
+
+    assert window.add_request(timestamp=62).success
+
+
+def test_remove_request_releases_capacity():
+    window = TokensPerMinuteBucketedWindow(requests_per_10_seconds=10, tokens_per_minute=100)
+
+    add_success_request(window, timestamp=1.5, token_count=60)
+    add_success_request(window, timestamp=2.5, token_count=40)
+    assert not window.add_request(timestamp=3, token_cost=10).success
+
+    window.remove_request(token_cost=40, timestamp=2.5)
+    add_success_request(window, timestamp=3, token_count=10, expected_remaining_tokens=30)
+
+    # removing a request whose bucket has left the window has no effect
+    window.remove_request(token_cost=60, timestamp=1.5)
+    add_success_request(window, timestamp=70, token_count=100, expected_remaining_tokens=0)
+    window.remove_request(token_cost=60, timestamp=1.5)
+    assert not window.add_request(timestamp=70, token_cost=1).success
+
+
+def test_requests_per_minute_remove_request():
+    window = RequestsPerMinuteBucketedWindow(requests_per_minute=1)
+
+    assert window.add_request(timestamp=1).success
+    assert not window.add_request(timestamp=2).success
+    window.remove_request(timestamp=1)
+    assert window.add_request(timestamp=2).success
+
+
+def test_rate_limit_mode_loaded_from_deployment_config(tmp_path, monkeypatch):
+    config_path = tmp_path / "deployments.json"
+    config_path.write_text(
+        json.dumps(
+            {
+                "sliding": {"model": "gpt-3.5-turbo", "tokensPerMinute": 1000},
+                "bucketed": {"model": "gpt-3.5-turbo", "tokensPerMinute": 1000, "rateLimitMode": "bucketed"},
+            }
+        ),
+        encoding="utf-8",
+    )
+    monkeypatch.setenv("OPENAI_DEPLOYMENT_CONFIG_PATH", str(config_path))
+
+    deployments = _load_openai_deployments(logging.getLogger("tests"))
+
+    assert deployments["sliding"].rate_limit_mode == constants.RATE_LIMIT_MODE_SLIDING
+    assert deployments["bucketed"].rate_limit_mode == constants.RATE_LIMIT_MODE_BUCKETED
+
+
+def test_invalid_rate_limit_mode_raises(tmp_path, monkeypatch):
+    config_path = tmp_path / "deployments.json"
+    config_path.write_text(
+        json.dumps({"invalid": {"model": "gpt-3.5-turbo", "tokensPerMinute": 1000, "rateLimitMode": "fixed"}}),
+        encoding="utf-8",
+    )
+    monkeypatch.setenv("OPENAI_DEPLOYMENT_CONFIG_PATH", str(config_path))
+
+    with pytest.raises(ValueError):
+        _load_openai_deployments(logging.getLogger("tests"))
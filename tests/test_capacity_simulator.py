@@ -0,0 +1,118 @@
+"""
+Test the offline rate-limit capacity simulator (tools/capacity-simulator) against the simulator's windows
+"""
+
+import importlib.util
+import json
+import math
+import os
+import random
+
+import pytest
+from aoai_api_simulator.limiters import RequestsPerMinuteSlidingWindow, TokensPerMinuteSlidingWindow
+
+np = pytest.importorskip("numpy")
+
+_tool_path = os.path.join(os.path.dirname(__file__), "..", "tools", "capacity-simulator", "capacity_simulator.py")
+_spec = importlib.util.spec_from_file_location("capacity_simulator", _tool_path)
+capacity_simulator = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(capacity_simulator)
+
+
+def _create_trace(seed: int, count: int, max_gap: float, max_cost: int) -> tuple[list[float], list[int]]:
+    rng = random.Random(seed)
+    timestamps = []
+    token_costs = []
+    timestamp = 0.0
+    for _ in range(count):
+        # mix bursts of simultaneous requests with gaps that expire the windows
+        timestamp += rng.choice([0, 0, rng.uniform(0, max_gap), rng.uniform(0, 70)])
+        timestamps.append(timestamp)
+        token_costs.append(rng.randint(1, max_cost))
+    return timestamps, token_costs
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_tokens_window_matches_limiter(seed: int):
+    timestamps, token_costs = _create_trace(seed, count=3000, max_gap=0.5, max_cost=400)
+    tokens_per_minute = 5000
+
+    result = capacity_simulator.simulate_tokens_window(timestamps, token_costs, tokens_per_minute)
+
+    window = TokensPerMinuteSlidingWindow(
+        requests_per_10_seconds=math.ceil(tokens_per_minute / 1000), tokens_per_minute=tokens_per_minute
+    )
+    for index, (timestamp, token_cost) in enumerate(zip(timestamps, token_costs)):
+        expected = window.add_request(token_cost=token_cost, timestamp=timestamp)
+        assert result.accepted[index] == expected.success, f"request {index}"
+        if expected.success:
+            assert result.remaining_tokens[index] == expected.remaining_tokens
+            assert result.remaining_requests[index] == expected.remaining_requests
+        else:
+            assert result.retry_after[index] == expected.retry_after, f"request {index}"
+            assert result.retry_reason[index] == (
+                capacity_simulator.RETRY_REASON_TOKENS
+                if expected.retry_reason == "tokens"
+                else capacity_simulator.RETRY_REASON_REQUESTS
+            )
+    assert not result.accepted.all() and result.accepted.any()
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_requests_window_matches_limiter(seed: int):
+    timestamps, _ = _create_trace(seed, count=2000, max_gap=5, max_cost=1)
+    requests_per_minute = 20
+
+    result = capacity_simulator.simulate_requests_window(timestamps, requests_per_minute)
+
+    window = RequestsPerMinuteSlidingWindow(requests_per_minute=requests_per_minute)
+    for index, timestamp in enumerate(timestamps):
+        expected = window.add_request(timestamp=timestamp)
+        assert result.accepted[index] == expected.success, f"request {index}"
+        if expected.success:
+            assert result.remaining_requests[index] == expected.remaining_requests
+        else:
+            assert result.retry_after[index] == expected.retry_after, f"request {index}"
+    assert not result.accepted.all() and result.accepted.any()
+
+
+def test_unordered_timestamps_raise():
+    with pytest.raises(ValueError):
+        capacity_simulator.simulate_tokens_window([2, 1], [10, 10], tokens_per_minute=1000)
+
+
+def test_trace_file_is_simulated_and_verified(tmp_path):
+    pd = pytest.importorskip("pandas")
+
+    timestamps, token_costs = _create_trace(0, count=1000, max_gap=0.5, max_cost=400)
+    rng = random.Random(0)
+    trace = pd.DataFrame(
+        {
+            "timestamp": timestamps,
+            "deployment": [rng.choice(["gpt-35-turbo-5k-token", "whisper"]) for _ in timestamps],
+            "token_cost": token_costs,
+        }
+    )
+    trace_path = os.path.join(tmp_path, "trace.csv")
+    trace.to_csv(trace_path, index=False)
+
+    deployments_path = os.path.join(tmp_path, "deployments.json")
+    with open(deployments_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "gpt-35-turbo-5k-token": {"model": "gpt-3.5-turbo", "tokensPerMinute": 5000},
+                "whisper": {"model": "whisper", "requestsPerMinute": 10},
+            },
+            f,
+        )
+    output_path = os.path.join(tmp_path, "output.csv")
+
+    exit_code = capacity_simulator.main(
+        [trace_path, "--deployments", deployments_path, "--output", output_path, "--verify"]
+    )
+
+    assert exit_code == 0
+    output = pd.read_csv(output_path)
+    assert len(output) == len(trace)
+    assert set(output["retry_reason"].dropna()) <= {"tokens", "requests"}
+    assert output["accepted"].sum() < len(trace)
@@ -0,0 +1,138 @@
+"""
+Test the simulated clock and time dilation
+"""
+
+import time
+
+import pytest
+from aoai_api_simulator.clock import SimulatorClock, simulator_clock
+from aoai_api_simulator.generator.lorem import generate_lorem_text
+from aoai_api_simulator.generator.manager import get_default_generators
+from aoai_api_simulator.generator.model_catalogue import model_catalogue
+from aoai_api_simulator.models import ChatCompletionLatency, Config, LatencyConfig, OpenAIDeployment
+from openai import AzureOpenAI, RateLimitError
+
+from .test_uvicorn_server import UvicornTestServer
+
+API_KEY = "123456789"
+ENDPOINT = "http://localhost:8001"
+
+
+def test_default_clock_matches_real_time():
+    clock = SimulatorClock()
+    assert abs(clock.time() - time.time()) < 0.1
+
+
+def test_dilated_clock_runs_faster_than_real_time():
+    clock = SimulatorClock(dilation=60)
+
+    simulated_start = clock.perf_counter()
+    real_start = time.perf_counter()
+    time.sleep(0.2)
+    simulated_duration = clock.perf_counter() - simulated_start
+    real_duration = time.perf_counter() - real_start
+
+    assert simulated_duration == pytest.approx(real_duration * 60, rel=0.1)
+
+
+def test_clocks_with_same_dilation_agree():
+    # processes sharing rate-limit state need to agree on the simulated time
+    assert SimulatorClock(dilation=60).time() == pytest.approx(SimulatorClock(dilation=60).time(), abs=1)
+
+
+@pytest.mark.asyncio
+async def test_sleep_is_scaled_by_dilation():
+    clock = SimulatorClock(dilation=100)
+
+    start = time.perf_counter()
+    await clock.sleep(10)
+    duration = time.perf_counter() - start
+
+    assert duration < 1
+
+
+def test_invalid_dilation_raises():
+    with pytest.raises(ValueError):
+        SimulatorClock(dilation=0)
+
+
+def _get_generator_config(time_dilation: float = 60) -> Config:
+    config = Config(generators=get_default_generators(), TIME_DILATION=time_dilation)
+    config.simulator_api_key = API_KEY
+    config.simulator_mode = "generate"
+    config.latency = LatencyConfig(
+        open_ai_chat_completions=ChatCompletionLatency(
+            LATENCY_OPENAI_CHAT_COMPLETIONS_MEAN=0,
+            LATENCY_OPENAI_CHAT_COMPLETIONS_STD_DEV=0.1,
+        ),
+    )
+    config.openai_deployments = {
+        "low_limit": OpenAIDeployment(
+            name="low_limit", model=model_catalogue["gpt-3.5-turbo"], tokens_per_minute=64 * 6
+        ),
+    }
+    return config
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_window_uses_dilated_time():
+    """
+    Ensure that with a dilation of 60 the tokens-per-minute window resets in around a second
+    """
+    # A second of real time is a minute of simulated time, so generate text up front
+    # to avoid the first request taking longer than the window while the lorem text is initialised
+    generate_lorem_text(max_tokens=300, model_name="gpt-3.5-turbo")
+
+    config = _get_generator_config()
+    server = UvicornTestServer(config)
+    try:
+        with server.run_in_thread():
+            aoai_client = AzureOpenAI(
+                api_key=API_KEY,
+                api_version="2023-12-01-preview",
+                azure_endpoint=ENDPOINT,
+                max_retries=0,
+            )
+            messages = [{"role": "user", "content": "What is the meaning of life?"}]
+            aoai_client.chat.completions.create(model="low_limit", messages=messages, max_tokens=300)
+
+            with pytest.raises(RateLimitError) as e:
+                aoai_client.chat.completions.create(model="low_limit", messages=messages, max_tokens=300)
+            # The window is a minute of simulated time, i.e. one second of real time
+            assert e.value.response.headers["Retry-After"] == "1"
+            assert int(e.value.response.headers["retry-after-ms"]) <= 1000
+
+            time.sleep(1.1)
+            response = aoai_client.chat.completions.create(model="low_limit", messages=messages, max_tokens=300)
+            assert len(response.choices) == 1
+    finally:
+        simulator_clock.set_dilation(1)
+
+
+@pytest.mark.asyncio
+async def test_response_timestamps_use_real_time():
+    """
+    Ensure that the timestamps in responses aren't dilated (large dilations would otherwise
+    produce timestamps far in the future)
+    """
+    config = _get_generator_config(time_dilation=3600)
+    server = UvicornTestServer(config)
+    try:
+        with server.run_in_thread():
+            aoai_client = AzureOpenAI(
+                api_key=API_KEY,
+                api_version="2023-12-01-preview",
+                azure_endpoint=ENDPOINT,
+                max_retries=0,
+            )
+            messages = [{"role": "user", "content": "What is the meaning of life?"}]
+            response = aoai_client.chat.completions.create(model="low_limit", messages=messages, max_tokens=10)
+            assert abs(response.created - time.time()) < 60
+
+            stream = aoai_client.chat.completions.create(
+                model="low_limit", messages=messages, max_tokens=10, stream=True
+            )
+            for chunk in stream:
+                assert abs(chunk.created - time.time()) < 60
+    finally:
+        simulator_clock.set_dilation(1)
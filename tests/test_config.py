@@ -2,7 +2,9 @@
 Test simulator config endpoints
 """
 
-from openai import AzureOpenAI, InternalServerError
+import os
+
+from openai import AzureOpenAI, InternalServerError, RateLimitError
 import pytest
 from pytest_httpserver import HTTPServer
 import requests
@@ -11,15 +13,20 @@ from tests.test_openai_record import TempDirectory
 
 from .test_uvicorn_server import UvicornTestServer
 
+from aoai_api_simulator import app_builder, constants
+from aoai_api_simulator.config_loader import set_config
 from aoai_api_simulator.generator.manager import get_default_generators
+from aoai_api_simulator.generator.model_catalogue import model_catalogue
 from aoai_api_simulator.models import (
     Config,
+    OpenAIDeployment,
     LatencyConfig,
     ChatCompletionLatency,
     CompletionLatency,
     EmbeddingLatency,
 )
 from aoai_api_simulator.record_replay.handler import get_default_forwarders
+from aoai_api_simulator.record_replay.persistence import JOURNAL_SUFFIX, YamlRecordingPersister
 
 API_KEY = "123456789"
 
@@ -74,7 +81,10 @@ async def test_config_update_latency():
             "latency": {
                 "open_ai_completions": {
                     "mean": 0.5,
-                }
+                },
+                "open_ai_streaming_inter_token": {
+                    "mean": 5,
+                },
             }
         }
         response = requests.patch(
@@ -92,6 +102,98 @@ async def test_config_update_latency():
         assert config_json["latency"]["open_ai_completions"]["std_dev"] == 0.1
         assert config_json["latency"]["open_ai_chat_completions"]["mean"] == 0
         assert config_json["latency"]["open_ai_chat_completions"]["std_dev"] == 0.1
+        assert config_json["latency"]["open_ai_streaming_inter_token"]["mean"] == 5
+
+
+@pytest.mark.asyncio
+async def test_config_update_preserves_rate_limit_state():
+    """
+    Ensure that updating the config doesn't reset the rate-limiting windows
+    and that the limits for a deployment can be updated
+    """
+    config = _get_generator_config()
+    config.openai_deployments = {
+        "low_limit": OpenAIDeployment(name="low_limit", model=model_catalogue["gpt-3.5-turbo"], tokens_per_minute=1000)
+    }
+    server = UvicornTestServer(config)
+    with server.run_in_thread():
+        url = "http://localhost:8001/++/config"
+        headers = {"api-key": API_KEY}
+        aoai_client = AzureOpenAI(
+            api_key=API_KEY,
+            api_version="2023-12-01-preview",
+            azure_endpoint="http://localhost:8001",
+            max_retries=0,
+        )
+        messages = [{"role": "user", "content": "What is the meaning of life?"}]
+        aoai_client.chat.completions.create(model="low_limit", messages=messages, max_tokens=500)
+        with pytest.raises(RateLimitError):
+            aoai_client.chat.completions.create(model="low_limit", messages=messages, max_tokens=500)
+
+        # Changing the latency shouldn't reset the window
+        config_update = {"latency": {"open_ai_chat_completions": {"mean": 0.01}}}
+        response = requests.patch(url, headers=headers, json=config_update, timeout=10)
+        assert response.status_code == 200
+        with pytest.raises(RateLimitError):
+            aoai_client.chat.completions.create(model="low_limit", messages=messages, max_tokens=500)
+
+        # Increasing the limit should allow the request
+        config_update = {"openai_deployments": {"low_limit": {"tokens_per_minute": 10000}}}
+        response = requests.patch(url, headers=headers, json=config_update, timeout=10)
+        assert response.json()["openai_deployments"]["low_limit"]["tokens_per_minute"] == 10000
+        response = aoai_client.chat.completions.create(model="low_limit", messages=messages, max_tokens=500)
+        assert len(response.choices) == 1
+
+        response = requests.patch(url, headers=headers, json={"openai_deployments": {"unknown": {}}}, timeout=10)
+        assert response.status_code == 400
+
+        # Invalid limits and unsupported settings are rejected without changing the config
+        for deployment_update in [
+            {"tokens_per_minute": "abc"},
+            {"tokens_per_minute": -5},
+            {"tokens_per_minute": 1.5},
+            {"requests_per_minute": True},
+            {"model": "gpt-4"},
+        ]:
+            config_update = {"openai_deployments": {"low_limit": deployment_update}}
+            response = requests.patch(url, headers=headers, json=config_update, timeout=10)
+            assert response.status_code == 400, deployment_update
+        response = requests.get(url, headers=headers, timeout=10)
+        assert response.json()["openai_deployments"]["low_limit"]["tokens_per_minute"] == 10000
+
+
+def test_set_config_updates_limiter_windows_in_place():
+    config = Config(generators=[])
+    config.openai_deployments = {
+        "deployment1": OpenAIDeployment(
+            name="deployment1", model=model_catalogue["gpt-3.5-turbo"], tokens_per_minute=1000
+        ),
+        "deployment2": OpenAIDeployment(
+            name="deployment2", model=model_catalogue["gpt-3.5-turbo"], tokens_per_minute=1000
+        ),
+    }
+    set_config(config)
+    limiter = config.limiters[constants.LIMITER_OPENAI_TOKENS]
+    window = limiter._deployment_limits["deployment1"]  # pylint: disable=protected-access
+    assert window.add_request(token_cost=1000, timestamp=1).success
+
+    new_config = config.model_copy(
+        update={
+            "openai_deployments": {
+                "deployment1": OpenAIDeployment(
+                    name="deployment1", model=model_catalogue["gpt-3.5-turbo"], tokens_per_minute=1500
+                ),
+            }
+        }
+    )
+    set_config(new_config, preserve_limiter_state=True)
+
+    assert new_config.limiters[constants.LIMITER_OPENAI_TOKENS] is limiter
+    assert limiter._deployment_limits == {"deployment1": window}  # pylint: disable=protected-access
+    # the existing request still counts against the new limit
+    result = window.add_request(token_cost=1000, timestamp=2)
+    assert not result.success
+    assert window.add_request(token_cost=500, timestamp=2).success
 
 
 def _get_record_config(httpserver: HTTPServer, recording_path: str) -> Config:
@@ -173,3 +275,59 @@ async def test_openai_record_replay_completion_via_config_endpoint(httpserver: H
                 response = aoai_client.completions.create(model="deployment1", prompt=prompt, max_tokens=50)
 
             assert e.value.status_code == 500
+
+
+@pytest.mark.asyncio
+async def test_config_update_keeps_record_replay_handler(httpserver: HTTPServer):
+    """
+    Ensure that updating config unrelated to recording doesn't save the recordings or replace the handler
+    """
+    httpserver.expect_request(
+        uri="/openai/deployments/deployment1/completions",
+        query_string="api-version=2023-12-01-preview",
+        method="POST",
+    ).respond_with_data(
+        '{"id":"cmpl-1","object":"text_completion","created":1711038651,"model":"gpt-35-turbo",'
+        + '"choices":[{"text":"This is a test","index":0,"finish_reason":"length","logprobs":null}],'
+        + '"usage":{"prompt_tokens":7,"completion_tokens":50,"total_tokens":57}}'
+    )
+
+    with TempDirectory() as temp_dir:
+        config = _get_record_config(httpserver, temp_dir.path)
+        server = UvicornTestServer(config)
+        with server.run_in_thread():
+            aoai_client = AzureOpenAI(
+                api_key=API_KEY,
+                api_version="2023-12-01-preview",
+                azure_endpoint="http://localhost:8001",
+                max_retries=0,
+            )
+            aoai_client.completions.create(model="deployment1", prompt="This is a test prompt", max_tokens=50)
+            handler = app_builder.record_replay_handler
+
+            response = requests.patch(
+                "http://localhost:8001/++/config",
+                headers={"api-key": API_KEY},
+                json={"latency": {"open_ai_completions": {"mean": 0.5}}},
+                timeout=10,
+            )
+            assert response.status_code == 200
+
+            assert app_builder.record_replay_handler is handler
+            # the recorded response is still in the journal (i.e. the recording wasn't compacted)
+            recording_path = YamlRecordingPersister(temp_dir.path).get_recording_file_path(
+                "/openai/deployments/deployment1/completions"
+            )
+            assert not os.path.exists(recording_path)
+            assert os.path.exists(recording_path + JOURNAL_SUFFIX)
+
+            # changing the mode replaces the handler
+            response = requests.patch(
+                "http://localhost:8001/++/config",
+                headers={"api-key": API_KEY},
+                json={"simulator_mode": "replay"},
+                timeout=10,
+            )
+            assert response.status_code == 200
+            assert app_builder.record_replay_handler is not handler
+            assert os.path.exists(recording_path)
@@ -0,0 +1,160 @@
+"""
+Test generating text from a corpus file
+"""
+
+import os
+import random
+
+import pytest
+import tiktoken
+from aoai_api_simulator.generator import corpus as corpus_module
+from aoai_api_simulator.generator.corpus import TextCorpus
+from aoai_api_simulator.generator.manager import get_default_generators
+from aoai_api_simulator.models import ChatCompletionLatency, Config, LatencyConfig
+from openai import AzureOpenAI
+
+from .test_uvicorn_server import UvicornTestServer
+
+API_KEY = "123456789"
+
+_sentences = [
+    "The quick brown fox jumps over the lazy dog.",
+    "Rate limits are applied per deployment, and the retry-after header says when to retry!",
+    "Naïve café owners serve crème brûlée — “delicious” they say.",
+    "Numbers like 12345 and 3.14159 tokenize differently to words",
+    "It's  got   extra spaces,\ttabs\tand\n\nblank lines.",
+    "def generate(text: str) -> list[int]: return encode(text)",
+]
+
+
+def _write_corpus(path: str, sentence_count: int = 3000, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    text = " ".join(rng.choice(_sentences) for _ in range(sentence_count))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return text
+
+
+@pytest.fixture(name="small_blocks")
+def fixture_small_blocks(monkeypatch):
+    # use small blocks to exercise the block boundaries when building the index
+    monkeypatch.setattr(corpus_module, "_BLOCK_SIZE", 4096)
+
+
+@pytest.mark.usefixtures("small_blocks")
+def test_index_token_count_matches_tokenizer(tmp_path):
+    path = os.path.join(tmp_path, "corpus.txt")
+    text = _write_corpus(path)
+
+    corpus = TextCorpus(path, "gpt-3.5-turbo")
+
+    assert corpus.token_count == len(tiktoken.get_encoding("cl100k_base").encode_ordinary(text))
+
+
+@pytest.mark.usefixtures("small_blocks")
+@pytest.mark.parametrize("max_tokens", [1, 2, 3, 7, 50, 333, 4097, 100_000])
+def test_generated_text_has_exact_token_count(tmp_path, max_tokens: int):
+    path = os.path.join(tmp_path, "corpus.txt")
+    _write_corpus(path)
+    encoding = tiktoken.get_encoding("cl100k_base")
+    corpus = TextCorpus(path, "gpt-3.5-turbo")
+
+    for _ in range(20):
+        text = corpus.generate_text(max_tokens)
+        assert len(encoding.encode_ordinary(text)) == max_tokens
+
+
+def test_generated_text_wraps_past_end_of_corpus(tmp_path):
+    path = os.path.join(tmp_path, "corpus.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        # "re" joined to the end of the corpus would give "there"
+        f.write("re is here and the")
+    encoding = tiktoken.get_encoding("cl100k_base")
+    corpus = TextCorpus(path, "gpt-3.5-turbo")
+
+    for max_tokens in range(1, 41):
+        for _ in range(20):
+            text = corpus.generate_text(max_tokens)
+            assert len(encoding.encode_ordinary(text)) == max_tokens
+            assert set(text.split()) <= {"re", "is", "here", "and", "the"}
+
+
+def test_index_is_saved_and_reused(tmp_path):
+    path = os.path.join(tmp_path, "corpus.txt")
+    _write_corpus(path, sentence_count=100)
+    TextCorpus(path, "gpt-3.5-turbo")
+    assert os.path.exists(f"{path}.cl100k_base.index")
+
+    corpus = TextCorpus(path, "gpt-3.5-turbo")
+
+    # the loaded index is memory-mapped rather than rebuilt
+    assert isinstance(corpus._cumulative_tokens, memoryview)  # pylint: disable=protected-access
+    assert len(tiktoken.get_encoding("cl100k_base").encode_ordinary(corpus.generate_text(20))) == 20
+
+
+def test_index_is_rebuilt_when_corpus_changes(tmp_path):
+    path = os.path.join(tmp_path, "corpus.txt")
+    _write_corpus(path, sentence_count=100)
+    original_count = TextCorpus(path, "gpt-3.5-turbo").token_count
+
+    text = _write_corpus(path, sentence_count=200, seed=1)
+    corpus = TextCorpus(path, "gpt-3.5-turbo")
+
+    assert corpus.token_count != original_count
+    assert corpus.token_count == len(tiktoken.get_encoding("cl100k_base").encode_ordinary(text))
+
+
+@pytest.mark.parametrize("truncate_to", [0, 16, 32, 100, -8])
+def test_index_is_rebuilt_when_truncated(tmp_path, truncate_to: int):
+    path = os.path.join(tmp_path, "corpus.txt")
+    text = _write_corpus(path, sentence_count=100)
+    index_path = f"{path}.cl100k_base.index"
+    TextCorpus(path, "gpt-3.5-turbo")
+    with open(index_path, "r+b") as f:
+        f.truncate(truncate_to if truncate_to >= 0 else os.path.getsize(index_path) + truncate_to)
+
+    corpus = TextCorpus(path, "gpt-3.5-turbo")
+
+    assert corpus.token_count == len(tiktoken.get_encoding("cl100k_base").encode_ordinary(text))
+    assert len(tiktoken.get_encoding("cl100k_base").encode_ordinary(corpus.generate_text(20))) == 20
+    # the rebuilt index is saved
+    assert isinstance(TextCorpus(path, "gpt-3.5-turbo")._offsets, memoryview)  # pylint: disable=protected-access
+
+
+def test_invalid_utf8_raises(tmp_path):
+    path = os.path.join(tmp_path, "corpus.bin")
+    with open(path, "wb") as f:
+        f.write(b"valid text \xff\xfe invalid")
+
+    with pytest.raises(ValueError):
+        TextCorpus(path, "gpt-3.5-turbo")
+
+
+@pytest.mark.asyncio
+async def test_chat_completion_uses_corpus(tmp_path):
+    path = os.path.join(tmp_path, "corpus.txt")
+    text = _write_corpus(path, sentence_count=200)
+
+    config = Config(generators=get_default_generators(), CORPUS_PATH=path)
+    config.simulator_api_key = API_KEY
+    config.simulator_mode = "generate"
+    config.latency = LatencyConfig(
+        open_ai_chat_completions=ChatCompletionLatency(
+            LATENCY_OPENAI_CHAT_COMPLETIONS_MEAN=0,
+            LATENCY_OPENAI_CHAT_COMPLETIONS_STD_DEV=0.1,
+        ),
+    )
+    server = UvicornTestServer(config)
+    with server.run_in_thread():
+        aoai_client = AzureOpenAI(
+            api_key=API_KEY,
+            api_version="2023-12-01-preview",
+            azure_endpoint="http://localhost:8001",
+            max_retries=0,
+        )
+        messages = [{"role": "user", "content": "What is the meaning of life?"}]
+        response = aoai_client.chat.completions.create(model="deployment1", messages=messages, max_tokens=30)
+
+    assert response.usage.completion_tokens == 30
+    corpus_words = set(text.split())
+    assert all(word in corpus_words for word in response.choices[0].message.content.split())
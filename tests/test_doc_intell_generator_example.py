@@ -6,6 +6,7 @@ import os
 
 import aiohttp
 import pytest
+from aoai_api_simulator.clock import simulator_clock
 from aoai_api_simulator.generator.manager import get_default_generators
 from aoai_api_simulator.models import (
     ChatCompletionLatency,
@@ -23,8 +24,8 @@ from .test_uvicorn_server import UvicornTestServer
 API_KEY = "123456789"
 
 
-def _get_generator_config() -> Config:
-    config = Config(generators=get_default_generators())
+def _get_generator_config(time_dilation: float = 1) -> Config:
+    config = Config(generators=get_default_generators(), TIME_DILATION=time_dilation)
     config.simulator_api_key = API_KEY
     config.simulator_mode = "generate"
     config.latency = LatencyConfig(
@@ -91,6 +92,30 @@ async def test_gets_result():
         assert len(result.pages) == 1
 
 
+@pytest.mark.asyncio
+async def test_gets_result_with_large_time_dilation():
+    """
+    Ensure that the processing time is simulated with time dilation and the timestamps are still valid
+    """
+    config = _get_generator_config(time_dilation=3600)
+    server = UvicornTestServer(config)
+    try:
+        with server.run_in_thread():
+            credential = AzureKeyCredential(API_KEY)
+            document_analysis_client = DocumentAnalysisClient("http://localhost:8001", credential)
+
+            base_path = os.path.dirname(os.path.realpath(__file__))
+            pdf_path = os.path.join(base_path, "../tools/test-client/receipt.png")
+
+            with open(pdf_path, "rb") as f:
+                poller = document_analysis_client.begin_analyze_document("prebuilt-receipt", f)
+
+            result = poller.result()
+            assert len(result.pages) == 1
+    finally:
+        simulator_clock.set_dilation(1)
+
+
 @pytest.mark.asyncio
 async def test_rate_limit():
     """
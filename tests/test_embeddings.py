@@ -0,0 +1,73 @@
+"""
+Test the deterministic embeddings and embedding cache
+"""
+
+import numpy as np
+import pytest
+from aoai_api_simulator.generator.embeddings import EmbeddingCache, get_embedding_inputs
+
+
+def test_embeddings_are_deterministic():
+    first = EmbeddingCache(max_size=0).get_embedding("text-embedding-ada-002", 1536, "hello world")
+    second = EmbeddingCache(max_size=0).get_embedding("text-embedding-ada-002", 1536, "hello world")
+
+    assert first.dtype == np.float32
+    assert first.shape == (1536,)
+    assert np.array_equal(first, second)
+    assert np.all((first >= -2) & (first <= 2))
+
+
+@pytest.mark.parametrize(
+    "model_name, embedding_size, embedding_input",
+    [
+        ("text-embedding-ada-002", 1536, "hello world!"),
+        ("text-embedding-3-small", 1536, "hello world"),
+        ("text-embedding-ada-002", 768, "hello world"),
+        ("text-embedding-ada-002", 1536, [15339, 1917]),
+    ],
+)
+def test_embeddings_differ_by_input_model_and_size(model_name: str, embedding_size: int, embedding_input):
+    cache = EmbeddingCache()
+    expected = cache.get_embedding("text-embedding-ada-002", 1536, "hello world")
+
+    embedding = cache.get_embedding(model_name, embedding_size, embedding_input)
+
+    assert embedding.shape != expected.shape or not np.array_equal(embedding, expected)
+
+
+def test_repeated_inputs_are_served_from_cache():
+    cache = EmbeddingCache()
+
+    embeddings = cache.get_embeddings("text-embedding-ada-002", 256, ["one", "two", "one"])
+    cached = cache.get_embedding("text-embedding-ada-002", 256, "two")
+
+    assert embeddings.shape == (3, 256)
+    assert np.array_equal(embeddings[0], embeddings[2])
+    assert np.array_equal(embeddings[1], cached)
+    assert not cached.flags.writeable
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_least_recently_used_embedding_is_evicted():
+    cache = EmbeddingCache(max_size=2)
+
+    cache.get_embeddings("text-embedding-ada-002", 8, ["one", "two", "one", "three", "one", "two"])
+
+    assert len(cache) == 2
+    assert (cache.hits, cache.misses) == (2, 4)
+
+    with pytest.raises(ValueError):
+        cache.set_max_size(-1)
+
+
+@pytest.mark.parametrize(
+    "request_input, expected",
+    [
+        ("hello", ["hello"]),
+        (["hello", "world"], ["hello", "world"]),
+        ([15339, 1917], [[15339, 1917]]),
+        ([[15339], [1917]], [[15339], [1917]]),
+    ],
+)
+def test_get_embedding_inputs(request_input, expected):
+    assert get_embedding_inputs(request_input) == expected
@@ -0,0 +1,112 @@
+"""
+Test the pooled HTTP client used for forwarding requests in record mode
+"""
+
+import asyncio
+import contextlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from aoai_api_simulator.models import RecordingConfig
+from aoai_api_simulator.record_replay.forwarding import ForwardingClient
+
+UPSTREAM_DELAY_S = 0.5
+
+
+class _SlowHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 to allow connections to be kept alive
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(UPSTREAM_DELAY_S)
+        # respond with the client port so that tests can check whether connections were reused
+        body = str(self.client_address[1]).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+@contextlib.contextmanager
+def _run_upstream_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _SlowHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}/"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _get_forwarding_client(max_connections: int) -> ForwardingClient:
+    client = ForwardingClient()
+    client.configure(RecordingConfig(RECORDING_FORWARD_MAX_CONNECTIONS=max_connections))
+    return client
+
+
+@pytest.mark.asyncio
+async def test_forwards_requests_concurrently():
+    client = _get_forwarding_client(max_connections=10)
+    with _run_upstream_server() as url:
+        start = time.perf_counter()
+        responses = await asyncio.gather(
+            *[client.request("POST", url, headers={}, content=b"{}") for _ in range(5)]
+        )
+        elapsed = time.perf_counter() - start
+        await client.aclose()
+
+    assert all(response.status_code == 200 for response in responses)
+    # the requests are sent concurrently rather than one at a time
+    assert elapsed < UPSTREAM_DELAY_S * 3
+
+
+@pytest.mark.asyncio
+async def test_limits_concurrent_requests_to_max_connections():
+    client = _get_forwarding_client(max_connections=1)
+    with _run_upstream_server() as url:
+        start = time.perf_counter()
+        responses = await asyncio.gather(
+            *[client.request("POST", url, headers={}, content=b"{}") for _ in range(3)]
+        )
+        elapsed = time.perf_counter() - start
+        await client.aclose()
+
+    assert all(response.status_code == 200 for response in responses)
+    assert elapsed >= UPSTREAM_DELAY_S * 3
+    # the requests are sent one after another on the same kept-alive connection
+    assert len({response.text for response in responses}) == 1
+
+
+@pytest.mark.asyncio
+async def test_reuses_client_within_event_loop():
+    client = _get_forwarding_client(max_connections=10)
+
+    assert client.get_client() is client.get_client()
+
+    await client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_configure_closes_replaced_client():
+    client = _get_forwarding_client(max_connections=10)
+    httpx_client = client.get_client()
+
+    # the client is only replaced when the client settings change
+    client.configure(RecordingConfig(RECORDING_FORWARD_MAX_CONNECTIONS=10))
+    assert client.get_client() is httpx_client
+
+    client.configure(RecordingConfig(RECORDING_FORWARD_MAX_CONNECTIONS=5))
+    new_httpx_client = client.get_client()
+    assert new_httpx_client is not httpx_client
+
+    await client.aclose()
+    assert httpx_client.is_closed
+    assert new_httpx_client.is_closed
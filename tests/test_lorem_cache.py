@@ -0,0 +1,75 @@
+"""
+Test the lorem generation warm-up and on-disk cache
+"""
+
+import os
+import threading
+from unittest.mock import patch
+
+import pytest
+import tiktoken
+from aoai_api_simulator.generator import lorem_cache
+from aoai_api_simulator.generator.lorem import generate_lorem_text, lorem_corpora, lorem_reference_values
+from aoai_api_simulator.generator.lorem_cache import LoremWarmUp, warm_up_lorem_model
+
+
+@pytest.fixture(name="empty_lorem_tables")
+def fixture_empty_lorem_tables():
+    corpora = dict(lorem_corpora)
+    reference_values = dict(lorem_reference_values)
+    lorem_corpora.clear()
+    lorem_reference_values.clear()
+    yield
+    lorem_corpora.clear()
+    lorem_corpora.update(corpora)
+    lorem_reference_values.clear()
+    lorem_reference_values.update(reference_values)
+
+
+@pytest.mark.usefixtures("empty_lorem_tables")
+def test_tables_are_loaded_from_cache(tmp_path):
+    warm_up_lorem_model("gpt-3.5-turbo", str(tmp_path))
+    assert os.path.exists(os.path.join(tmp_path, "lorem-cl100k_base.json"))
+
+    # simulate a new worker process
+    lorem_corpora.clear()
+    with patch("aoai_api_simulator.generator.lorem.LoremCorpus.build") as build:
+        warm_up_lorem_model("gpt-3.5-turbo", str(tmp_path))
+        text = generate_lorem_text(max_tokens=100, model_name="gpt-3.5-turbo")
+
+    build.assert_not_called()
+    assert len(tiktoken.get_encoding("cl100k_base").encode(text)) == 100
+
+
+@pytest.mark.usefixtures("empty_lorem_tables")
+def test_invalid_cache_file_is_replaced(tmp_path):
+    with open(os.path.join(tmp_path, "lorem-cl100k_base.json"), "w", encoding="utf-8") as f:
+        f.write("not json")
+
+    warm_up_lorem_model("gpt-3.5-turbo", str(tmp_path))
+
+    assert "cl100k_base" in lorem_corpora
+    # pylint: disable-next=protected-access
+    assert lorem_cache._load_from_cache(str(tmp_path), "cl100k_base") is not None
+
+
+def test_warm_up_reports_ready_when_complete():
+    warm_up = LoremWarmUp()
+    started = threading.Event()
+    release = threading.Event()
+
+    def blocking_warm_up(*_):
+        started.set()
+        release.wait(10)
+
+    with patch("aoai_api_simulator.generator.lorem_cache.warm_up_lorem_model", side_effect=blocking_warm_up):
+        thread = warm_up.start(["gpt-3.5-turbo"], cache_dir=None)
+        assert started.wait(10)
+        assert not warm_up.is_ready
+
+        release.set()
+        thread.join(10)
+
+    assert warm_up.is_ready
+    # models are only warmed up once
+    assert warm_up.start(["gpt-3.5-turbo"], cache_dir=None) is None
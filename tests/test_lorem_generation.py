@@ -5,9 +5,11 @@ The main challenges have been ensuring low max_token values generate the correct
 """
 
 import time
+from aoai_api_simulator.generator.lorem import LoremCorpus
 from aoai_api_simulator.generator.openai import generate_lorem_text
 from aoai_api_simulator.generator.openai_tokens import num_tokens_from_string
 import pytest
+import tiktoken
 
 
 def test_generation_min_max_time_10_tokens():
@@ -48,6 +50,26 @@ def test_generation_min_max_time_10_000_tokens():
     )
 
 
+@pytest.mark.parametrize("max_tokens", list(range(0, 40)) + [100, 999, 4097, 20000])
+def test_corpus_generates_exact_token_count(max_tokens: int):
+    """
+    Ensure that the token counts from the corpus table match tiktoken's count for the generated text
+    """
+    encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
+    corpus = LoremCorpus.build("gpt-3.5-turbo")
+    assert corpus.is_exact
+
+    for _ in range(20):
+        text = corpus.generate_text(max_tokens)
+        assert len(encoding.encode(text)) == max_tokens
+
+
+def test_corpus_is_not_exact_when_token_counts_are_not_additive():
+    # a line break merges with the surrounding spaces, so isn't counted the same in the joined text
+    corpus = LoremCorpus.build("gpt-3.5-turbo", words=["do", "\n"])
+    assert not corpus.is_exact
+
+
 def run_test(max_tokens, expected_min, expected_max, max_duration, iteration_count=200):
 
     generate_lorem_text(1, "gpt-3.5-turbo-0613")  # ignore first run
@@ -2,7 +2,11 @@
 Test the OpenAI generator endpoints
 """
 
+import json
+import time
+
 import pytest
+import requests
 from aoai_api_simulator.generator.manager import get_default_generators
 from aoai_api_simulator.generator.model_catalogue import model_catalogue
 from aoai_api_simulator.models import (
@@ -12,6 +16,8 @@ from aoai_api_simulator.models import (
     EmbeddingLatency,
     LatencyConfig,
     OpenAIDeployment,
+    StreamingFirstTokenLatency,
+    StreamingInterTokenLatency,
 )
 from openai import AuthenticationError, AzureOpenAI, BadRequestError, NotFoundError, Stream
 from openai.types.chat import ChatCompletionChunk
@@ -204,16 +210,106 @@ async def test_stream_success():
 
         is_first_chunk = True
         count = 0
+        chunk_ids = set()
         chunk: ChatCompletionChunk
         for chunk in response:
             if is_first_chunk:
                 is_first_chunk = False
                 assert chunk.choices[0].delta.role == "assistant"
             assert len(chunk.choices) == 1
+            chunk_ids.add(chunk.id)
             count += 1
 
         assert count > 5
-        assert chunk.choices[0].delta.finish_reason == "length"
+        # all chunks for a response have the same id
+        assert len(chunk_ids) == 1
+        assert chunk.choices[0].finish_reason == "length"
+
+
+@pytest.mark.asyncio
+async def test_stream_is_paced_per_token():
+    """
+    Ensure streamed responses apply the time-to-first-token and inter-token latency
+    """
+    config = _get_generator_config()
+    config.latency.open_ai_streaming_first_token = StreamingFirstTokenLatency(
+        LATENCY_OPENAI_STREAMING_FIRST_TOKEN_MEAN=500,
+        LATENCY_OPENAI_STREAMING_FIRST_TOKEN_STD_DEV=0,
+    )
+    config.latency.open_ai_streaming_inter_token = StreamingInterTokenLatency(
+        LATENCY_OPENAI_STREAMING_INTER_TOKEN_MEAN=20,
+        LATENCY_OPENAI_STREAMING_INTER_TOKEN_STD_DEV=0,
+    )
+    server = UvicornTestServer(config)
+    with server.run_in_thread():
+        aoai_client = AzureOpenAI(
+            api_key=API_KEY,
+            api_version="2023-12-01-preview",
+            azure_endpoint=ENDPOINT,
+            max_retries=0,
+        )
+        messages = [{"role": "user", "content": "What is the meaning of life?"}]
+        start_time = time.perf_counter()
+        response: Stream[ChatCompletionChunk] = aoai_client.chat.completions.create(
+            model="gpt-3.5-10m", messages=messages, max_tokens=50, stream=True
+        )
+
+        chunk_times = []
+        content = ""
+        for chunk in response:
+            chunk_times.append(time.perf_counter() - start_time)
+            content += chunk.choices[0].delta.content or ""
+
+    # each content chunk is a single token (lorem text is ASCII)
+    assert len(chunk_times) == 50 + 1
+    assert len(content.split()) > 5
+    assert chunk_times[0] >= 0.5
+    # 49 inter-token delays of 20ms
+    assert chunk_times[-1] - chunk_times[0] >= 0.9
+    # the latency is applied as the tokens are sent rather than before the response starts
+    assert chunk_times[0] < 0.9
+
+
+@pytest.mark.asyncio
+async def test_stream_include_usage():
+    """
+    Ensure a usage chunk is sent at the end of a streamed response when stream_options.include_usage is set
+    """
+    config = _get_generator_config()
+    config.latency.open_ai_streaming_first_token = StreamingFirstTokenLatency(
+        LATENCY_OPENAI_STREAMING_FIRST_TOKEN_MEAN=0,
+        LATENCY_OPENAI_STREAMING_FIRST_TOKEN_STD_DEV=0,
+    )
+    config.latency.open_ai_streaming_inter_token = StreamingInterTokenLatency(
+        LATENCY_OPENAI_STREAMING_INTER_TOKEN_MEAN=0,
+        LATENCY_OPENAI_STREAMING_INTER_TOKEN_STD_DEV=0,
+    )
+    server = UvicornTestServer(config)
+    with server.run_in_thread():
+        # use a raw request as the version of the openai package used for the tests doesn't support stream_options
+        response = requests.post(
+            f"{ENDPOINT}/openai/deployments/gpt-3.5-10m/chat/completions?api-version=2024-06-01",
+            headers={"api-key": API_KEY},
+            json={
+                "messages": [{"role": "user", "content": "What is the meaning of life?"}],
+                "max_tokens": 10,
+                "stream": True,
+                "stream_options": {"include_usage": True},
+            },
+            timeout=10,
+        )
+
+    assert response.status_code == 200
+    events = [line[len("data: ") :] for line in response.text.split("\n\n") if line]
+    assert events[-1] == "[DONE]"
+    chunks = [json.loads(event) for event in events[:-1]]
+
+    assert all(chunk["usage"] is None for chunk in chunks[:-1])
+    assert chunks[-2]["choices"][0]["finish_reason"] == "length"
+    assert chunks[-1]["choices"] == []
+    usage = chunks[-1]["usage"]
+    assert usage["completion_tokens"] == 10
+    assert usage["total_tokens"] == usage["prompt_tokens"] + 10
 
 
 @pytest.mark.asyncio
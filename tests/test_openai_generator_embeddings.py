@@ -2,11 +2,17 @@
 Test the OpenAI generator endpoints
 """
 
+import base64
+import json
 import logging
+import re
 
+import numpy as np
 import pytest
+from aoai_api_simulator.generator import openai_tokens
 from aoai_api_simulator.generator.manager import get_default_generators
 from aoai_api_simulator.generator.model_catalogue import model_catalogue
+from aoai_api_simulator.generator.openai import create_embeddings, embedding_to_json_float
 from aoai_api_simulator.models import (
     ChatCompletionLatency,
     CompletionLatency,
@@ -147,15 +153,17 @@ async def test_limit_reached():
 
         # "low_limit" deployment has a rate limit of 600 tokens per minute
         # So we will trigger the limit based on the number of requests (not tokens)
-        # and it will reset in 10s
+        # and it will reset within 10s of the first request being received
         with pytest.raises(RateLimitError) as e:
             aoai_client.chat.completions.create(model="low_limit", messages=messages, max_tokens=50)
 
         assert e.value.status_code == 429
-        assert (
-            e.value.message
-            == "Error code: 429 - {'error': {'code': '429', 'message': 'Requests to the OpenAI API Simulator have exceeded call rate limit. Please retry after 10 seconds.'}}"
+        match = re.match(
+            r"Error code: 429 - {'error': {'code': '429', 'message': 'Requests to the OpenAI API Simulator have exceeded call rate limit. Please retry after (\d+) seconds.'}}",
+            e.value.message,
         )
+        assert match
+        assert 1 <= int(match.group(1)) <= 10
 
 
 @pytest.mark.asyncio
@@ -275,3 +283,133 @@ async def test_using_unsupported_model_for_embeddings_returns_400():
             e.value.message
             == "Error code: 400 - {'error': {'code': 'OperationNotSupported', 'message': 'The embeddings operation does not work with the specified model, low_limit. Please choose different model and try again. You can learn more about which models can be used with each operation here: https://go.microsoft.com/fwlink/?linkid=2197993.'}}"
         )
+
+
+@pytest.mark.asyncio
+async def test_encoding_formats():
+    """
+    Ensure embeddings are returned as floats or as base64-encoded float32 values
+    """
+    config = _get_generator_config()
+    server = UvicornTestServer(config)
+    with server.run_in_thread():
+        aoai_client = AzureOpenAI(
+            api_key=API_KEY,
+            api_version="2023-12-01-preview",
+            azure_endpoint=ENDPOINT,
+            max_retries=0,
+        )
+        content = ["This is some text to generate embeddings for", "And some more text"]
+
+        response = aoai_client.embeddings.create(model="deployment1", input=content, encoding_format="float")
+        assert [item.index for item in response.data] == [0, 1]
+        for item in response.data:
+            assert len(item.embedding) == 1536
+            assert all(isinstance(value, float) and -2 <= value <= 2 for value in item.embedding)
+
+        response = aoai_client.embeddings.create(model="deployment1", input=content, encoding_format="base64")
+        assert [item.index for item in response.data] == [0, 1]
+        for item in response.data:
+            embedding = np.frombuffer(base64.b64decode(item.embedding), dtype="<f4")
+            assert len(embedding) == 1536
+            assert np.all((embedding >= -2) & (embedding <= 2))
+
+        with pytest.raises(BadRequestError) as e:
+            aoai_client.embeddings.create(model="deployment1", input=content, encoding_format="int8")
+        assert e.value.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_deterministic_embeddings():
+    """
+    Ensure identical inputs get identical embeddings when deterministic embeddings are enabled
+    """
+    config = _get_generator_config()
+    config.deterministic_embeddings = True
+    server = UvicornTestServer(config)
+    with server.run_in_thread():
+        aoai_client = AzureOpenAI(
+            api_key=API_KEY,
+            api_version="2023-12-01-preview",
+            azure_endpoint=ENDPOINT,
+            max_retries=0,
+        )
+        content = ["This is some text to generate embeddings for", "And some more text"]
+
+        first = aoai_client.embeddings.create(model="deployment1", input=content)
+        second = aoai_client.embeddings.create(model="deployment1", input=list(reversed(content)))
+        third = aoai_client.embeddings.create(model="deployment3", input=content[0], dimensions=256)
+
+    assert first.data[0].embedding == second.data[1].embedding
+    assert first.data[1].embedding == second.data[0].embedding
+    assert first.data[0].embedding != first.data[1].embedding
+    assert len(third.data[0].embedding) == 256
+
+
+@pytest.mark.asyncio
+async def test_oversized_requests_return_400():
+    """
+    Ensure requests exceeding the input limits for the model are rejected
+    """
+    config = _get_generator_config()
+    server = UvicornTestServer(config)
+    with server.run_in_thread():
+        aoai_client = AzureOpenAI(
+            api_key=API_KEY,
+            api_version="2023-12-01-preview",
+            azure_endpoint=ENDPOINT,
+            max_retries=0,
+        )
+
+        with pytest.raises(BadRequestError) as e:
+            aoai_client.embeddings.create(model="deployment1", input=["text"] * 2049)
+        assert "Too many inputs. The max number of inputs is 2048." in e.value.message
+
+        # text-embedding-ada-001 has a limit of 2046 tokens per input
+        with pytest.raises(BadRequestError) as e:
+            aoai_client.embeddings.create(model="deployment2", input=["short text", " hello" * 2047])
+        assert "maximum context length is 2046 tokens, however you requested 2047 tokens in input[1]" in e.value.message
+
+        response = aoai_client.embeddings.create(model="deployment2", input=["short text", " hello" * 2046])
+        assert len(response.data) == 2
+        assert response.usage.prompt_tokens == 2 + 2046
+
+
+
+@pytest.mark.asyncio
+async def test_inputs_are_tokenized_once_without_token_count_cache(monkeypatch):
+    """
+    Ensure the input token counts from the rate-limiter are reused when the token count cache is disabled
+    """
+    tokenized_texts = []
+    count_tokens_batch = openai_tokens._count_tokens_batch  # pylint: disable=protected-access
+
+    def record_count_tokens_batch(encoding, texts):
+        tokenized_texts.extend(texts)
+        return count_tokens_batch(encoding, texts)
+
+    monkeypatch.setattr(openai_tokens, "_count_tokens_batch", record_count_tokens_batch)
+    config = _get_generator_config()
+    config.token_count_cache_size = 0
+    server = UvicornTestServer(config)
+    with server.run_in_thread():
+        aoai_client = AzureOpenAI(
+            api_key=API_KEY,
+            api_version="2023-12-01-preview",
+            azure_endpoint=ENDPOINT,
+            max_retries=0,
+        )
+
+        response = aoai_client.embeddings.create(model="deployment1", input=["first text", "second text"])
+
+    assert len(response.data) == 2
+    assert response.usage.prompt_tokens == 4
+    assert tokenized_texts == ["first text", "second text"]
+
+def test_embedding_to_json_float_round_trips():
+    embeddings = create_embeddings(3, 1000)
+    embeddings[0, :3] = [-2, 2, 0]
+
+    for embedding in embeddings:
+        values = json.loads(embedding_to_json_float(embedding))
+        assert np.allclose(values, embedding, rtol=0, atol=1e-8)
@@ -4,8 +4,10 @@ Test the OpenAI generator endpoints
 
 import shutil
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 import pytest
+import requests
 from aoai_api_simulator.generator.model_catalogue import model_catalogue
 from aoai_api_simulator.models import (
     ChatCompletionLatency,
@@ -16,6 +18,7 @@ from aoai_api_simulator.models import (
     OpenAIDeployment,
 )
 from aoai_api_simulator.record_replay.handler import get_default_forwarders
+from aoai_api_simulator.record_replay.persistence import YamlRecordingPersister
 from openai import AzureOpenAI, InternalServerError, RateLimitError
 from pytest_httpserver import HTTPServer
 
@@ -44,7 +47,7 @@ class TempDirectory:
 API_KEY = "123456879"
 
 
-def _get_record_config(httpserver: HTTPServer, recording_path: str) -> Config:
+def _get_record_config(httpserver: HTTPServer, recording_path: str, recording_format: str = "yaml") -> Config:
     forwarding_server_url = httpserver.url_for("/").removesuffix("/")
     config = Config(generators=[])
     config.simulator_api_key = API_KEY
@@ -52,6 +55,7 @@ def _get_record_config(httpserver: HTTPServer, recording_path: str) -> Config:
     config.recording.aoai_api_endpoint = forwarding_server_url
     config.recording.aoai_api_key = "123456789"
     config.recording.dir = recording_path
+    config.recording.format = recording_format
     config.recording.forwarders = get_default_forwarders()
     config.latency = LatencyConfig(
         open_ai_completions=CompletionLatency(
@@ -70,11 +74,12 @@ def _get_record_config(httpserver: HTTPServer, recording_path: str) -> Config:
     return config
 
 
-def _get_replay_config(recording_path: str) -> Config:
+def _get_replay_config(recording_path: str, recording_format: str = "yaml") -> Config:
     config = Config(generators=[])
     config.simulator_api_key = API_KEY
     config.simulator_mode = "replay"
     config.recording.dir = recording_path
+    config.recording.format = recording_format
     config.recording.forwarders = get_default_forwarders()
     config.latency = LatencyConfig(
         open_ai_completions=CompletionLatency(
@@ -102,7 +107,8 @@ def _get_replay_config(recording_path: str) -> Config:
 
 
 @pytest.mark.asyncio
-async def test_openai_record_replay_completion(httpserver: HTTPServer):
+@pytest.mark.parametrize("recording_format", ["yaml", "indexed", "sqlite"])
+async def test_openai_record_replay_completion(httpserver: HTTPServer, recording_format: str):
     """
     Ensure we can call the completion endpoint using the record mode
     and then replay the same recording in replay mode
@@ -120,7 +126,7 @@ async def test_openai_record_replay_completion(httpserver: HTTPServer):
 
     with TempDirectory() as temp_dir:
         # set up simulated API in record mode
-        config = _get_record_config(httpserver, temp_dir.path)
+        config = _get_record_config(httpserver, temp_dir.path, recording_format)
         server = UvicornTestServer(config)
         with server.run_in_thread():
             aoai_client = AzureOpenAI(
@@ -140,7 +146,7 @@ async def test_openai_record_replay_completion(httpserver: HTTPServer):
         httpserver.clear_all_handlers()
 
         # set up simulated API in replay mode (using the recording from above)
-        config = _get_replay_config(temp_dir.path)
+        config = _get_replay_config(temp_dir.path, recording_format)
         server = UvicornTestServer(config)
         with server.run_in_thread():
             aoai_client = AzureOpenAI(
@@ -169,6 +175,53 @@ async def test_openai_record_replay_completion(httpserver: HTTPServer):
                 assert e.status_code == 500
 
 
+@pytest.mark.asyncio
+async def test_save_recordings_while_recording(httpserver: HTTPServer):
+    """
+    Ensure that saving the recordings while requests are being recorded doesn't lose recorded responses
+    """
+    httpserver.expect_request(
+        uri="/openai/deployments/deployment1/completions",
+        query_string="api-version=2023-12-01-preview",
+        method="POST",
+    ).respond_with_data(
+        '{"id":"cmpl-1","object":"text_completion","created":1711038651,"model":"gpt-35-turbo",'
+        + '"choices":[{"text":"This is a test","index":0,"finish_reason":"length","logprobs":null}],'
+        + '"usage":{"prompt_tokens":7,"completion_tokens":50,"total_tokens":57}}'
+    )
+
+    with TempDirectory() as temp_dir:
+        config = _get_record_config(httpserver, temp_dir.path)
+        server = UvicornTestServer(config)
+        with server.run_in_thread():
+            aoai_client = AzureOpenAI(
+                api_key=API_KEY,
+                api_version="2023-12-01-preview",
+                azure_endpoint="http://localhost:8001",
+                max_retries=0,
+            )
+
+            def record(i: int):
+                aoai_client.completions.create(model="deployment1", prompt=f"Test prompt {i}", max_tokens=50)
+
+            def save_recordings():
+                response = requests.post(
+                    "http://localhost:8001/++/save-recordings", headers={"api-key": API_KEY}, timeout=10
+                )
+                assert response.status_code == 200
+
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                futures = [executor.submit(record, i) for i in range(40)]
+                futures += [executor.submit(save_recordings) for _ in range(10)]
+                for future in futures:
+                    future.result()
+
+        recording = YamlRecordingPersister(temp_dir.path).load_recording_for_url(
+            "/openai/deployments/deployment1/completions", expect_recording_file=True
+        )
+        assert len(recording) == 40
+
+
 @pytest.mark.asyncio
 async def test_openai_record_replay_completion_limit_reached(httpserver: HTTPServer):
     """
@@ -235,7 +288,8 @@ async def test_openai_record_replay_completion_limit_reached(httpserver: HTTPSer
 
 
 @pytest.mark.asyncio
-async def test_openai_record_replay_translation(httpserver: HTTPServer):
+@pytest.mark.parametrize("recording_format", ["yaml", "indexed", "sqlite"])
+async def test_openai_record_replay_translation(httpserver: HTTPServer, recording_format: str):
     """
     Ensure we can call the translation endpoint multiple times using recorded responses to trigger rate-limiting
     Translations uses request-based rate limiting
@@ -252,7 +306,7 @@ async def test_openai_record_replay_translation(httpserver: HTTPServer):
     audio_file_path = "/workspaces/aoai-api-simulator/tests/audio/short-white-noise.mp3"
     with TempDirectory() as temp_dir:
         # set up simulated API in record mode
-        config = _get_record_config(httpserver, temp_dir.path)
+        config = _get_record_config(httpserver, temp_dir.path, recording_format)
         server = UvicornTestServer(config)
         with server.run_in_thread():
             aoai_client = AzureOpenAI(
@@ -271,7 +325,7 @@ async def test_openai_record_replay_translation(httpserver: HTTPServer):
         httpserver.clear_all_handlers()
 
         # set up simulated API in replay mode (using the recording from above)
-        config = _get_replay_config(temp_dir.path)
+        config = _get_replay_config(temp_dir.path, recording_format)
         server = UvicornTestServer(config)
         with server.run_in_thread():
             aoai_client = AzureOpenAI(
@@ -0,0 +1,105 @@
+"""
+Test the serialization of streamed chat completion chunks
+"""
+
+import json
+
+import pytest
+from aoai_api_simulator.generator.openai_streaming import (
+    ChatCompletionChunkTemplate,
+    plan_chunks,
+    stream_chat_completion,
+)
+from aoai_api_simulator.models import (
+    LatencyConfig,
+    StreamingConfig,
+    StreamingFirstTokenLatency,
+    StreamingInterTokenLatency,
+)
+
+
+def _parse_event(event: bytes) -> dict:
+    assert event.startswith(b"data: ")
+    assert event.endswith(b"\n\n")
+    return json.loads(event[len(b"data: ") :])
+
+
+@pytest.mark.parametrize("content", ["Hello", " world", 'quote " and \\ backslash', "new\nline\ttab", "wörld 👋", ""])
+def test_content_chunk_matches_serialized_chunk(content: str):
+    template = ChatCompletionChunkTemplate("gpt-3.5-turbo")
+
+    chunk = _parse_event(template.content_chunk(content))
+
+    assert chunk["id"] == template.id
+    assert chunk["created"] == template.created
+    assert chunk["object"] == "chat.completion.chunk"
+    assert chunk["choices"][0]["delta"] == {"content": content}
+    assert chunk["choices"][0]["finish_reason"] is None
+    assert "usage" not in chunk
+
+
+def test_first_and_finish_chunks():
+    template = ChatCompletionChunkTemplate("gpt-3.5-turbo")
+
+    first_chunk = _parse_event(template.content_chunk("Hello", is_first=True))
+    finish_chunk = _parse_event(template.finish_chunk("length"))
+
+    assert first_chunk["choices"][0]["delta"] == {"role": "assistant", "content": "Hello"}
+    assert finish_chunk["id"] == first_chunk["id"]
+    assert finish_chunk["choices"][0]["delta"] == {}
+    assert finish_chunk["choices"][0]["finish_reason"] == "length"
+
+
+def _get_latency_config(first_token_ms: float, inter_token_ms: float) -> LatencyConfig:
+    return LatencyConfig(
+        open_ai_streaming_first_token=StreamingFirstTokenLatency(
+            LATENCY_OPENAI_STREAMING_FIRST_TOKEN_MEAN=first_token_ms,
+            LATENCY_OPENAI_STREAMING_FIRST_TOKEN_STD_DEV=0,
+        ),
+        open_ai_streaming_inter_token=StreamingInterTokenLatency(
+            LATENCY_OPENAI_STREAMING_INTER_TOKEN_MEAN=inter_token_ms,
+            LATENCY_OPENAI_STREAMING_INTER_TOKEN_STD_DEV=0,
+        ),
+    )
+
+
+_token_chunks = [("One", 1), (" two", 1), (" three", 1), (" four", 1), (" five", 1)]
+
+
+def test_plan_chunks_sends_one_token_per_chunk_by_default():
+    chunks = list(plan_chunks(_token_chunks, _get_latency_config(100, 10), StreamingConfig()))
+
+    assert [content for _, content in chunks] == [text for text, _ in _token_chunks]
+    assert [send_time for send_time, _ in chunks] == pytest.approx([0.1, 0.11, 0.12, 0.13, 0.14])
+
+
+def test_plan_chunks_coalesces_tokens():
+    streaming = StreamingConfig(STREAMING_CHUNK_MODE="tokens", STREAMING_CHUNK_TOKENS=2)
+
+    chunks = list(plan_chunks(_token_chunks, _get_latency_config(100, 10), streaming))
+
+    assert [content for _, content in chunks] == ["One two", " three four", " five"]
+    assert [send_time for send_time, _ in chunks] == pytest.approx([0.11, 0.13, 0.14])
+
+
+def test_plan_chunks_coalesces_by_time():
+    streaming = StreamingConfig(STREAMING_CHUNK_MODE="time", STREAMING_CHUNK_INTERVAL_MS=15)
+
+    chunks = list(plan_chunks(_token_chunks, _get_latency_config(100, 10), streaming))
+
+    # tokens are available at 100, 110, 120, 130 and 140ms
+    assert [content for _, content in chunks] == ["One two", " three four", " five"]
+    assert [send_time for send_time, _ in chunks] == pytest.approx([0.115, 0.135, 0.14])
+
+
+@pytest.mark.asyncio
+async def test_stream_ends_with_usage_and_done():
+    template = ChatCompletionChunkTemplate("gpt-3.5-turbo", include_usage=True)
+    chunks = plan_chunks(_token_chunks, _get_latency_config(0, 0), StreamingConfig())
+
+    events = [event async for event in stream_chat_completion(template, chunks, "stop", usage=(7, 5))]
+
+    assert len(events) == len(_token_chunks) + 3
+    assert all(_parse_event(event)["usage"] is None for event in events[:-2])
+    assert _parse_event(events[-2])["usage"] == {"prompt_tokens": 7, "completion_tokens": 5, "total_tokens": 12}
+    assert events[-1] == b"data: [DONE]\n\n"
@@ -0,0 +1,136 @@
+"""
+Test the tokenizer registry and token count cache
+"""
+
+from unittest.mock import patch
+
+import pytest
+import tiktoken
+from aoai_api_simulator.generator.openai_tokens import (
+    TokenCountCache,
+    get_tokenizer,
+    num_tokens_from_messages,
+    num_tokens_from_string,
+    num_tokens_per_input,
+    split_into_tokens,
+    token_count_cache,
+)
+
+messages = [
+    {"role": "system", "content": "You are a helpful assistant."},
+    {"role": "user", "content": "What is the meaning of life?"},
+]
+
+
+def test_cached_count_matches_tokenizer():
+    cache = TokenCountCache()
+    encoding = tiktoken.get_encoding("cl100k_base")
+    text = "The quick brown fox jumps over the lazy dog"
+
+    assert cache.count_tokens(encoding, text) == len(encoding.encode(text))
+    assert cache.count_tokens(encoding, text) == len(encoding.encode(text))
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+class _CharacterEncoding:
+    # stand-in for a second encoding that counts each character as a token
+    name = "characters"
+
+    def encode(self, text: str) -> list[str]:
+        return list(text)
+
+
+def test_counts_are_cached_per_encoding():
+    cache = TokenCountCache()
+    text = "Bonjour, comment ça va?"
+
+    for encoding in [tiktoken.get_encoding("cl100k_base"), _CharacterEncoding()] * 2:
+        assert cache.count_tokens(encoding, text) == len(encoding.encode(text))
+
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TokenCountCache(max_size=2)
+    encoding = tiktoken.get_encoding("cl100k_base")
+
+    cache.count_tokens(encoding, "one")
+    cache.count_tokens(encoding, "two")
+    cache.count_tokens(encoding, "one")
+    cache.count_tokens(encoding, "three")  # evicts "two"
+    cache.count_tokens(encoding, "one")
+    cache.count_tokens(encoding, "two")
+
+    assert len(cache) == 2
+    assert (cache.hits, cache.misses) == (2, 4)
+
+
+def test_zero_size_disables_cache():
+    cache = TokenCountCache(max_size=0)
+    encoding = tiktoken.get_encoding("cl100k_base")
+
+    assert cache.count_tokens(encoding, "hello") == 1
+    assert cache.count_tokens(encoding, "hello") == 1
+    assert len(cache) == 0
+
+    with pytest.raises(ValueError):
+        cache.set_max_size(-1)
+
+
+def test_batch_counts_only_tokenize_uncached_texts():
+    cache = TokenCountCache()
+    encoding = tiktoken.get_encoding("cl100k_base")
+    texts = ["one", "two words", "one", "three more words"]
+    cache.count_tokens(encoding, "two words")
+
+    with patch.object(tiktoken.Encoding, "encode", wraps=encoding.encode) as encode:
+        counts = cache.count_tokens_batch(encoding, texts)
+
+    assert counts == [len(encoding.encode(text)) for text in texts]
+    # "one" is tokenized twice as it is repeated within the batch
+    assert encode.call_count == 3
+    assert (cache.hits, cache.misses) == (1, 4)
+
+
+def test_num_tokens_per_input():
+    assert num_tokens_per_input(["hello world", [1, 2, 3], "hello"], "text-embedding-ada-002") == [2, 3, 1]
+
+
+def test_split_into_tokens_joins_partial_characters():
+    text = "Hello wörld 👋 and more text"
+
+    chunks = split_into_tokens(text, "gpt-3.5-turbo")
+
+    assert "".join(chunk for chunk, _ in chunks) == text
+    assert sum(tokens for _, tokens in chunks) == len(tiktoken.get_encoding("cl100k_base").encode(text))
+    # the emoji is split across tokens, so it is sent with the token that completes it
+    assert ("👋", 1) in chunks
+
+
+def test_tokenizer_is_resolved_once_per_model():
+    model = "gpt-4-test-registry"
+    with patch("aoai_api_simulator.generator.openai_tokens.tiktoken.encoding_for_model") as encoding_for_model:
+        encoding_for_model.return_value = tiktoken.get_encoding("cl100k_base")
+        for _ in range(3):
+            num_tokens_from_string("hello", model)
+            num_tokens_from_messages(messages, model)
+
+    assert get_tokenizer(model).tokens_per_message == 3
+    # once for the model and once for the model version assumed for chat messages
+    assert encoding_for_model.call_count == 2
+
+
+def test_repeated_messages_are_tokenized_once():
+    token_count_cache.clear()
+    expected = num_tokens_from_messages(messages, "gpt-3.5-turbo")
+
+    with patch.object(tiktoken.Encoding, "encode") as encode:
+        assert num_tokens_from_messages(messages, "gpt-3.5-turbo") == expected
+
+    encode.assert_not_called()
+    assert token_count_cache.hits == 4
+
+
+def test_unsupported_model_raises_for_messages():
+    with pytest.raises(NotImplementedError):
+        num_tokens_from_messages(messages, "text-embedding-ada-002")
@@ -0,0 +1,173 @@
+"""
+Test that rate-limits are checked before responses are generated
+"""
+
+import asyncio
+import itertools
+from unittest.mock import patch
+
+import pytest
+from aoai_api_simulator import constants
+from aoai_api_simulator.generator.manager import get_default_generators
+from aoai_api_simulator.generator.model_catalogue import model_catalogue
+from aoai_api_simulator.generator.openai import azure_openai_chat_completion
+from aoai_api_simulator.generator.openai_tokens import num_tokens_from_messages
+from aoai_api_simulator.limiters import OpenAITokensLimiter
+from aoai_api_simulator.models import ChatCompletionLatency, Config, LatencyConfig, OpenAIDeployment, RequestContext
+from fastapi import Request, Response
+from openai import AzureOpenAI, BadRequestError, RateLimitError
+
+from .test_uvicorn_server import UvicornTestServer
+
+API_KEY = "123456789"
+ENDPOINT = "http://localhost:8001"
+
+
+def _get_generator_config(generators) -> Config:
+    config = Config(generators=generators)
+    config.simulator_api_key = API_KEY
+    config.simulator_mode = "generate"
+    config.latency = LatencyConfig(
+        open_ai_chat_completions=ChatCompletionLatency(
+            LATENCY_OPENAI_CHAT_COMPLETIONS_MEAN=0,
+            LATENCY_OPENAI_CHAT_COMPLETIONS_STD_DEV=0.1,
+        ),
+    )
+    config.openai_deployments = {
+        "low_limit": OpenAIDeployment(
+            name="low_limit", model=model_catalogue["gpt-3.5-turbo"], tokens_per_minute=64 * 6
+        ),
+        "low_limit_embedding": OpenAIDeployment(
+            name="low_limit_embedding",
+            model=model_catalogue["text-embedding-ada-002"],
+            embedding_size=1536,
+            tokens_per_minute=1000,
+        ),
+    }
+    return config
+
+
+def _get_client() -> AzureOpenAI:
+    return AzureOpenAI(
+        api_key=API_KEY,
+        api_version="2023-12-01-preview",
+        azure_endpoint=ENDPOINT,
+        max_retries=0,
+    )
+
+
+@pytest.mark.asyncio
+async def test_rejected_requests_skip_generation():
+    """
+    Ensure that the generator isn't invoked for requests that are rejected by the rate-limiter
+    """
+    generator_calls = []
+
+    async def counting_chat_completion(context):
+        generator_calls.append(context.request.url.path)
+        return await azure_openai_chat_completion(context)
+
+    config = _get_generator_config([counting_chat_completion])
+    server = UvicornTestServer(config)
+    with server.run_in_thread():
+        aoai_client = _get_client()
+        messages = [{"role": "user", "content": "What is the meaning of life?"}]
+        aoai_client.chat.completions.create(model="low_limit", messages=messages, max_tokens=300)
+
+        # "low_limit" allows 384 tokens per minute
+        for _ in range(5):
+            with pytest.raises(RateLimitError):
+                aoai_client.chat.completions.create(model="low_limit", messages=messages, max_tokens=300)
+
+    assert len(generator_calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_requests_do_not_count_towards_limits():
+    """
+    Ensure that requests that are admitted but then fail don't count towards the rate-limit
+    """
+    config = _get_generator_config(get_default_generators())
+    server = UvicornTestServer(config)
+    with server.run_in_thread():
+        aoai_client = _get_client()
+        messages = [{"role": "user", "content": "What is the meaning of life?"}]
+
+        # chat completions aren't supported by the embedding model so return 400
+        with pytest.raises(BadRequestError):
+            aoai_client.chat.completions.create(model="low_limit_embedding", messages=messages, max_tokens=50)
+
+        # "low_limit_embedding" allows 1 request per 10 seconds, so this would be rate-limited
+        # if the failed request had counted
+        response = aoai_client.embeddings.create(model="low_limit_embedding", input="This is some text")
+        assert len(response.data) == 1
+
+
+@pytest.mark.asyncio
+async def test_prompt_is_tokenized_once():
+    """
+    Ensure that the prompt tokens counted when checking the rate-limit are reused by the generator
+    """
+    config = _get_generator_config(get_default_generators())
+    server = UvicornTestServer(config)
+    with patch(
+        "aoai_api_simulator.limiters_cost.num_tokens_from_messages", wraps=num_tokens_from_messages
+    ) as limiter_tokenizer, patch(
+        "aoai_api_simulator.generator.openai.num_tokens_from_messages", wraps=num_tokens_from_messages
+    ) as generator_tokenizer:
+        with server.run_in_thread():
+            aoai_client = _get_client()
+            messages = [{"role": "user", "content": "What is the meaning of life?"}]
+            response = aoai_client.chat.completions.create(model="low_limit", messages=messages, max_tokens=50)
+
+    assert limiter_tokenizer.call_count == 1
+    assert generator_tokenizer.call_count == 0
+    assert response.usage.prompt_tokens == num_tokens_from_messages(messages, "gpt-3.5-turbo")
+
+
+class _DelayedCostLimiter(OpenAITokensLimiter):
+    """
+    Tokens limiter where determining the cost waits for the event in the request context
+    """
+
+    async def _determine_cost(self, context: RequestContext) -> int:
+        await context.values["cost_event"].wait()
+        return 10
+
+
+def _create_limiter_context(config: Config, cost_event: asyncio.Event) -> RequestContext:
+    request = Request({"type": "http", "method": "POST", "path": "/", "query_string": b"", "headers": []})
+    context = RequestContext(config=config, request=request)
+    context.values[constants.SIMULATOR_KEY_DEPLOYMENT_NAME] = "high_limit"
+    context.values["cost_event"] = cost_event
+    return context
+
+
+@pytest.mark.asyncio
+async def test_overlapping_requests_are_added_in_timestamp_order():
+    """
+    Ensure that a request that takes longer to determine the cost than a later request
+    doesn't add an out-of-order timestamp to the window
+    """
+    config = _get_generator_config(get_default_generators())
+    config.openai_deployments = {
+        "high_limit": OpenAIDeployment(
+            name="high_limit", model=model_catalogue["gpt-3.5-turbo"], tokens_per_minute=100000
+        ),
+    }
+    limiter = _DelayedCostLimiter(config.openai_deployments)
+    slow_event = asyncio.Event()
+    fast_event = asyncio.Event()
+    fast_event.set()
+
+    with patch("aoai_api_simulator.limiters.simulator_clock.time", side_effect=itertools.count(1000)):
+        slow_request = asyncio.create_task(limiter(_create_limiter_context(config, slow_event), Response()))
+        await asyncio.sleep(0)
+        # the second request starts after the first but finishes determining its cost first
+        await limiter(_create_limiter_context(config, fast_event), Response())
+        slow_event.set()
+        await slow_request
+
+    timestamps = limiter._deployment_limits["high_limit"]._timestamps  # pylint: disable=protected-access
+    assert len(timestamps) == 2
+    assert timestamps == sorted(timestamps)
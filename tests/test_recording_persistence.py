@@ -0,0 +1,256 @@
+"""
+Test the persistence of recordings
+"""
+
+import os
+
+import pytest
+from aoai_api_simulator.record_replay.body_store import BODY_STORE_DIR_NAME
+from aoai_api_simulator.record_replay.indexed_persistence import (
+    DATA_FILE_EXTENSION,
+    INDEX_FILE_EXTENSION,
+    IndexedRecording,
+    IndexedRecordingPersister,
+)
+from aoai_api_simulator.record_replay.models import RecordedResponse, hash_body, hash_request_parts
+from aoai_api_simulator.record_replay.persistence import JOURNAL_SUFFIX, YamlRecordingPersister
+from aoai_api_simulator.record_replay.sqlite_persistence import SqliteRecording, SqliteRecordingPersister
+
+URL_PATH = "/openai/deployments/deployment1/embeddings"
+
+
+def _create_recorded_response(index: int, url_path: str = URL_PATH) -> RecordedResponse:
+    headers = {"content-type": ["application/json"]}
+    body = f'{{"input": "test {index}"}}'
+    body_hash = hash_body(headers, body)
+    return RecordedResponse(
+        request_hash=hash_request_parts("POST", url_path, headers, body_hash=body_hash),
+        status_code=200,
+        headers={"content-type": ["application/json"]},
+        body=f'{{"index": {index}}}',
+        duration_ms=index,
+        context_values={"index": index},
+        full_request={
+            "method": "POST",
+            "uri": f"http://localhost:8000{url_path}?api-version=2024-06-01",
+            "headers": headers,
+            "body": body,
+        },
+    )
+
+
+@pytest.mark.parametrize("persister_type", [YamlRecordingPersister, IndexedRecordingPersister])
+def test_append_writes_journal(tmp_path, persister_type):
+    persister = persister_type(str(tmp_path))
+    recorded_responses = [_create_recorded_response(i) for i in range(3)]
+
+    for recorded_response in recorded_responses:
+        persister.append_recorded_response(URL_PATH, recorded_response)
+    persister.close()
+
+    recording_path = persister.get_recording_file_path(URL_PATH)
+    assert not os.path.exists(recording_path)
+    assert os.path.exists(recording_path + JOURNAL_SUFFIX)
+
+    recording = persister_type(str(tmp_path)).load_recording_for_url(URL_PATH, expect_recording_file=True)
+    assert recording == {r.request_hash: r for r in recorded_responses}
+
+
+@pytest.mark.parametrize("persister_type", [YamlRecordingPersister, IndexedRecordingPersister])
+def test_save_compacts_journal(tmp_path, persister_type):
+    persister = persister_type(str(tmp_path))
+    recorded_responses = [_create_recorded_response(i) for i in range(3)]
+    for recorded_response in recorded_responses[:2]:
+        persister.append_recorded_response(URL_PATH, recorded_response)
+
+    persister.save_recording(URL_PATH, {r.request_hash: r for r in recorded_responses[:2]})
+
+    recording_path = persister.get_recording_file_path(URL_PATH)
+    assert os.path.exists(recording_path)
+    assert not os.path.exists(recording_path + JOURNAL_SUFFIX)
+
+    # appending after compaction starts a new journal
+    persister.append_recorded_response(URL_PATH, recorded_responses[2])
+    persister.close()
+    assert os.path.exists(recording_path + JOURNAL_SUFFIX)
+
+    recording = persister_type(str(tmp_path)).load_recording_for_url(URL_PATH, expect_recording_file=True)
+    assert dict(recording) == {r.request_hash: r for r in recorded_responses}
+
+
+def test_load_ignores_incomplete_journal_entry(tmp_path):
+    persister = YamlRecordingPersister(str(tmp_path))
+    recorded_responses = [_create_recorded_response(i) for i in range(2)]
+    for recorded_response in recorded_responses:
+        persister.append_recorded_response(URL_PATH, recorded_response)
+    persister.close()
+
+    # simulate the simulator stopping part way through writing an entry
+    journal_path = persister.get_recording_file_path(URL_PATH) + JOURNAL_SUFFIX
+    with open(journal_path, "a", encoding="utf-8") as f:
+        f.write('---\ncontext_values:\n  index: 2\nrequest:\n  body: "{\\"input')
+
+    recording = YamlRecordingPersister(str(tmp_path)).load_recording_for_url(URL_PATH, expect_recording_file=True)
+    assert recording == {r.request_hash: r for r in recorded_responses}
+
+
+def _get_blob_paths(recording_dir) -> list:
+    return sorted(str(path) for path in (recording_dir / BODY_STORE_DIR_NAME).rglob("*.gz"))
+
+
+def test_deduplicates_large_bodies(tmp_path):
+    persister = YamlRecordingPersister(str(tmp_path), deduplicate_bodies=True)
+    other_url_path = "/openai/deployments/deployment2/embeddings"
+    large_body = '{"embedding": [' + ", ".join(["0.0123456789"] * 500) + "]}"
+    recorded_responses = [_create_recorded_response(i) for i in range(3)]
+    other_recorded_response = _create_recorded_response(3, other_url_path)
+    for recorded_response in recorded_responses[:2] + [other_recorded_response]:
+        recorded_response.body = large_body
+    recorded_responses[2].body = b"\x00\x01" * 1000
+    persister.save_recording(URL_PATH, {r.request_hash: r for r in recorded_responses})
+    persister.save_recording(other_url_path, {other_recorded_response.request_hash: other_recorded_response})
+
+    # one compressed blob per distinct body
+    blob_paths = _get_blob_paths(tmp_path)
+    assert len(blob_paths) == 2
+    assert sum(os.path.getsize(path) for path in blob_paths) < len(large_body)
+    with open(persister.get_recording_file_path(URL_PATH), "r", encoding="utf-8") as f:
+        assert large_body not in f.read()
+
+    recording = YamlRecordingPersister(str(tmp_path)).load_recording_for_url(URL_PATH, expect_recording_file=True)
+    for recorded_response in recorded_responses:
+        loaded_response = recording[recorded_response.request_hash]
+        # the body is only loaded when it is requested
+        assert loaded_response.body is None
+        assert loaded_response.get_body() == recorded_response.body
+
+
+def test_deduplicate_keeps_small_bodies_in_recording(tmp_path):
+    persister = YamlRecordingPersister(str(tmp_path), deduplicate_bodies=True)
+    recorded_responses = [_create_recorded_response(i) for i in range(2)]
+    recorded_responses[1].body = None
+    persister.save_recording(URL_PATH, {r.request_hash: r for r in recorded_responses})
+
+    assert not _get_blob_paths(tmp_path)
+    recording = YamlRecordingPersister(str(tmp_path)).load_recording_for_url(URL_PATH, expect_recording_file=True)
+    assert recording == {r.request_hash: r for r in recorded_responses}
+
+
+def test_deduplicated_journal_is_compacted(tmp_path):
+    persister = YamlRecordingPersister(str(tmp_path), deduplicate_bodies=True)
+    recorded_responses = [_create_recorded_response(i) for i in range(2)]
+    for recorded_response in recorded_responses:
+        recorded_response.body = "x" * 2000
+        persister.append_recorded_response(URL_PATH, recorded_response)
+    persister.close()
+
+    persister = YamlRecordingPersister(str(tmp_path), deduplicate_bodies=True)
+    recording = persister.load_recording_for_url(URL_PATH, expect_recording_file=True)
+    # saving the loaded recording keeps the references to the stored bodies
+    persister.save_recording(URL_PATH, recording)
+
+    assert len(_get_blob_paths(tmp_path)) == 1
+    recording = persister.load_recording_for_url(URL_PATH, expect_recording_file=True)
+    assert [recording[r.request_hash].get_body() for r in recorded_responses] == ["x" * 2000] * 2
+
+
+def test_indexed_recording_loads_responses_on_demand(tmp_path):
+    persister = IndexedRecordingPersister(str(tmp_path))
+    recorded_responses = [_create_recorded_response(i) for i in range(100)]
+    recorded_responses[1].body = None
+    recorded_responses[2].body = b"\x00\x01binary"
+    persister.save_recording(URL_PATH, {r.request_hash: r for r in recorded_responses})
+
+    base_path = persister.get_recording_base_path(URL_PATH)
+    assert os.path.exists(base_path + DATA_FILE_EXTENSION)
+    assert os.path.exists(base_path + INDEX_FILE_EXTENSION)
+
+    recording = IndexedRecordingPersister(str(tmp_path)).load_recording_for_url(URL_PATH, expect_recording_file=True)
+    assert isinstance(recording, IndexedRecording)
+    assert len(recording) == 100
+    for recorded_response in recorded_responses:
+        assert recording.get(recorded_response.request_hash) == recorded_response
+    assert recording.get("0" * 32) is None
+    assert recording.get("not a hash") is None
+
+
+def test_indexed_recording_adds_responses(tmp_path):
+    persister = IndexedRecordingPersister(str(tmp_path))
+    recorded_responses = [_create_recorded_response(i) for i in range(3)]
+    persister.save_recording(URL_PATH, {r.request_hash: r for r in recorded_responses[:2]})
+
+    recording = persister.load_recording_for_url(URL_PATH, expect_recording_file=True)
+    recording[recorded_responses[2].request_hash] = recorded_responses[2]
+    # replacing an existing response doesn't add a new entry
+    recorded_responses[0].status_code = 201
+    recording[recorded_responses[0].request_hash] = recorded_responses[0]
+
+    assert len(recording) == 3
+    assert sorted(recording) == sorted(r.request_hash for r in recorded_responses)
+
+    persister.save_recording(URL_PATH, recording)
+    recording = persister.load_recording_for_url(URL_PATH, expect_recording_file=True)
+    assert dict(recording) == {r.request_hash: r for r in recorded_responses}
+
+
+def test_indexed_recording_rejects_mismatched_data_file(tmp_path):
+    persister = IndexedRecordingPersister(str(tmp_path))
+    persister.save_recording(URL_PATH, {r.request_hash: r for r in [_create_recorded_response(0)]})
+
+    with open(persister.get_recording_base_path(URL_PATH) + DATA_FILE_EXTENSION, "ab") as f:
+        f.write(b"extra")
+
+    with pytest.raises(ValueError):
+        persister.load_recording_for_url(URL_PATH, expect_recording_file=True)
+
+
+def test_sqlite_recording_round_trip(tmp_path):
+    persister = SqliteRecordingPersister(str(tmp_path))
+    recorded_responses = [_create_recorded_response(i) for i in range(10)]
+    recorded_responses[1].body = None
+    recorded_responses[2].body = b"\x00\x01binary"
+    persister.save_recording(URL_PATH, {r.request_hash: r for r in recorded_responses})
+    persister.close()
+
+    persister = SqliteRecordingPersister(str(tmp_path))
+    recording = persister.load_recording_for_url(URL_PATH, expect_recording_file=True)
+    assert isinstance(recording, SqliteRecording)
+    assert len(recording) == 10
+    for recorded_response in recorded_responses:
+        assert recording.get(recorded_response.request_hash) == recorded_response
+    assert recording.get("0" * 32) is None
+    assert persister.load_recording_for_url("/openai/deployments/other/embeddings", expect_recording_file=True) is None
+    persister.close()
+
+
+def test_sqlite_recording_appends_responses(tmp_path):
+    persister = SqliteRecordingPersister(str(tmp_path))
+    recorded_responses = [_create_recorded_response(i) for i in range(3)]
+    for recorded_response in recorded_responses:
+        persister.append_recorded_response(URL_PATH, recorded_response)
+    persister.close()
+
+    recording = SqliteRecordingPersister(str(tmp_path)).load_recording_for_url(URL_PATH, expect_recording_file=True)
+    assert dict(recording) == {r.request_hash: r for r in recorded_responses}
+
+
+def test_sqlite_recording_columns_can_be_queried(tmp_path):
+    persister = SqliteRecordingPersister(str(tmp_path))
+    other_url_path = "/openai/deployments/deployment2/chat/completions"
+    recorded_responses = [_create_recorded_response(i) for i in range(3)]
+    other_recorded_response = _create_recorded_response(3, other_url_path)
+    other_recorded_response.context_values = {
+        "Deployment-Name": "deployment2",
+        "Operation-Name": "chat_completions",
+        "X-OpenAI-Tokens-Prompt": 10,
+        "X-OpenAI-Tokens-Completion": 20,
+        "X-OpenAI-Tokens-Total": 30,
+    }
+    persister.save_recording(URL_PATH, {r.request_hash: r for r in recorded_responses})
+    persister.save_recording(other_url_path, {other_recorded_response.request_hash: other_recorded_response})
+
+    rows = persister.query_all(
+        "SELECT url, deployment, operation, status_code, total_tokens FROM interactions WHERE total_tokens > ?", (0,)
+    )
+    assert rows == [(other_url_path, "deployment2", "chat_completions", 200, 30)]
+    persister.close()
@@ -0,0 +1,133 @@
+import random
+
+import pytest
+from aoai_api_simulator import constants
+from aoai_api_simulator.generator.model_catalogue import model_catalogue
+from aoai_api_simulator.limiters import (
+    RequestsPerMinuteBucketedWindow,
+    TokensPerMinuteBucketedWindow,
+    create_openai_tokens_limiter,
+)
+from aoai_api_simulator.models import OpenAIDeployment
+from fastapi import Response
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+
+# pylint: disable-next=wrong-import-position
+from aoai_api_simulator.limiters_redis import RedisLimiterStore  # noqa: E402
+
+deployment1 = OpenAIDeployment(name="deployment1", model=model_catalogue["gpt-3.5-turbo"], tokens_per_minute=1000)
+whisper = OpenAIDeployment(name="whisper", model=model_catalogue["whisper"], requests_per_minute=3)
+
+
+def create_store(server=None) -> RedisLimiterStore:
+    client = fakeredis.aioredis.FakeRedis(server=server)
+    return RedisLimiterStore(client=client, key_prefix="test")
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("seed", range(3))
+async def test_tokens_window_matches_bucketed_window(seed: int):
+    rng = random.Random(seed)
+    redis_window = create_store().create_tokens_window(deployment1, requests_per_10_seconds=20, tokens_per_minute=1000)
+    bucketed_window = TokensPerMinuteBucketedWindow(requests_per_10_seconds=20, tokens_per_minute=1000)
+
+    timestamp = 0.0
+    for _ in range(500):
+        timestamp += rng.choice([0, 0.01, 0.1, 0.3, 1, 2.5, 70])
+        token_cost = rng.randint(1, 100)
+        expected = bucketed_window.add_request(token_cost=token_cost, timestamp=timestamp)
+        actual = await redis_window.add_request(token_cost=token_cost, timestamp=timestamp)
+        assert actual == expected
+
+
+@pytest.mark.asyncio
+async def test_requests_window_matches_bucketed_window():
+    rng = random.Random(0)
+    redis_window = create_store().create_requests_window(whisper, requests_per_minute=3)
+    bucketed_window = RequestsPerMinuteBucketedWindow(requests_per_minute=3)
+
+    timestamp = 0.0
+    for _ in range(200):
+        timestamp += rng.choice([0, 0.5, 1, 5, 20, 70])
+        expected = bucketed_window.add_request(timestamp=timestamp)
+        actual = await redis_window.add_request(timestamp=timestamp)
+        assert actual == expected
+
+
+@pytest.mark.asyncio
+async def test_stores_on_same_server_share_state():
+    server = fakeredis.FakeServer()
+    window1 = create_store(server).create_tokens_window(deployment1, requests_per_10_seconds=10, tokens_per_minute=100)
+    window2 = create_store(server).create_tokens_window(deployment1, requests_per_10_seconds=10, tokens_per_minute=100)
+
+    assert (await window1.add_request(token_cost=60, timestamp=1)).success
+
+    result = await window2.add_request(token_cost=60, timestamp=2)
+    assert not result.success
+    assert result.retry_reason == "tokens"
+
+    result = await window2.add_request(token_cost=40, timestamp=2)
+    assert result.success
+    assert result.remaining_tokens == 0
+
+
+@pytest.mark.asyncio
+async def test_remove_request_releases_capacity():
+    store = create_store()
+    tokens_window = store.create_tokens_window(deployment1, requests_per_10_seconds=10, tokens_per_minute=100)
+    requests_window = store.create_requests_window(whisper, requests_per_minute=1)
+
+    assert (await tokens_window.add_request(token_cost=100, timestamp=1.5)).success
+    assert not (await tokens_window.add_request(token_cost=10, timestamp=2)).success
+    await tokens_window.remove_request(token_cost=100, timestamp=1.5)
+    result = await tokens_window.add_request(token_cost=10, timestamp=2)
+    assert result.success
+    assert result.remaining_tokens == 90
+    assert result.remaining_requests == 9
+
+    assert (await requests_window.add_request(timestamp=1)).success
+    assert not (await requests_window.add_request(timestamp=2)).success
+    await requests_window.remove_request(timestamp=1)
+    assert (await requests_window.add_request(timestamp=2)).success
+
+
+@pytest.mark.asyncio
+async def test_deployments_with_similar_names_do_not_share_state():
+    store = create_store()
+    model = model_catalogue["gpt-3.5-turbo"]
+    slash_deployment = OpenAIDeployment(name="gpt/4", model=model, tokens_per_minute=100)
+    underscore_deployment = OpenAIDeployment(name="gpt_4", model=model, tokens_per_minute=100)
+    window1 = store.create_tokens_window(slash_deployment, requests_per_10_seconds=10, tokens_per_minute=100)
+    window2 = store.create_tokens_window(underscore_deployment, requests_per_10_seconds=10, tokens_per_minute=100)
+    requests_window1 = store.create_requests_window(slash_deployment, requests_per_minute=1)
+    requests_window2 = store.create_requests_window(underscore_deployment, requests_per_minute=1)
+
+    assert (await window1.add_request(token_cost=100, timestamp=1)).success
+    result = await window2.add_request(token_cost=100, timestamp=1)
+    assert result.success
+    assert result.remaining_tokens == 0
+
+    assert (await requests_window1.add_request(timestamp=1)).success
+    assert (await requests_window2.add_request(timestamp=1)).success
+
+
+@pytest.mark.asyncio
+async def test_tokens_limiter_with_redis_store(monkeypatch):
+    async def fixed_token_cost(_):
+        return 600
+
+    monkeypatch.setattr("aoai_api_simulator.limiters.determine_token_cost", fixed_token_cost)
+    limiter = create_openai_tokens_limiter({"deployment1": deployment1}, create_store())
+
+    class _Context:
+        values = {constants.SIMULATOR_KEY_DEPLOYMENT_NAME: "deployment1"}
+
+    response = await limiter(_Context(), Response(status_code=200))
+    assert response.status_code == 200
+    assert response.headers["x-ratelimit-remaining-tokens"] == "400"
+
+    response = await limiter(_Context(), Response(status_code=200))
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 0
@@ -0,0 +1,64 @@
+"""
+Test the request body caching on RequestContext
+"""
+
+import json
+from unittest.mock import patch
+
+import pytest
+from aoai_api_simulator.models import Config, RequestContext
+from fastapi import Request
+
+
+def _create_request(body: bytes, content_type: str) -> Request:
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/openai/deployments/deployment1/chat/completions",
+        "query_string": b"",
+        "headers": [(b"content-type", content_type.encode("utf-8"))],
+    }
+    return Request(scope, receive)
+
+
+@pytest.mark.asyncio
+async def test_json_is_parsed_once():
+    body = json.dumps({"messages": [{"role": "user", "content": "hello"}], "max_tokens": 10}).encode("utf-8")
+    context = RequestContext(config=Config(generators=[]), request=_create_request(body, "application/json"))
+
+    with patch("aoai_api_simulator.models.json.loads", wraps=json.loads) as loads:
+        first = await context.json()
+        second = await context.json()
+
+    assert loads.call_count == 1
+    assert first is second
+    assert first["max_tokens"] == 10
+    assert await context.body() == body
+
+
+@pytest.mark.asyncio
+async def test_json_null_is_parsed_once():
+    context = RequestContext(config=Config(generators=[]), request=_create_request(b"null", "application/json"))
+
+    with patch("aoai_api_simulator.models.json.loads", wraps=json.loads) as loads:
+        assert await context.json() is None
+        assert await context.json() is None
+
+    assert loads.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_form_is_parsed_once():
+    context = RequestContext(
+        config=Config(generators=[]),
+        request=_create_request(b"response_format=json&model=whisper", "application/x-www-form-urlencoded"),
+    )
+
+    first = await context.form()
+    second = await context.form()
+
+    assert first is second
+    assert first["response_format"] == "json"
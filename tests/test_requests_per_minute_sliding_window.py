@@ -124,3 +124,18 @@ def test_1000_request_limit():
 
     # Check that we can send requests again after 60s
     add_success_request(window, timestamp=start_timestamp + 60)
+
+
+def test_remove_request_releases_capacity():
+    window = RequestsPerMinuteSlidingWindow(requests_per_minute=2)
+
+    add_success_request(window, timestamp=1)
+    add_success_request(window, timestamp=2)
+    assert not window.add_request(timestamp=3).success
+
+    window.remove_request(timestamp=2)
+    add_success_request(window, timestamp=3)
+
+    # removing a request that isn't in the window has no effect
+    window.remove_request(timestamp=100)
+    assert not window.add_request(timestamp=4).success
@@ -0,0 +1,100 @@
+import multiprocessing
+import os
+
+from aoai_api_simulator import constants
+from aoai_api_simulator.generator.model_catalogue import model_catalogue
+from aoai_api_simulator.limiters import get_default_limiters
+from aoai_api_simulator.limiters_shared_memory import (
+    SharedMemoryLimiterStore,
+    SharedMemoryRequestsPerMinuteWindow,
+    SharedMemoryTokensPerMinuteWindow,
+)
+from aoai_api_simulator.models import Config, OpenAIDeployment, RateLimitConfig
+
+
+def test_windows_on_same_path_share_state(tmp_path):
+    path = os.path.join(tmp_path, "tokens-deployment1.bin")
+    window1 = SharedMemoryTokensPerMinuteWindow(requests_per_10_seconds=10, tokens_per_minute=100, path=path)
+    window2 = SharedMemoryTokensPerMinuteWindow(requests_per_10_seconds=10, tokens_per_minute=100, path=path)
+
+    assert window1.add_request(token_cost=60, timestamp=1).success
+
+    result = window2.add_request(token_cost=60, timestamp=2)
+    assert not result.success
+    assert result.retry_reason == "tokens"
+
+    result = window2.add_request(token_cost=40, timestamp=2)
+    assert result.success
+    assert result.remaining_tokens == 0
+
+
+def test_requests_windows_on_same_path_share_state(tmp_path):
+    path = os.path.join(tmp_path, "requests-whisper.bin")
+    window1 = SharedMemoryRequestsPerMinuteWindow(requests_per_minute=2, path=path)
+    window2 = SharedMemoryRequestsPerMinuteWindow(requests_per_minute=2, path=path)
+
+    assert window1.add_request(timestamp=1).success
+    assert window2.add_request(timestamp=2).success
+    assert not window1.add_request(timestamp=3).success
+
+
+def _add_requests_in_process(path: str, count: int, timestamp: float, results):
+    window = SharedMemoryTokensPerMinuteWindow(requests_per_10_seconds=1000, tokens_per_minute=1000, path=path)
+    accepted = 0
+    for _ in range(count):
+        if window.add_request(token_cost=1, timestamp=timestamp).success:
+            accepted += 1
+    results.put(accepted)
+
+
+def test_limits_enforced_across_processes(tmp_path):
+    path = os.path.join(tmp_path, "tokens-deployment1.bin")
+    process_count = 4
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+
+    processes = [
+        context.Process(target=_add_requests_in_process, args=(path, 500, 100.5, results))
+        for _ in range(process_count)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    accepted = sum(results.get() for _ in range(process_count))
+    # 2000 requests were made across the processes, but the deployment only allows 1000 tokens
+    assert accepted == 1000
+
+
+def test_default_limiters_use_shared_memory_store(tmp_path):
+    config = Config(generators=[])
+    config.openai_deployments = {
+        "deployment1": OpenAIDeployment(
+            name="deployment1", model=model_catalogue["gpt-3.5-turbo"], tokens_per_minute=1000
+        ),
+    }
+    config.rate_limit = RateLimitConfig(
+        RATE_LIMIT_STORE=constants.RATE_LIMIT_STORE_SHARED_MEMORY,
+        RATE_LIMIT_SHARED_MEMORY_DIR=str(tmp_path),
+    )
+
+    get_default_limiters(config)
+
+    assert len(list(tmp_path.glob("tokens-deployment1-*.bin"))) == 1
+
+
+def test_deployments_with_similar_names_do_not_share_state(tmp_path):
+    store = SharedMemoryLimiterStore(str(tmp_path))
+    deployments = [
+        OpenAIDeployment(name=name, model=model_catalogue["gpt-3.5-turbo"], tokens_per_minute=1000)
+        for name in ["gpt/4", "gpt_4"]
+    ]
+    windows = [
+        store.create_tokens_window(deployment, requests_per_10_seconds=1, tokens_per_minute=1000)
+        for deployment in deployments
+    ]
+
+    assert windows[0].add_request(token_cost=1000, timestamp=1).success
+    assert windows[1].add_request(token_cost=1000, timestamp=1).success
+    assert len(list(tmp_path.glob("tokens-gpt_4-*.bin"))) == 2
@@ -0,0 +1,153 @@
+"""
+Test the token cost calculation used for rate-limiting
+"""
+
+import json
+from unittest.mock import patch
+
+import pytest
+from aoai_api_simulator import constants
+from aoai_api_simulator.generator.model_catalogue import model_catalogue
+from aoai_api_simulator.generator.openai_tokens import num_tokens_from_messages, num_tokens_from_string
+from aoai_api_simulator.limiters_cost import determine_token_cost
+from aoai_api_simulator.models import Config, OpenAIDeployment, RateLimitConfig, RequestContext
+from fastapi import Request
+
+messages = [
+    {"role": "system", "content": "You are a helpful assistant."},
+    {"role": "user", "content": "What is the meaning of life?"},
+]
+
+
+def _create_context(
+    operation_name: str, body: dict, deployment_name: str = "deployment1", cost_mode: str | None = None
+) -> RequestContext:
+    async def receive():
+        return {"type": "http.request", "body": json.dumps(body).encode("utf-8"), "more_body": False}
+
+    request = Request(
+        {
+            "type": "http",
+            "method": "POST",
+            "path": f"/openai/deployments/{deployment_name}/{operation_name.replace('_', '/')}",
+            "query_string": b"",
+            "headers": [(b"content-type", b"application/json")],
+        },
+        receive,
+    )
+    config = Config(generators=[])
+    config.openai_deployments = {
+        "deployment1": OpenAIDeployment(
+            name="deployment1", model=model_catalogue["gpt-3.5-turbo"], tokens_per_minute=10000
+        ),
+        "embedding": OpenAIDeployment(
+            name="embedding",
+            model=model_catalogue["text-embedding-ada-002"],
+            embedding_size=1536,
+            tokens_per_minute=10000,
+        ),
+    }
+    if cost_mode:
+        config.rate_limit = RateLimitConfig(RATE_LIMIT_COST_MODE=cost_mode)
+
+    context = RequestContext(config=config, request=request)
+    context.values[constants.SIMULATOR_KEY_OPERATION_NAME] = operation_name
+    context.values[constants.SIMULATOR_KEY_DEPLOYMENT_NAME] = deployment_name
+    return context
+
+
+@pytest.mark.asyncio
+async def test_chat_cost_is_prompt_tokens_plus_max_tokens():
+    context = _create_context(constants.OPENAI_OPERATION_CHAT_COMPLETIONS, {"messages": messages, "max_tokens": 50})
+    prompt_tokens = num_tokens_from_messages(messages, "gpt-3.5-turbo")
+
+    token_cost = await determine_token_cost(context)
+
+    assert token_cost == prompt_tokens + 50
+    assert context.values[constants.SIMULATOR_KEY_OPENAI_RATE_LIMIT_TOKENS] == token_cost
+    # the prompt token count is stored for the generator to use
+    assert context.values[constants.SIMULATOR_KEY_OPENAI_PROMPT_TOKENS] == prompt_tokens
+
+
+@pytest.mark.asyncio
+async def test_chat_cost_without_max_tokens_uses_default_completion_estimate():
+    context = _create_context(constants.OPENAI_OPERATION_CHAT_COMPLETIONS, {"messages": messages})
+    prompt_tokens = num_tokens_from_messages(messages, "gpt-3.5-turbo")
+
+    assert await determine_token_cost(context) == prompt_tokens + 16
+
+
+@pytest.mark.asyncio
+async def test_completion_cost_uses_effective_max_tokens():
+    prompt = "Once upon a time"
+    context = _create_context(constants.OPENAI_OPERATION_COMPLETIONS, {"prompt": prompt, "max_tokens": 10000})
+
+    # max_tokens is capped at the model's context size (less the prompt)
+    assert await determine_token_cost(context) == 4097
+
+
+@pytest.mark.asyncio
+async def test_embeddings_cost_is_prompt_tokens():
+    inputs = ["This is some text", "This is some more text"]
+    context = _create_context(constants.OPENAI_OPERATION_EMBEDDINGS, {"input": inputs}, deployment_name="embedding")
+    expected = sum(num_tokens_from_string(i, "text-embedding-ada-002") for i in inputs)
+
+    assert await determine_token_cost(context) == expected
+
+    # the count for each input is stored for the generator to use
+    assert context.values[constants.SIMULATOR_KEY_OPENAI_EMBEDDING_INPUT_TOKENS] == [
+        num_tokens_from_string(i, "text-embedding-ada-002") for i in inputs
+    ]
+
+@pytest.mark.asyncio
+async def test_stored_prompt_tokens_are_reused():
+    context = _create_context(constants.OPENAI_OPERATION_CHAT_COMPLETIONS, {"messages": messages, "max_tokens": 50})
+    context.values[constants.SIMULATOR_KEY_OPENAI_PROMPT_TOKENS] = 7
+
+    with patch("aoai_api_simulator.limiters_cost.num_tokens_from_messages") as tokenizer:
+        assert await determine_token_cost(context) == 57
+
+    tokenizer.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_heuristic_mode_estimates_prompt_tokens():
+    context = _create_context(
+        constants.OPENAI_OPERATION_CHAT_COMPLETIONS, {"messages": messages, "max_tokens": 50}, cost_mode="heuristic"
+    )
+    characters = sum(len(value) for message in messages for value in message.values())
+
+    with patch("aoai_api_simulator.limiters_cost.num_tokens_from_messages") as tokenizer:
+        token_cost = await determine_token_cost(context)
+
+    tokenizer.assert_not_called()
+    assert token_cost == (characters + 3) // 4 + 50
+    # the estimate isn't stored as the generator needs the actual prompt token count
+    assert constants.SIMULATOR_KEY_OPENAI_PROMPT_TOKENS not in context.values
+
+
+@pytest.mark.asyncio
+async def test_unsupported_model_falls_back_to_estimate():
+    # chat completions aren't supported by embedding models (the generator returns a 400)
+    context = _create_context(
+        constants.OPENAI_OPERATION_CHAT_COMPLETIONS,
+        {"messages": messages, "max_tokens": 50},
+        deployment_name="embedding",
+    )
+
+    assert await determine_token_cost(context) > 50
+    assert constants.SIMULATOR_KEY_OPENAI_PROMPT_TOKENS not in context.values
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("content", [[{"type": "text", "text": "What is the meaning of life?"}], None])
+async def test_non_string_message_content_falls_back_to_estimate(content):
+    request_messages = [messages[0], {"role": "user", "content": content}]
+    context = _create_context(
+        constants.OPENAI_OPERATION_CHAT_COMPLETIONS, {"messages": request_messages, "max_tokens": 50}
+    )
+
+    # only the string values are included in the estimate
+    characters = len("system") + len(messages[0]["content"]) + len("user")
+    assert await determine_token_cost(context) == (characters + 3) // 4 + 50
+    assert constants.SIMULATOR_KEY_OPENAI_PROMPT_TOKENS not in context.values
@@ -1,4 +1,5 @@
 import math
+import random
 import time
 
 import pytest
@@ -235,3 +236,162 @@ def test_100k_token_limit():
 
     # Check that we can send requests again after 10s
     add_success_request(window, timestamp=timestamp, token_count=200)
+
+
+class ReferenceTokensPerMinuteSlidingWindow:
+    """
+    The original list-scanning implementation of TokensPerMinuteSlidingWindow,
+    kept as an oracle to validate the indexed implementation against
+    """
+
+    def __init__(self, requests_per_10_seconds: int, tokens_per_minute: int):
+        self._requests_per_10_seconds = requests_per_10_seconds
+        self._tokens_per_minute = tokens_per_minute
+        self._requests = []
+
+    def add_request(self, token_cost: int, timestamp: float):
+        while len(self._requests) > 0 and self._requests[0][0] <= timestamp - 60:
+            self._requests.pop(0)
+
+        request_count_in_10s = 1
+        token_count_in_60s = token_cost
+        requests_count = 1
+        tokens_count = token_cost
+        requests_full_time = -math.inf
+        tokens_full_time = -math.inf
+        for request_timestamp, request_token_cost in reversed(self._requests):
+            if requests_count <= self._requests_per_10_seconds:
+                requests_count += 1
+            if tokens_count <= self._tokens_per_minute:
+                tokens_count += request_token_cost
+            if requests_full_time == -math.inf and requests_count > self._requests_per_10_seconds:
+                requests_full_time = request_timestamp
+            if tokens_full_time == -math.inf and tokens_count > self._tokens_per_minute:
+                tokens_full_time = request_timestamp
+            if request_timestamp > timestamp - 10:
+                request_count_in_10s += 1
+            token_count_in_60s += request_token_cost
+
+        if token_count_in_60s > self._tokens_per_minute or request_count_in_10s > self._requests_per_10_seconds:
+            if (
+                token_cost == self._tokens_per_minute
+                and requests_full_time == -math.inf
+                and tokens_full_time == -math.inf
+            ):
+                tokens_full_time = self._requests[-1][0]
+            time_to_reset_requests = 10 - (timestamp - requests_full_time)
+            time_to_reset_tokens = 60 - (timestamp - tokens_full_time)
+            if time_to_reset_requests > time_to_reset_tokens:
+                return (False, None, None, math.ceil(time_to_reset_requests), "requests")
+            return (False, None, None, math.ceil(time_to_reset_tokens), "tokens")
+
+        self._requests.append((timestamp, token_cost))
+        return (
+            True,
+            self._tokens_per_minute - token_count_in_60s,
+            self._requests_per_10_seconds - request_count_in_10s,
+            None,
+            None,
+        )
+
+    def remove_request(self, token_cost: int, timestamp: float):
+        if (timestamp, token_cost) in self._requests:
+            self._requests.remove((timestamp, token_cost))
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_matches_reference_implementation(seed: int):
+    rng = random.Random(seed)
+    tokens_per_minute = rng.choice([100, 1000, 10_000])
+    requests_per_10_seconds = math.ceil(tokens_per_minute / 1000) * rng.choice([1, 5])
+
+    window = TokensPerMinuteSlidingWindow(
+        requests_per_10_seconds=requests_per_10_seconds, tokens_per_minute=tokens_per_minute
+    )
+    reference = ReferenceTokensPerMinuteSlidingWindow(
+        requests_per_10_seconds=requests_per_10_seconds, tokens_per_minute=tokens_per_minute
+    )
+
+    timestamp = 1.0
+    for i in range(3000):
+        timestamp += rng.choice([0, 0, 0.01, 0.1, 0.5, 1, 5, 20])
+        token_cost = rng.choice([0, 1, 5, 20, tokens_per_minute // 10, tokens_per_minute // 2, tokens_per_minute])
+
+        result = window.add_request(token_cost=token_cost, timestamp=timestamp)
+        expected = reference.add_request(token_cost=token_cost, timestamp=timestamp)
+        actual = (
+            result.success,
+            result.remaining_tokens,
+            result.remaining_requests,
+            result.retry_after,
+            result.retry_reason,
+        )
+        assert actual == expected, f"mismatch at request {i} ({timestamp=}, {token_cost=})"
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_remove_request_matches_reference_implementation(seed: int):
+    rng = random.Random(seed)
+    tokens_per_minute = 1000
+    requests_per_10_seconds = 5
+
+    window = TokensPerMinuteSlidingWindow(
+        requests_per_10_seconds=requests_per_10_seconds, tokens_per_minute=tokens_per_minute
+    )
+    reference = ReferenceTokensPerMinuteSlidingWindow(
+        requests_per_10_seconds=requests_per_10_seconds, tokens_per_minute=tokens_per_minute
+    )
+
+    admitted = []
+    timestamp = 1.0
+    for i in range(3000):
+        timestamp += rng.choice([0, 0, 0.01, 0.1, 0.5, 1, 5, 20])
+        token_cost = rng.choice([0, 1, 5, 20, 100, 500])
+
+        result = window.add_request(token_cost=token_cost, timestamp=timestamp)
+        expected = reference.add_request(token_cost=token_cost, timestamp=timestamp)
+        assert result.success == expected[0], f"mismatch at request {i} ({timestamp=}, {token_cost=})"
+        assert (result.retry_after, result.retry_reason) == expected[3:]
+        if result.success:
+            admitted.append((timestamp, token_cost))
+
+        # release some of the admitted requests (including ones that have left the window)
+        if admitted and rng.random() < 0.3:
+            removed_timestamp, removed_token_cost = admitted.pop(rng.randrange(len(admitted)))
+            window.remove_request(token_cost=removed_token_cost, timestamp=removed_timestamp)
+            reference.remove_request(token_cost=removed_token_cost, timestamp=removed_timestamp)
+
+
+def test_remove_request_does_not_rewrite_window_entries():
+    window = TokensPerMinuteSlidingWindow(requests_per_10_seconds=10_000, tokens_per_minute=1_000_000)
+    for i in range(1000):
+        window.add_request(token_cost=10, timestamp=1 + i * 0.01)
+    cumulative_tokens = list(window._cumulative_tokens)  # pylint: disable=protected-access
+
+    # removing an early request is recorded without updating the later entries
+    window.remove_request(token_cost=10, timestamp=1)
+    assert window._cumulative_tokens == cumulative_tokens  # pylint: disable=protected-access
+
+    result = window.add_request(token_cost=10, timestamp=11)
+    assert result.success
+    assert result.remaining_tokens == 1_000_000 - 1000 * 10
+
+
+def test_released_counts_with_many_removed_requests():
+    window = TokensPerMinuteSlidingWindow(requests_per_10_seconds=10_000, tokens_per_minute=1_000_000)
+    for i in range(1000):
+        window.add_request(token_cost=i, timestamp=1 + i * 0.01)
+    # remove every third request, out of order
+    removed = list(range(0, 1000, 3))
+    random.Random(0).shuffle(removed)
+    for i in removed:
+        window.remove_request(token_cost=i, timestamp=1 + i * 0.01)
+
+    for index in range(0, 1000, 7):
+        expected = [i for i in removed if i >= index]
+        # pylint: disable-next=protected-access
+        assert window._get_released_counts_from(index) == (len(expected), sum(expected))
+
+    result = window.add_request(token_cost=1, timestamp=11)
+    assert result.success
+    assert result.remaining_tokens == 1_000_000 - (sum(range(1000)) - sum(removed)) - 1
@@ -0,0 +1,421 @@
+"""
+Offline rate-limit capacity simulator
+
+Replays a traffic trace (timestamp, deployment, token cost) through the same window rules as the simulator's
+TokensPerMinuteSlidingWindow and RequestsPerMinuteSlidingWindow to determine which requests would be accepted
+or throttled (with the retry-after values and remaining capacity), without running the simulator or a load test.
+
+Rather than adding requests to a window one at a time, the trace is processed in alternating runs:
+ - an accept run assumes that the next requests are all accepted and uses vectorized window sums to find
+   the first request that exceeds a limit (all the requests before it are accepted)
+ - a throttle run holds the accepted history fixed (throttled requests don't count towards the limits)
+   and uses vectorized window sums to find the next request that fits within the limits
+This gives the same results as the simulator's windows with a NumPy call per run rather than a Python call
+per request, so traces with millions of requests can be processed in seconds.
+"""
+
+import argparse
+import json
+import math
+import sys
+from dataclasses import dataclass
+
+import numpy as np
+
+# retry_reason values in CapacityResult
+RETRY_REASON_NONE = 0
+RETRY_REASON_TOKENS = 1
+RETRY_REASON_REQUESTS = 2
+
+_retry_reason_names = {RETRY_REASON_NONE: "", RETRY_REASON_TOKENS: "tokens", RETRY_REASON_REQUESTS: "requests"}
+
+_min_run_size = 32
+_max_run_size = 65536
+
+
+@dataclass
+class CapacityResult:
+    """
+    Per-request results from simulating a trace (in timestamp order).
+    retry_after and retry_reason are only set for throttled requests,
+    remaining_tokens and remaining_requests are only set for accepted requests (NaN otherwise)
+    """
+
+    timestamps: np.ndarray
+    token_costs: np.ndarray
+    accepted: np.ndarray
+    retry_after: np.ndarray
+    retry_reason: np.ndarray
+    remaining_tokens: np.ndarray
+    remaining_requests: np.ndarray
+
+
+# pylint: disable-next=too-many-instance-attributes,too-few-public-methods
+class _WindowSimulator:
+    """
+    Simulates a window with an optional tokens-per-minute limit and a request limit
+    (requests_per_10_seconds for token-limited deployments, requests_per_minute otherwise)
+    """
+
+    def __init__(
+        self,
+        timestamps: np.ndarray,
+        token_costs: np.ndarray,
+        tokens_per_minute: int | None,
+        request_limit: int,
+        request_window_seconds: int,
+    ):
+        self.timestamps = timestamps
+        self.token_costs = token_costs
+        self.tokens_per_minute = tokens_per_minute
+        self.request_limit = request_limit
+        self.request_window_seconds = request_window_seconds
+        # number of stored requests that (with the current request) fill the request limit
+        self.requests_needed_for_full = max(math.floor(request_limit), 1)
+
+        count = len(timestamps)
+        # prefix sums of the token costs for the whole trace (for window sums within a run)
+        self.trace_tokens = np.concatenate(([0], np.cumsum(token_costs)))
+        # timestamps and prefix sums of the token costs for the accepted requests
+        self.accepted_timestamps = np.empty(count, dtype=np.float64)
+        self.accepted_tokens = np.zeros(count + 1, dtype=np.int64)
+        self.accepted_count = 0
+
+        self.result = CapacityResult(
+            timestamps=timestamps,
+            token_costs=token_costs,
+            accepted=np.zeros(count, dtype=bool),
+            retry_after=np.full(count, np.nan),
+            retry_reason=np.zeros(count, dtype=np.int8),
+            remaining_tokens=np.full(count, np.nan),
+            remaining_requests=np.full(count, np.nan),
+        )
+
+    def _history_counts(self, timestamps: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # For each timestamp, return the index of the oldest accepted request in the last 60s,
+        # the number of accepted requests in the request window, and the accepted tokens in the last 60s
+        history = self.accepted_timestamps[: self.accepted_count]
+        heads = np.searchsorted(history, timestamps - 60, side="right")
+        request_counts = self.accepted_count - np.searchsorted(
+            history, timestamps - self.request_window_seconds, side="right"
+        )
+        token_counts = self.accepted_tokens[self.accepted_count] - self.accepted_tokens[heads]
+        return heads, request_counts, token_counts
+
+    def _exceeds_limits(self, request_counts: np.ndarray, token_counts: np.ndarray) -> np.ndarray:
+        exceeded = request_counts > self.request_limit
+        if self.tokens_per_minute is not None:
+            exceeded |= token_counts > self.tokens_per_minute
+        return exceeded
+
+    def _accept_run(self, start: int, end: int) -> int:
+        """
+        Accepts requests from start until the first request that exceeds the limits (assuming that all
+        the requests in the run are accepted). Returns the index of the first request not accepted
+        """
+        timestamps = self.timestamps[start:end]
+        _, request_counts, token_counts = self._history_counts(timestamps)
+
+        # add the requests earlier in the run that are in the window
+        indices = np.arange(start, end)
+        request_starts = np.maximum(
+            np.searchsorted(self.timestamps, timestamps - self.request_window_seconds, side="right"), start
+        )
+        token_starts = np.maximum(np.searchsorted(self.timestamps, timestamps - 60, side="right"), start)
+        request_counts += indices - request_starts + 1
+        token_counts += self.trace_tokens[indices + 1] - self.trace_tokens[token_starts]
+
+        exceeded = self._exceeds_limits(request_counts, token_counts)
+        run_length = int(np.argmax(exceeded)) if exceeded.any() else end - start
+
+        accepted_end = start + run_length
+        if run_length > 0:
+            result = self.result
+            result.accepted[start:accepted_end] = True
+            result.remaining_requests[start:accepted_end] = self.request_limit - request_counts[:run_length]
+            if self.tokens_per_minute is not None:
+                result.remaining_tokens[start:accepted_end] = self.tokens_per_minute - token_counts[:run_length]
+
+            count = self.accepted_count
+            self.accepted_timestamps[count : count + run_length] = timestamps[:run_length]
+            self.accepted_tokens[count + 1 : count + run_length + 1] = self.accepted_tokens[count] + (
+                self.trace_tokens[start + 1 : accepted_end + 1] - self.trace_tokens[start]
+            )
+            self.accepted_count += run_length
+        return accepted_end
+
+    def _throttle_run(self, start: int, end: int) -> int:
+        """
+        Throttles requests from start until the first request that fits within the limits
+        (the accepted history doesn't change as throttled requests don't count towards the limits).
+        Returns the index of the first request not throttled
+        """
+        timestamps = self.timestamps[start:end]
+        token_costs = self.token_costs[start:end]
+        heads, request_counts, token_counts = self._history_counts(timestamps)
+        exceeded = self._exceeds_limits(request_counts + 1, token_counts + token_costs)
+        run_length = int(np.argmin(exceeded)) if not exceeded.all() else end - start
+        if run_length > 0:
+            self._set_retry_after(
+                start,
+                timestamps[:run_length],
+                token_costs[:run_length],
+                heads[:run_length],
+            )
+        return start + run_length
+
+    def _set_retry_after(self, start: int, timestamps: np.ndarray, token_costs: np.ndarray, heads: np.ndarray):
+        # This follows the retry calculation in TokensPerMinuteSlidingWindow.add_request
+        # (and is equivalent to the calculation in RequestsPerMinuteSlidingWindow.add_request)
+        count = self.accepted_count
+        history = self.accepted_timestamps[:count]
+
+        needed = self.requests_needed_for_full
+        requests_full_times = np.full(len(timestamps), -np.inf)
+        if count >= needed:
+            requests_full_times[count - heads >= needed] = history[count - needed]
+
+        tokens_full_times = np.full(len(timestamps), -np.inf)
+        if self.tokens_per_minute is not None and count > 0:
+            # we're full at the first request i where token_cost + tokens(i..newest) > tokens_per_minute
+            targets = self.accepted_tokens[count] + token_costs - self.tokens_per_minute
+            full_indices = np.maximum(np.searchsorted(self.accepted_tokens[:count], targets, side="left"), heads) - 1
+            has_full_index = full_indices >= heads
+            tokens_full_times[has_full_index] = history[full_indices[has_full_index]]
+
+        time_to_reset_requests = self.request_window_seconds - (timestamps - requests_full_times)
+        time_to_reset_tokens = 60 - (timestamps - tokens_full_times)
+
+        is_requests = time_to_reset_requests > time_to_reset_tokens
+        time_to_reset = np.where(is_requests, time_to_reset_requests, time_to_reset_tokens)
+        # If a request exceeds the limit on its own then there is nothing to wait for in the window
+        # so use the full window duration
+        time_to_reset[np.isneginf(time_to_reset)] = 60
+
+        end = start + len(timestamps)
+        self.result.retry_after[start:end] = np.ceil(time_to_reset)
+        self.result.retry_reason[start:end] = np.where(is_requests, RETRY_REASON_REQUESTS, RETRY_REASON_TOKENS)
+
+    def run(self) -> CapacityResult:
+        count = len(self.timestamps)
+        position = 0
+        accept_run_size = _min_run_size
+        throttle_run_size = _min_run_size
+        while position < count:
+            end = min(position + accept_run_size, count)
+            new_position = self._accept_run(position, end)
+            accept_run_size = _next_run_size(accept_run_size, new_position - position, end - position)
+            position = new_position
+            if position >= count or new_position == end:
+                continue
+
+            end = min(position + throttle_run_size, count)
+            new_position = self._throttle_run(position, end)
+            throttle_run_size = _next_run_size(throttle_run_size, new_position - position, end - position)
+            position = new_position
+        return self.result
+
+
+def _next_run_size(run_size: int, run_length: int, available: int) -> int:
+    if run_length == available:
+        # the whole run was used, so try a longer run next time
+        return min(run_size * 2, _max_run_size)
+    return max(_min_run_size, min(run_length * 2, _max_run_size))
+
+
+def _validate_trace(timestamps, token_costs) -> tuple[np.ndarray, np.ndarray]:
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    token_costs = np.asarray(token_costs, dtype=np.int64)
+    if timestamps.shape != token_costs.shape:
+        raise ValueError("timestamps and token_costs must be the same length")
+    if len(timestamps) > 1 and np.any(np.diff(timestamps) < 0):
+        raise ValueError("timestamps must be in ascending order")
+    return timestamps, token_costs
+
+
+def simulate_tokens_window(timestamps, token_costs, tokens_per_minute: int) -> CapacityResult:
+    """
+    Simulates a deployment that is rate-limited by tokens-per-minute (and requests-per-10-seconds)
+    using the same rules as TokensPerMinuteSlidingWindow.
+    timestamps must be in ascending order
+    """
+    timestamps, token_costs = _validate_trace(timestamps, token_costs)
+    requests_per_10_seconds = math.ceil(tokens_per_minute / 1000)  # as in OpenAITokensLimiter
+    return _WindowSimulator(
+        timestamps,
+        token_costs,
+        tokens_per_minute=tokens_per_minute,
+        request_limit=requests_per_10_seconds,
+        request_window_seconds=10,
+    ).run()
+
+
+def simulate_requests_window(timestamps, requests_per_minute: int) -> CapacityResult:
+    """
+    Simulates a deployment that is rate-limited by requests-per-minute
+    using the same rules as RequestsPerMinuteSlidingWindow.
+    timestamps must be in ascending order
+    """
+    timestamps, token_costs = _validate_trace(timestamps, np.zeros(len(timestamps), dtype=np.int64))
+    return _WindowSimulator(
+        timestamps,
+        token_costs,
+        tokens_per_minute=None,
+        request_limit=requests_per_minute,
+        request_window_seconds=60,
+    ).run()
+
+
+def load_trace(path: str):
+    """
+    Loads a trace from a CSV or Parquet file with timestamp, deployment and token_cost columns
+    """
+    # pylint: disable-next=import-outside-toplevel
+    import pandas as pd
+
+    if path.endswith(".parquet"):
+        trace = pd.read_parquet(path)
+    else:
+        trace = pd.read_csv(path)
+    missing = {"timestamp", "deployment", "token_cost"} - set(trace.columns)
+    if missing:
+        raise ValueError(f"Trace is missing columns: {', '.join(sorted(missing))}")
+    return trace
+
+
+def load_deployments(path: str) -> dict[str, dict]:
+    """
+    Loads deployments from a JSON file in the same format as OPENAI_DEPLOYMENT_CONFIG_PATH
+    """
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def simulate_trace(trace, deployments: dict[str, dict]):
+    """
+    Simulates each deployment in the trace and returns the trace (ordered by timestamp)
+    with accepted, retry_after, retry_reason, remaining_tokens and remaining_requests columns added
+    """
+    trace = trace.sort_values("timestamp", kind="stable").reset_index(drop=True)
+    columns = {
+        "accepted": np.zeros(len(trace), dtype=bool),
+        "retry_after": np.full(len(trace), np.nan),
+        "retry_reason": np.full(len(trace), "", dtype=object),
+        "remaining_tokens": np.full(len(trace), np.nan),
+        "remaining_requests": np.full(len(trace), np.nan),
+    }
+    for deployment_name, indices in trace.groupby("deployment", sort=False).indices.items():
+        deployment = deployments.get(deployment_name)
+        if deployment is None:
+            print(f"Deployment {deployment_name} not in deployment config - requests are not rate-limited")
+            columns["accepted"][indices] = True
+            continue
+
+        timestamps = trace["timestamp"].to_numpy()[indices]
+        tokens_per_minute = int(deployment.get("tokensPerMinute", 0))
+        if tokens_per_minute > 0:
+            result = simulate_tokens_window(timestamps, trace["token_cost"].to_numpy()[indices], tokens_per_minute)
+        else:
+            result = simulate_requests_window(timestamps, int(deployment.get("requestsPerMinute", 0)))
+
+        columns["accepted"][indices] = result.accepted
+        columns["retry_after"][indices] = result.retry_after
+        columns["retry_reason"][indices] = np.array(list(_retry_reason_names.values()), dtype=object)[
+            result.retry_reason
+        ]
+        columns["remaining_tokens"][indices] = result.remaining_tokens
+        columns["remaining_requests"][indices] = result.remaining_requests
+
+    return trace.assign(**columns)
+
+
+def verify_against_limiter(trace, deployments: dict[str, dict]) -> int:
+    """
+    Replays the trace through the simulator's window classes (one request at a time)
+    and returns the number of requests where the result differs from the simulated trace
+    """
+    # pylint: disable-next=import-outside-toplevel
+    from aoai_api_simulator.limiters import RequestsPerMinuteSlidingWindow, TokensPerMinuteSlidingWindow
+
+    windows = {}
+    for name, deployment in deployments.items():
+        tokens_per_minute = int(deployment.get("tokensPerMinute", 0))
+        if tokens_per_minute > 0:
+            windows[name] = TokensPerMinuteSlidingWindow(
+                requests_per_10_seconds=math.ceil(tokens_per_minute / 1000), tokens_per_minute=tokens_per_minute
+            )
+        else:
+            windows[name] = RequestsPerMinuteSlidingWindow(int(deployment.get("requestsPerMinute", 0)))
+
+    mismatches = 0
+    for row in trace.itertuples(index=False):
+        window = windows.get(row.deployment)
+        if window is None:
+            continue
+        try:
+            if isinstance(window, TokensPerMinuteSlidingWindow):
+                expected = window.add_request(token_cost=int(row.token_cost), timestamp=float(row.timestamp))
+            else:
+                expected = window.add_request(timestamp=float(row.timestamp))
+        except (OverflowError, ValueError):
+            # The window can't calculate a retry-after value for a request that exceeds the limit
+            # on its own (e.g. a token cost greater than tokens-per-minute with no other requests in the window)
+            continue
+        if expected.success != row.accepted or (
+            not expected.success
+            and (expected.retry_after != row.retry_after or expected.retry_reason != row.retry_reason)
+        ):
+            mismatches += 1
+    return mismatches
+
+
+def _print_summary(simulated_trace):
+    print(f"{'Deployment':<32} {'Requests':>10} {'Accepted':>10} {'Throttled':>10} {'Accepted tokens/min':>20}")
+    for deployment_name, group in simulated_trace.groupby("deployment", sort=True):
+        accepted = group[group["accepted"]]
+        duration_minutes = max((group["timestamp"].max() - group["timestamp"].min()) / 60, 1 / 60)
+        tokens_per_minute = accepted["token_cost"].sum() / duration_minutes
+        throttled = len(group) - len(accepted)
+        print(
+            f"{deployment_name:<32} {len(group):>10} {len(accepted):>10} "
+            + f"{throttled:>10} {tokens_per_minute:>20.0f}"
+        )
+
+
+def main(args: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Simulate the rate-limiting of a traffic trace")
+    parser.add_argument("trace", help="CSV or Parquet file with timestamp, deployment and token_cost columns")
+    parser.add_argument(
+        "--deployments",
+        required=True,
+        help="Deployment config JSON file (same format as OPENAI_DEPLOYMENT_CONFIG_PATH)",
+    )
+    parser.add_argument("--output", help="CSV or Parquet file to write the per-request results to")
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Cross-check the results against the simulator's rate-limit windows (slow for large traces)",
+    )
+    parsed_args = parser.parse_args(args)
+
+    trace = load_trace(parsed_args.trace)
+    deployments = load_deployments(parsed_args.deployments)
+    simulated_trace = simulate_trace(trace, deployments)
+    _print_summary(simulated_trace)
+
+    if parsed_args.output:
+        if parsed_args.output.endswith(".parquet"):
+            simulated_trace.to_parquet(parsed_args.output, index=False)
+        else:
+            simulated_trace.to_csv(parsed_args.output, index=False)
+
+    if parsed_args.verify:
+        mismatches = verify_against_limiter(simulated_trace, deployments)
+        print(f"Verification against the simulator's rate-limit windows: {mismatches} mismatches")
+        if mismatches:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""
+Recording converter
+
+Converts the YAML recording files in a recording directory (RECORDING_FORMAT=yaml) to:
+ - the indexed recording format (--format indexed, RECORDING_FORMAT=indexed), which is opened without parsing
+   the recording and loads responses on demand. Each <recording>.yaml file is converted to <recording>.dat
+   and <recording>.idx files in the output directory
+ - the SQLite recording format (--format sqlite, RECORDING_FORMAT=sqlite), which can be queried with SQL.
+   All recordings are added to the recordings.sqlite database in the output directory
+
+Recordings with an uncompacted autosave journal (<recording>.yaml.journal) should be saved first
+(e.g. by stopping the simulator or calling /++/save-recordings).
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+
+from aoai_api_simulator.record_replay.indexed_persistence import write_indexed_recording
+from aoai_api_simulator.record_replay.persistence import JOURNAL_SUFFIX, YamlRecordingPersister
+from aoai_api_simulator.record_replay.sqlite_persistence import SqliteRecordingPersister
+from fastapi.datastructures import URL
+
+
+def convert_recording_dir(input_dir: str, output_dir: str, output_format: str) -> int:
+    """
+    Converts the YAML recordings in input_dir to the output format in output_dir
+    and returns the number of recordings converted
+    """
+    yaml_persister = YamlRecordingPersister(input_dir)
+    sqlite_persister = SqliteRecordingPersister(output_dir) if output_format == "sqlite" else None
+    os.makedirs(output_dir, exist_ok=True)
+
+    recording_paths = sorted(glob.glob(os.path.join(input_dir, "*.yaml")))
+    for recording_path in recording_paths:
+        if os.path.exists(recording_path + JOURNAL_SUFFIX):
+            print(f"⚠️ Skipping the uncompacted journal for {recording_path}", file=sys.stderr)
+
+        start_time = time.perf_counter()
+        recording = yaml_persister.load_recording_file(recording_path)
+        if sqlite_persister:
+            # the recordings are keyed on the URL path in the database
+            recorded_responses_by_url = {}
+            for recorded_response in recording.values():
+                url = URL(recorded_response.full_request["uri"]).path
+                recorded_responses_by_url.setdefault(url, []).append(recorded_response)
+            for url, recorded_responses in recorded_responses_by_url.items():
+                sqlite_persister.insert_recorded_responses(url, recorded_responses)
+            output_path = sqlite_persister.get_database_path()
+        else:
+            output_path = os.path.join(output_dir, os.path.basename(recording_path).removesuffix(".yaml"))
+            write_indexed_recording(output_path, recording.values())
+        duration = time.perf_counter() - start_time
+        print(f"Converted {recording_path} ({len(recording)} responses) to {output_path} in {duration:.2f}s")
+
+    if sqlite_persister:
+        sqlite_persister.close()
+    return len(recording_paths)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input_dir", help="Directory containing the YAML recording files")
+    parser.add_argument(
+        "output_dir", nargs="?", help="Directory to write the converted recording files to (defaults to input_dir)"
+    )
+    parser.add_argument("--format", choices=["indexed", "sqlite"], default="indexed", help="Recording format")
+    args = parser.parse_args()
+
+    count = convert_recording_dir(args.input_dir, args.output_dir or args.input_dir, args.format)
+    print(f"Converted {count} recordings")
+
+
+if __name__ == "__main__":
+    main()
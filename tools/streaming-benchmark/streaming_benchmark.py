@@ -0,0 +1,95 @@
+"""
+Streaming chunk serialization benchmark
+
+Compares the CPU time per chunk for serializing streamed chat completion chunks by building and serializing
+the full chunk (with a new id) for each chunk against splicing the content into a pre-serialized template
+(see ChatCompletionChunkTemplate).
+"""
+
+import argparse
+import json
+import time
+
+import nanoid
+from aoai_api_simulator.generator.openai_streaming import ChatCompletionChunkTemplate
+
+_words = "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore".split()
+
+
+def _serialize_full_chunk(model_name: str, content: str, role: str | None) -> bytes:
+    # serializes the chunk in the same way as the streaming generator before chunk templates were used
+    chunk_string = json.dumps(
+        {
+            "id": "chatcmpl-" + nanoid.non_secure_generate(size=29),
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model_name": model_name,
+            "system_fingerprint": None,
+            "choices": [
+                {
+                    "delta": {
+                        "content": content,
+                        "function_call": None,
+                        "role": role,
+                        "tool_calls": None,
+                        "finish_reason": None,
+                        "index": 0,
+                        "logprobs": None,
+                        "content_filter_results": {
+                            "hate": {"filtered": False, "severity": "safe"},
+                            "self_harm": {"filtered": False, "severity": "safe"},
+                            "sexual": {"filtered": False, "severity": "safe"},
+                            "violence": {"filtered": False, "severity": "safe"},
+                        },
+                    },
+                },
+            ],
+        }
+    )
+    return ("data: " + chunk_string + "\n\n").encode("utf-8")
+
+
+def benchmark_full_chunks(model_name: str, streams: int, chunks_per_stream: int) -> float:
+    start_time = time.perf_counter()
+    for _ in range(streams):
+        role = "assistant"
+        for index in range(chunks_per_stream):
+            _serialize_full_chunk(model_name, " " + _words[index % len(_words)], role)
+            role = None
+    return time.perf_counter() - start_time
+
+
+def benchmark_chunk_templates(model_name: str, streams: int, chunks_per_stream: int) -> float:
+    start_time = time.perf_counter()
+    for _ in range(streams):
+        # the template is created once per response
+        template = ChatCompletionChunkTemplate(model_name)
+        for index in range(chunks_per_stream):
+            template.content_chunk(" " + _words[index % len(_words)], is_first=index == 0)
+    return time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=1000, help="Number of streamed responses to serialize")
+    parser.add_argument("--chunks", type=int, default=200, help="Number of chunks per streamed response")
+    parser.add_argument("--model", default="gpt-3.5-turbo", help="Model name to include in the chunks")
+    args = parser.parse_args()
+
+    total_chunks = args.streams * args.chunks
+    results = {
+        "full chunk per token": benchmark_full_chunks(args.model, args.streams, args.chunks),
+        "chunk templates": benchmark_chunk_templates(args.model, args.streams, args.chunks),
+    }
+
+    print(f"Serialized {total_chunks} chunks ({args.streams} streams x {args.chunks} chunks)")
+    baseline = results["full chunk per token"]
+    for name, duration in results.items():
+        print(
+            f"  {name:<22}: {duration:.3f}s ({duration / total_chunks * 1e6:.2f}us per chunk, "
+            + f"{baseline / duration:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()